@@ -1,13 +1,104 @@
+import datetime
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from .models import Post, PostImage, OutboxMessage
+from . import search, related
+
+
+# Columns the changelist never shows
+CHANGELIST_DEFERRED = ('body', 'body_html', 'excerpt')
+
+
+def count_limit():
+    return getattr(settings, 'BLOG_ADMIN_COUNT_LIMIT', 1000)
+
+
+def inline_image_limit():
+    return getattr(settings, 'BLOG_ADMIN_INLINE_IMAGES', 50)
+
+
+def date_range(year, month=None, day=None):
+    """[start, end) of a year, month or day in the current time zone."""
+    start = datetime.datetime(year, month or 1, day or 1)
+    if day:
+        end = start + datetime.timedelta(days=1)
+    elif month:
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        end = start.replace(year=year + 1)
+    if settings.USE_TZ:
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
+
+
+class CappedPaginator(Paginator):
+    """
+    Counts at most count_limit() + 1 rows, so a changelist page costs the
+    same on a large table; pages past the limit aren't linked.
+    """
+    @cached_property
+    def count(self):
+        try:
+            return self.object_list.order_by()[:count_limit() + 1].count()
+        except (AttributeError, TypeError):
+            return len(self.object_list)
+
+    @property
+    def capped(self):
+        return self.count > count_limit()
+
 
-from .models import Post, PostImage
+class RangeDateChangeList(ChangeList):
+    """
+    ChangeList that filters the date hierarchy with a range on the column
+    (field__gte/field__lt) instead of extracting the year, month and day
+    of every row, and loads no CHANGELIST_DEFERRED columns.
+    """
+    def get_filters_params(self, params=None):
+        lookup_params = super(RangeDateChangeList, self).get_filters_params(params)
+        field = self.date_hierarchy
+        if not field:
+            return lookup_params
+        parts = []
+        for level, part in enumerate(('year', 'month', 'day')):
+            value = lookup_params.pop('{}__{}'.format(field, part), None)
+            # A month counts only with its year, a day with its month
+            if value is not None and len(parts) == level:
+                parts.append(value)
+        if parts:
+            try:
+                start, end = date_range(*[int(part) for part in parts])
+            except (ValueError, OverflowError) as e:
+                raise IncorrectLookupParameters(e)
+            lookup_params['{}__gte'.format(field)] = start
+            lookup_params['{}__lt'.format(field)] = end
+        return lookup_params
+
+    def get_queryset(self, request):
+        queryset = super(RangeDateChangeList, self).get_queryset(request)
+        return queryset.defer(*CHANGELIST_DEFERRED)
+
+    def get_results(self, request):
+        super(RangeDateChangeList, self).get_results(request)
+        self.count_capped = getattr(self.paginator, 'capped', False)
+        self.count_limit = count_limit()
 
 
-class InlineImage(admin.StackedInline):
+class InlineImage(admin.TabularInline):
     """
     Allows to upload image on the same page as a parent model"
     """
     model = PostImage
+    fields = ('image', 'image_title', 'image_author', 'image_description')
     # Controls the number of extra forms fields
     extra = 0
 
@@ -15,14 +106,77 @@ class InlineImage(admin.StackedInline):
 class PostAdmin(admin.ModelAdmin):
     list_display = ('title', 'slug', 'author',
                     'publish', 'status')
-    list_filter = ('status', 'created', 'publish', 'author')
-    search_fields = ('title', 'body')
+    # Only filters on indexed columns; publish dates through date_hierarchy
+    list_filter = ('status', 'author')
+    # Searches go through the full-text index, see get_search_results()
+    search_fields = ('title',)
     # automatically generate the value for slug
     prepopulated_fields = {'slug': ('title',)}
     raw_id_fields = ('author',)
+    readonly_fields = ('images',)
+    # Drilled down with range queries, see blog/templates/admin/blog/post/change_list.html
     date_hierarchy = 'publish'
-    ordering = ['status', 'publish']
+    # Follows blog_post_status_publish_idx (the changelist adds -pk)
+    ordering = ['status', '-publish']
     inlines = [InlineImage]
+    paginator = CappedPaginator
+    # No unfiltered COUNT(*) next to the filtered one
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return RangeDateChangeList
+
+    def changeform_view(self, request, *args, **kwargs):
+        # The post and then its tags are saved; rank the post once
+        with related.deferred_updates():
+            return super(PostAdmin, self).changeform_view(request, *args, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        return search.filter_queryset(queryset, search_term), False
+
+    def image_count(self, obj):
+        if obj is None or obj.pk is None:
+            return 0
+        if not hasattr(obj, '_image_count'):
+            obj._image_count = obj.postimage_set.count()
+        return obj._image_count
+
+    def get_inline_instances(self, request, obj=None):
+        # Posts with many images link to their images instead of loading
+        # a form for each
+        if self.image_count(obj) > inline_image_limit():
+            return []
+        return super(PostAdmin, self).get_inline_instances(request, obj)
+
+    def images(self, obj):
+        count = self.image_count(obj)
+        if not count:
+            return '-'
+        url = '{}?post__id__exact={}'.format(reverse('admin:blog_postimage_changelist'), obj.pk)
+        return format_html('<a href="{}">{} image{}</a>', url, count, '' if count == 1 else 's')
 
 admin.site.register(Post, PostAdmin)
 
+
+class PostImageAdmin(admin.ModelAdmin):
+    list_display = ('image_title', 'image_author', 'post', 'image_created')
+    search_fields = ('image_title',)
+    raw_id_fields = ('post',)
+    paginator = CappedPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super(PostImageAdmin, self).get_queryset(request)\
+            .select_related('post')\
+            .defer(*['post__{}'.format(name) for name in CHANGELIST_DEFERRED])
+
+admin.site.register(PostImage, PostImageAdmin)
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'from_email', 'created',
+                    'attempts', 'sent')
+    list_filter = ('sent',)
+    readonly_fields = ('created', 'attempts', 'sent', 'last_error')
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
@@ -0,0 +1,207 @@
+"""
+Posts as JSON Lines, one post with its tags and images per line, read
+and written in batches so memory use doesn't grow with the archive.
+Used by the export_posts and import_posts management commands.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag
+
+from .cache import bump_content_version
+from .models import Post, PostImage, TaggedPost
+from .storage import referenced_media_names
+from .tagstats import refresh_tag_stats
+from . import search, related
+
+
+def serialize_post(post):
+    return {
+        'title': post.title,
+        'subtitle': post.subtitle,
+        'slug': post.slug,
+        'author': post.author.username,
+        'body': post.body,
+        'publish': post.publish.isoformat(),
+        'created': post.created.isoformat(),
+        'updated': post.updated.isoformat(),
+        'status': post.status,
+        'tags': sorted(tag.name for tag in post.tags.all()),
+        'images': [{'file': image.image.name,
+                    'width': image.width,
+                    'height': image.height,
+                    'title': image.image_title,
+                    'author': image.image_author,
+                    'description': image.image_description}
+                   for image in post.postimage_set.all()],
+    }
+
+
+def media_names(record):
+    """Media files a serialized post needs: its images and those in its body."""
+    names = {image['file'] for image in record['images']}
+    names.update(unquote(name) for name in referenced_media_names(record['body']))
+    return names
+
+
+def export_posts(stream, batch_size=500, statuses=None):
+    """
+    Write every post to stream as one JSON object per line, walking the
+    table by primary key. Yields the media file names the posts use, so
+    the caller can copy them alongside.
+    """
+    queryset = Post.objects.select_related('author').prefetch_related('tags', 'postimage_set')
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        for post in batch:
+            record = serialize_post(post)
+            stream.write(json.dumps(record, sort_keys=True) + '\n')
+            for name in media_names(record):
+                yield name
+        last_pk = batch[-1].pk
+
+
+def copy_media(names, source, target, workers=4):
+    """
+    Copy media files by name from source to target (storages) in a thread
+    pool. Returns {old name: new name}; a content-addressed target may
+    store a file under a different name. Missing files are left out.
+    """
+    def copy(name):
+        if not source.exists(name):
+            return name, None
+        if target.exists(name):
+            return name, name
+        with source.open(name) as source_file:
+            return name, target.save(name, File(source_file))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {old: new for old, new in executor.map(copy, sorted(names)) if new is not None}
+
+
+def _rename_media(body, renamed):
+    for old, new in renamed.items():
+        if old != new:
+            body = body.replace(settings.MEDIA_URL + old, settings.MEDIA_URL + new)
+    return body
+
+
+class PostImporter(object):
+    """
+    Load serialized posts in batches with bulk_create, bypassing the
+    per-row signals. Posts already in the database (same slug and
+    publish time) are skipped, so an interrupted import can simply be
+    run again. Tag statistics, related posts and the cache version are
+    updated once at the end of every run; the search index per batch.
+    """
+    def __init__(self, media_source=None, workers=4):
+        self.media_source = media_source
+        self.workers = workers
+        self.users = {}
+        self.tags = {}
+        self.renamed = {}
+        self.imported = 0
+        self.skipped = 0
+
+    def get_users(self, usernames):
+        missing = set(usernames) - set(self.users)
+        if missing:
+            for user in User.objects.filter(username__in=missing):
+                self.users[user.username] = user
+            for username in missing - set(self.users):
+                user = User(username=username)
+                user.set_unusable_password()
+                user.save()
+                self.users[username] = user
+        return self.users
+
+    def get_tags(self, names):
+        missing = set(names) - set(self.tags)
+        if missing:
+            for tag in Tag.objects.filter(name__in=missing):
+                self.tags[tag.name] = tag.pk
+            for name in missing - set(self.tags):
+                # One at a time, taggit picks a unique slug
+                self.tags[name] = Tag.objects.create(name=name).pk
+        return self.tags
+
+    def import_batch(self, records):
+        existing = set(Post.objects.filter(slug__in={record['slug'] for record in records})
+                                   .values_list('slug', 'publish'))
+        count = len(records)
+        records = [record for record in records
+                   if (record['slug'], parse_datetime(record['publish'])) not in existing]
+        self.skipped += count - len(records)
+        if not records:
+            return
+        if self.media_source is not None:
+            names = set().union(*[media_names(record) for record in records]) - set(self.renamed)
+            self.renamed.update(copy_media(names, self.media_source, default_storage, self.workers))
+
+        users = self.get_users({record['author'] for record in records})
+        tags = self.get_tags({name for record in records for name in record['tags']})
+        with transaction.atomic():
+            posts = []
+            for record in records:
+                post = Post(title=record['title'], subtitle=record['subtitle'], slug=record['slug'],
+                            author=users[record['author']],
+                            body=_rename_media(record['body'], self.renamed),
+                            publish=parse_datetime(record['publish']), status=record['status'])
+                post.update_derived_fields()
+                post.update_schedule()
+                posts.append(post)
+            Post.objects.bulk_create(posts)
+            # bulk_create doesn't return primary keys on every backend
+            keys = {(slug, publish): pk for pk, slug, publish in
+                    Post.objects.filter(slug__in=[post.slug for post in posts])
+                                .values_list('pk', 'slug', 'publish')}
+            tagged = []
+            images = []
+            for record in records:
+                pk = keys[(record['slug'], parse_datetime(record['publish']))]
+                # auto_now and auto_now_add can't be set through bulk_create
+                Post.objects.filter(pk=pk).update(created=parse_datetime(record['created']),
+                                                  updated=parse_datetime(record['updated']))
+                tagged.extend(TaggedPost(tag_id=tags[name], content_object_id=pk)
+                              for name in set(record['tags']))
+                images.extend(PostImage(post_id=pk, image=self.renamed.get(image['file'], image['file']),
+                                        width=image['width'], height=image['height'],
+                                        image_title=image['title'], image_author=image['author'],
+                                        image_description=image['description'])
+                              for image in record['images'])
+            TaggedPost.objects.bulk_create(tagged)
+            PostImage.objects.bulk_create(images)
+            backend = search.get_backend()
+            for post in Post.objects.filter(pk__in=keys.values()).prefetch_related('tags'):
+                backend.index(post)
+        self.imported += len(records)
+
+    def run(self, stream, batch_size=500):
+        batch = []
+        for line in stream:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                self.import_batch(batch)
+                batch = []
+                yield self.imported, self.skipped
+        if batch:
+            self.import_batch(batch)
+            yield self.imported, self.skipped
+        # Even when every post was skipped: the run that imported them may
+        # have stopped before getting here
+        refresh_tag_stats()
+        related.rebuild()
+        bump_content_version()
+
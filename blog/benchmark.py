@@ -0,0 +1,571 @@
+"""
+Synthetic dataset and request driver behind the seed_benchmark_data and
+run_benchmark management commands. Requests go through the test client
+in-process, so the numbers cover Django and the database, not a web server.
+"""
+import datetime
+import gc
+import json
+import math
+import multiprocessing
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection, connections, transaction
+from django.template import Engine
+from django.template.loader import get_template
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, get_resolver
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+from taggit.models import Tag
+
+from .models import Post, PostImage, TaggedPost, TagStat
+from .pagination import KeysetPaginator, encode_cursor
+from .sitemaps import shard_size
+from . import sitemaps
+from .sqlite import pragmas
+
+
+BENCH_USERNAME = 'benchmark'
+WORDS = ('python django query index cache template static request response database '
+         'server latency throughput cursor page tag feed sitemap image search profile '
+         'memory thread process worker queue test deploy nginx gunicorn sqlite').split()
+BATCH_SIZE = 1000
+# Templates every page includes, see run_render_benchmark
+CHROME_TEMPLATES = ('blog/navigation.html', 'blog/header.html', 'blog/footer.html',
+                    'blog/pagination.html')
+ROUNDS = 5
+# Django's own middleware in place of the Lean* ones, see run_middleware_benchmark
+STOCK_MIDDLEWARE = {
+    'blog.middleware.LeanSessionMiddleware': 'django.contrib.sessions.middleware.SessionMiddleware',
+    'blog.middleware.LeanCsrfViewMiddleware': 'django.middleware.csrf.CsrfViewMiddleware',
+    'blog.middleware.LeanAuthenticationMiddleware': 'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'blog.middleware.LeanMessageMiddleware': 'django.contrib.messages.middleware.MessageMiddleware',
+}
+# What the post list page, the feeds and a sitemap shard load, with every
+# column (summary=False) and as served (summary=True), see projection_memory
+PROJECTION_PAGES = OrderedDict([
+    ('post_list', lambda summary, shard: _published(summary).select_related('author')
+                                                            .prefetch_related('tags')[:5]),
+    ('feed', lambda summary, shard: _published(summary)[:3]),
+    ('sitemap', lambda summary, shard: (sitemaps.shard_rows(shard) if summary
+                                        else sitemaps.shard_queryset(shard).order_by('pk'))),
+])
+# SQLite's own defaults, what run_sqlite_benchmark compares BLOG_SQLITE_PRAGMAS to
+SQLITE_BASELINE_PRAGMAS = OrderedDict([('journal_mode', 'delete'), ('synchronous', 'full')])
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _body(rng, paragraphs):
+    parts = []
+    for index in range(paragraphs):
+        parts.append('<p>{}.</p>'.format(_sentence(rng, rng.randint(40, 120))))
+        if index % 3 == 1:
+            parts.append('<pre><code class="language-python">def f(x):\n    return x * {}\n</code></pre>'.format(
+                rng.randint(1, 99)))
+    return '\n'.join(parts)
+
+
+def _image_file(rng, width, height):
+    content = BytesIO()
+    color = tuple(rng.randint(0, 255) for _ in range(3))
+    Image.new('RGB', (width, height), color).save(content, 'JPEG', quality=80)
+    return ContentFile(content.getvalue())
+
+
+def seed_dataset(posts=100000, tags=5000, images=20, seed=1, draft_ratio=0.1, stdout=None):
+    """
+    Create a reproducible synthetic blog: the same arguments always give
+    the same posts, tags and images. Posts are bulk inserted, so derived
+    fields are computed here and the search index and tag statistics are
+    rebuilt afterwards instead of by signals.
+    """
+    rng = random.Random(seed)
+    author, created = User.objects.get_or_create(username=BENCH_USERNAME,
+                                                 defaults={'is_staff': True, 'is_superuser': True})
+    if not created and author.blog_posts.exists():
+        raise ValueError('Benchmark data already exists, use a fresh database.')
+    author.set_password(BENCH_USERNAME)
+    author.save()
+
+    tag_objects = Tag.objects.bulk_create(
+        [Tag(name='{} {}'.format(rng.choice(WORDS), index), slug='bench-tag-{}'.format(index))
+         for index in range(tags)])
+    tag_ids = list(Tag.objects.filter(slug__startswith='bench-tag-').order_by('pk')
+                                .values_list('pk', flat=True))
+    # Zipf-like popularity, so some tags have thousands of posts and most a few
+    tag_weights = [1.0 / (rank + 1) for rank in range(len(tag_objects))]
+
+    image_names = []
+    for index in range(images):
+        width = rng.choice((800, 1200, 1920))
+        name = default_storage.save('images/bench-{}.jpg'.format(index),
+                                    _image_file(rng, width, width * 9 // 16))
+        image_names.append((name, width, width * 9 // 16))
+
+    start = timezone.now() - datetime.timedelta(days=10 * 365)
+    step = datetime.timedelta(days=10 * 365) / max(posts, 1)
+    for offset in range(0, posts, BATCH_SIZE):
+        batch = []
+        for index in range(offset, min(offset + BATCH_SIZE, posts)):
+            title = _sentence(rng, rng.randint(3, 9))
+            post = Post(title=title,
+                        subtitle=_sentence(rng, rng.randint(5, 12)),
+                        slug=slugify('{} {}'.format(title, index))[:200],
+                        author=author,
+                        body=_body(rng, rng.randint(3, 15)),
+                        publish=start + step * index,
+                        status='draft' if rng.random() < draft_ratio else 'published')
+            post.update_derived_fields()
+            batch.append(post)
+        with transaction.atomic():
+            Post.objects.bulk_create(batch)
+            # Primary keys aren't set by bulk_create on every backend
+            created_posts = list(Post.objects.filter(author=author)
+                                             .order_by('-pk')
+                                             .values_list('pk', flat=True)[:len(batch)])
+            tagged = []
+            post_images = []
+            for post_pk in created_posts:
+                for tag_pk in set(rng.choices(tag_ids, tag_weights, k=rng.randint(1, 5))):
+                    tagged.append(TaggedPost(tag_id=tag_pk, content_object_id=post_pk))
+                if image_names:
+                    name, width, height = rng.choice(image_names)
+                    post_images.append(PostImage(post_id=post_pk, image=name, width=width,
+                                                 height=height, image_title='Benchmark',
+                                                 image_author=BENCH_USERNAME))
+            TaggedPost.objects.bulk_create(tagged)
+            PostImage.objects.bulk_create(post_images)
+        if stdout:
+            stdout.write('Created {} posts'.format(min(offset + BATCH_SIZE, posts)))
+
+
+def route_names():
+    """Names of every named URL pattern, with their namespace."""
+    names = set()
+
+    def walk(resolver, prefix):
+        for pattern in resolver.url_patterns:
+            if hasattr(pattern, 'url_patterns'):
+                namespace = pattern.namespace
+                walk(pattern, prefix + namespace + ':' if namespace else prefix)
+            elif pattern.name:
+                names.add(prefix + pattern.name)
+    walk(get_resolver(), '')
+    return names
+
+
+def routes(samples=20, seed=1):
+    """
+    Benchmark routes as (label, url name, list of paths, needs login).
+    Paths of a route are requested in turn, so detail and tag pages hit
+    different rows instead of one hot row.
+    """
+    rng = random.Random(seed)
+    published = Post.published.order_by('-publish', '-id')
+    count = published.count()
+    if not count:
+        raise ValueError('No published posts, run `manage.py seed_benchmark_data` first.')
+    sample_posts = [published[rng.randrange(count)] for _ in range(samples)]
+    deep_post = published[count * 9 // 10]
+    tags = list(Tag.objects.filter(blog_stat__isnull=False).order_by('-blog_stat__post_count', 'pk'))
+    if not tags:
+        raise ValueError('No tagged posts, run `manage.py rebuild_tag_stats`.')
+    popular, rare = tags[0], tags[-1]
+    search_word = rng.choice(WORDS)
+    shard = (Post.published.order_by('-pk').values_list('pk', flat=True).first() - 1) // shard_size()
+    deep_page = max(1, count // 5 * 9 // 10)
+
+    return [
+        ('post_list', 'blog:post_list', [reverse('blog:post_list')], False),
+        ('post_list_deep_page', 'blog:post_list',
+         ['{}?page={}'.format(reverse('blog:post_list'), deep_page)], False),
+        ('post_list_deep_cursor', 'blog:post_list',
+         ['{}?after={}'.format(reverse('blog:post_list'), encode_cursor(deep_post))], False),
+        ('post_list_by_tag_popular', 'blog:post_list_by_tag',
+         [reverse('blog:post_list_by_tag', args=[popular.slug])], False),
+        ('post_list_by_tag_rare', 'blog:post_list_by_tag',
+         [reverse('blog:post_list_by_tag', args=[rare.slug])], False),
+        ('post_detail', 'blog:post_detail', [post.get_absolute_url() for post in sample_posts], False),
+        ('tag_index', 'blog:tag_index', [reverse('blog:tag_index')], False),
+        ('post_search', 'blog:post_search', ['{}?q={}'.format(reverse('blog:post_search'), search_word)],
+         False),
+        ('post_feed', 'blog:post_feed', [reverse('blog:post_feed')], False),
+        ('post_feed_atom', 'blog:post_feed_atom', [reverse('blog:post_feed_atom')], False),
+        ('post_feed_by_tag', 'blog:post_feed_by_tag',
+         [reverse('blog:post_feed_by_tag', args=[popular.slug])], False),
+        ('post_feed_atom_by_tag', 'blog:post_feed_atom_by_tag',
+         [reverse('blog:post_feed_atom_by_tag', args=[popular.slug])], False),
+        ('sitemap', 'sitemap', [reverse('sitemap')], False),
+        ('sitemap_posts', 'sitemap_posts', [reverse('sitemap_posts', args=[shard])], False),
+        ('contact', 'contact', [reverse('contact')], False),
+        ('about', 'about', [reverse('about')], False),
+        ('admin_index', 'admin:index', [reverse('admin:index')], True),
+        ('admin_post_changelist', 'admin:blog_post_changelist',
+         [reverse('admin:blog_post_changelist')], True),
+        ('admin_post_search', 'admin:blog_post_changelist',
+         ['{}?q={}'.format(reverse('admin:blog_post_changelist'), search_word)], True),
+        ('admin_post_change', 'admin:blog_post_change',
+         [reverse('admin:blog_post_change', args=[sample_posts[0].pk])], True),
+        ('ckeditor_browse', 'ckeditor_browse', [reverse('ckeditor_browse')], True),
+    ]
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)
+    return values[rank]
+
+
+def measure_route(client, paths, requests, warmup=5, cold=None):
+    """
+    Time requests to paths (in turn) and count the queries and peak
+    Python memory of one extra instrumented request, which is kept out
+    of the timings since tracing slows everything down.
+    """
+    for index in range(warmup):
+        client.get(paths[index % len(paths)])
+
+    gc.collect()
+    if cold:
+        cold()
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(paths[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Read now, the captured queries are a view on the connection's log
+    query_count = len(queries)
+
+    latencies = []
+    started = time.perf_counter()
+    for index in range(requests):
+        if cold:
+            cold()
+        request_started = time.perf_counter()
+        client.get(paths[index % len(paths)])
+        latencies.append(round((time.perf_counter() - request_started) * 1000, 3))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return OrderedDict([
+        ('status', response.status_code),
+        ('requests', requests),
+        ('throughput', round(requests / elapsed, 2) if elapsed else None),
+        ('latency_ms', OrderedDict([
+            ('mean', round(sum(latencies) / len(latencies), 3) if latencies else None),
+            ('p50', percentile(latencies, 50)),
+            ('p95', percentile(latencies, 95)),
+            ('p99', percentile(latencies, 99)),
+            ('max', latencies[-1] if latencies else None),
+        ])),
+        ('queries', query_count),
+        ('peak_memory_kib', round(peak / 1024.0, 1)),
+    ])
+
+
+def run(requests=100, warmup=5, only=None, cold=None, host='localhost', label='', stdout=None):
+    """Benchmark every route and return the report as an OrderedDict."""
+    client = Client(HTTP_HOST=host)
+    staff = Client(HTTP_HOST=host)
+    staff.force_login(User.objects.get(username=BENCH_USERNAME))
+    report = OrderedDict([
+        ('label', label),
+        ('created', timezone.now().isoformat()),
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('database', connection.vendor),
+        ])),
+        ('dataset', OrderedDict([
+            ('posts', Post.objects.count()),
+            ('published', Post.published.count()),
+            ('tags', Tag.objects.count()),
+            ('images', PostImage.objects.count()),
+        ])),
+        ('settings', OrderedDict([('requests', requests), ('warmup', warmup), ('cold', bool(cold))])),
+        ('routes', OrderedDict()),
+    ])
+    covered = set()
+    for route, name, paths, login in routes():
+        covered.add(name)
+        if only and route not in only:
+            continue
+        result = measure_route(staff if login else client, paths, requests, warmup, cold)
+        report['routes'][route] = result
+        if stdout:
+            stdout.write('{:<28} {:>8.1f} req/s  p95 {:>8.2f} ms  {:>4} queries  {:>8.1f} KiB'.format(
+                route, result['throughput'] or 0, result['latency_ms']['p95'] or 0,
+                result['queries'], result['peak_memory_kib']))
+    # Media serving and uploads aren't worth timing, but new pages are
+    report['not_covered'] = sorted(name for name in route_names() - covered
+                                   if not name.startswith('admin:') and name != 'ckeditor_upload')
+    return report
+
+
+def _mean_ms(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return round((time.perf_counter() - started) * 1000 / iterations, 4)
+
+
+def render_breakdown(iterations=200, host='localhost'):
+    """
+    How much of rendering the first post_list page goes to the shared
+    chrome templates and how much to the content, with fragment caching
+    off and on, plus the cost of compiling the template on every render
+    instead of once per process.
+    """
+    request = RequestFactory(HTTP_HOST=host).get(reverse('blog:post_list'))
+    posts = KeysetPaginator(Post.published.summary().select_related('author').prefetch_related('tags'),
+                            5).first_page()
+    # Render the tags up front, so the timings don't include queries
+    for post in posts:
+        list(post.tags.all())
+    context = {'posts': posts, 'page': posts, 'tag': None}
+
+    page = get_template('blog/post/list.html')
+    chrome = [(name, get_template(name)) for name in CHROME_TEMPLATES]
+    report = OrderedDict([('iterations', iterations)])
+    for label, timeout in (('fragments_uncached', 0), ('fragments_cached', 60 * 60)):
+        with override_settings(BLOG_FRAGMENT_CACHE_TIMEOUT=timeout):
+            cache.clear()
+            page_ms = _mean_ms(lambda: page.render(context, request), iterations)
+            chrome_ms = OrderedDict((name, _mean_ms(lambda: template.render(context, request), iterations))
+                                    for name, template in chrome)
+        chrome_total = sum(chrome_ms.values())
+        report[label] = OrderedDict([
+            ('page_ms', page_ms),
+            ('chrome_ms', chrome_ms),
+            ('chrome_total_ms', round(chrome_total, 4)),
+            ('content_ms', round(page_ms - chrome_total, 4)),
+            ('chrome_share', round(chrome_total / page_ms, 3) if page_ms else None),
+        ])
+
+    loaders = ['django.template.loaders.filesystem.Loader',
+               'django.template.loaders.app_directories.Loader']
+    uncached_engine = Engine(loaders=loaders)
+    cached_engine = Engine(loaders=[('django.template.loaders.cached.Loader', loaders)])
+    report['template_loading_ms'] = OrderedDict(
+        (label, _mean_ms(lambda: engine.get_template('blog/post/list.html'), iterations))
+        for label, engine in (('uncached_loader', uncached_engine), ('cached_loader', cached_engine)))
+    return report
+
+
+def middleware_overhead(requests=500, host='localhost'):
+    """
+    Mean time of anonymous requests to the public routes with the
+    configured middleware and with Django's session, CSRF, auth and
+    message middleware instead (and no PublicReadMiddleware), plus the
+    caching headers each variant sends. Pages come from the page cache
+    after the first request, so the difference is mostly middleware.
+    """
+    stock = [STOCK_MIDDLEWARE.get(path, path) for path in settings.MIDDLEWARE
+             if path != 'blog.middleware.PublicReadMiddleware']
+    variants = (('stock', stock), ('lean', list(settings.MIDDLEWARE)))
+    public_views = set(getattr(settings, 'BLOG_PUBLIC_VIEWS', ()))
+    report = OrderedDict([('requests', requests), ('routes', OrderedDict())])
+    for route, name, paths, login in routes():
+        if login or name not in public_views:
+            continue
+        result = OrderedDict()
+        clients = OrderedDict()
+        for label, middleware in variants:
+            with override_settings(MIDDLEWARE=middleware):
+                # A new client loads the middleware on its first request
+                clients[label] = Client(HTTP_HOST=host)
+                response = clients[label].get(paths[0])
+            result[label] = OrderedDict([('mean_ms', None),
+                                         ('vary', response.get('Vary')),
+                                         ('cache_control', response.get('Cache-Control')),
+                                         ('set_cookie', sorted(response.cookies))])
+        # Alternate the variants and keep the best round of each, the
+        # difference is small next to the noise
+        for _ in range(ROUNDS):
+            for label, client in clients.items():
+                mean_ms = _mean_ms(lambda: client.get(paths[0]), max(1, requests // ROUNDS))
+                if result[label]['mean_ms'] is None or mean_ms < result[label]['mean_ms']:
+                    result[label]['mean_ms'] = mean_ms
+        saved = result['stock']['mean_ms'] - result['lean']['mean_ms']
+        result['saved_ms'] = round(saved, 4)
+        result['saved_share'] = round(saved / result['stock']['mean_ms'], 3) if result['stock']['mean_ms'] else None
+        report['routes'][route] = result
+    return report
+
+
+def _published(summary):
+    return Post.published.summary() if summary else Post.published.all()
+
+
+def _fetched_bytes(rows):
+    """Size of the column values loaded into post instances or value rows."""
+    total = 0
+    for row in rows:
+        if isinstance(row, tuple):
+            total += sum(sys.getsizeof(value) for value in row)
+        else:
+            total += sum(sys.getsizeof(row.__dict__[field.attname])
+                         for field in row._meta.concrete_fields
+                         if field.attname in row.__dict__)
+    return total
+
+
+def projection_memory(body_sizes=(1024, 16384, 131072)):
+    """
+    Bytes loaded and peak Python memory of the first post list and feed
+    page and of the sitemap shard holding the newest post, with every
+    column and as the views load them, while the newest posts' bodies
+    grow. The bodies are changed in a transaction that is rolled back.
+    """
+    newest = list(Post.published.values_list('pk', flat=True)[:50])
+    if not newest:
+        raise ValueError('No published posts, run seed_benchmark_data first')
+    shard = (newest[0] - 1) // shard_size()
+    report = OrderedDict([('posts', len(newest)), ('sitemap_shard', shard), ('body_sizes', OrderedDict())])
+    for size in body_sizes:
+        result = OrderedDict()
+        with transaction.atomic():
+            body = '<p>{}</p>'.format('x' * size)
+            Post.objects.filter(pk__in=newest).update(body=body, body_html=body)
+            for name, page in PROJECTION_PAGES.items():
+                result[name] = OrderedDict()
+                for label, summary in (('full', False), ('summary', True)):
+                    gc.collect()
+                    tracemalloc.start()
+                    loaded = list(page(summary, shard))
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    result[name][label] = OrderedDict([('fetched_bytes', _fetched_bytes(loaded)),
+                                                       ('peak_memory_kib', round(peak / 1024.0, 1))])
+            transaction.set_rollback(True)
+        report['body_sizes'][size] = result
+    return report
+
+
+def _sqlite_worker(args):
+    """
+    One process of sqlite_concurrency(): post list pages and tag counts
+    (readers) or single-row updates (writers) until the deadline.
+    """
+    kind, post_ids, deadline, seed = args
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            if kind == 'read':
+                list(Post.published.order_by('-publish').values('title', 'slug', 'publish')[:10])
+                list(TagStat.objects.order_by('-post_count').values_list('tag_id', 'post_count')[:20])
+            else:
+                Post.objects.filter(pk=rng.choice(post_ids)).update(updated=timezone.now())
+        except OperationalError:
+            # database is locked
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    connections.close_all()
+    return kind, latencies, errors
+
+
+def sqlite_concurrency(readers=4, writers=1, duration=10.0):
+    """
+    Throughput of reader and writer processes sharing the default SQLite
+    database, with SQLite's default settings and with BLOG_SQLITE_PRAGMAS.
+    Writers touch Post.updated, nothing else changes.
+    """
+    database = connections['default'].settings_dict
+    name = str(database['NAME'])
+    if connections['default'].vendor != 'sqlite' or name == ':memory:' or 'mode=memory' in name:
+        raise ValueError('The SQLite benchmark needs a database file, not {!r}'.format(name))
+    post_ids = list(Post.published.values_list('pk', flat=True)[:1000])
+    if not post_ids:
+        raise ValueError('No published posts, run seed_benchmark_data first')
+    report = OrderedDict([('database', name), ('readers', readers), ('writers', writers),
+                          ('duration_s', duration), ('cpus', multiprocessing.cpu_count()),
+                          ('profiles', OrderedDict())])
+    for label, profile in (('baseline', SQLITE_BASELINE_PRAGMAS), ('tuned', pragmas())):
+        with override_settings(BLOG_SQLITE_PRAGMAS=profile):
+            # journal_mode is stored in the file; switch it while no other
+            # connection is open, and don't hand connections to the workers
+            connections.close_all()
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+            connections.close_all()
+            deadline = time.time() + duration
+            jobs = ([('read', post_ids, deadline, seed) for seed in range(readers)] +
+                    [('write', post_ids, deadline, seed) for seed in range(writers)])
+            pool = multiprocessing.Pool(len(jobs))
+            try:
+                results = pool.map(_sqlite_worker, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        result = OrderedDict([('journal_mode', journal_mode)])
+        for kind in ('read', 'write'):
+            latencies = sorted(value for job_kind, values, _ in results if job_kind == kind
+                               for value in values)
+            result[kind] = OrderedDict([
+                ('ops_per_s', round(len(latencies) / duration, 1)),
+                ('errors', sum(errors for job_kind, _, errors in results if job_kind == kind)),
+                ('p50_ms', round(percentile(latencies, 50) * 1000, 3) if latencies else None),
+                ('p95_ms', round(percentile(latencies, 95) * 1000, 3) if latencies else None),
+            ])
+        report['profiles'][label] = result
+    # Leave the database in the configured mode
+    connections.close_all()
+    return report
+
+
+def compare(report, baseline, threshold=0.2):
+    """
+    Regressions of report against an earlier one: routes whose p95
+    latency or peak memory grew by more than threshold, or that make
+    more queries.
+    """
+    regressions = []
+    if report['settings'] != baseline.get('settings'):
+        regressions.append('settings differ: {} -> {}'.format(dict(baseline.get('settings', {})),
+                                                              dict(report['settings'])))
+    for label, result in report['routes'].items():
+        before = baseline.get('routes', {}).get(label)
+        if not before:
+            continue
+        checks = (('p95 latency', result['latency_ms']['p95'], before['latency_ms']['p95'], threshold),
+                  ('peak memory', result['peak_memory_kib'], before['peak_memory_kib'], threshold),
+                  ('queries', result['queries'], before['queries'], 0))
+        for metric, now, then, allowed in checks:
+            if now is not None and then is not None and now > then * (1 + allowed):
+                regressions.append('{}: {} {} -> {}'.format(label, metric, then, now))
+    return regressions
+
+
+def load_report(path):
+    with open(path) as report_file:
+        return json.load(report_file, object_pairs_hook=OrderedDict)
+
+
+def save_report(report, path):
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+        report_file.write('\n')
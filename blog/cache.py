@@ -0,0 +1,178 @@
+import hashlib
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import BaseCache
+from django.http import HttpResponse
+
+from . import instrumentation, routers
+
+
+VERSION_KEY = 'blog:content-version'
+# Set for BLOG_REPLICA_PIN_SECONDS after each bump, see fresh_reads()
+BUMPED_KEY = 'blog:content-version:bumped'
+# Backends whose entries only the process that wrote them can see
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def cache_is_shared(alias='default'):
+    """Whether a version bump in one process reaches all the others."""
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def get_content_version():
+    """
+    Return the current content version. Every cached page is stored
+    under the version that was current when it was rendered, so bumping
+    the version invalidates all of them at once.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed with a timestamp rather than 1, so a restarted or evicted
+        # cache can never hand out keys that old entries still live under.
+        cache.add(VERSION_KEY, int(time.time()), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_content_version():
+    """Invalidate every versioned cache entry."""
+    version = _increment_version()
+    if routers.replicas():
+        # See fresh_reads()
+        cache.set(BUMPED_KEY, True, getattr(settings, 'BLOG_REPLICA_PIN_SECONDS', 5))
+    return version
+
+
+def _increment_version():
+    if type(caches['default']).incr is not BaseCache.incr:
+        try:
+            # Atomic, and the entry keeps its (lack of) expiry
+            return cache.incr(VERSION_KEY)
+        except ValueError:
+            pass
+    # BaseCache.incr() is a get and a set with the default timeout, which
+    # would make the version expire; set it without one instead.
+    version = cache.get(VERSION_KEY)
+    # Key missing (never set or evicted): seed like get_content_version()
+    version = int(time.time()) if version is None else version + 1
+    cache.set(VERSION_KEY, version, None)
+    return version
+
+
+@contextmanager
+def fresh_reads():
+    """
+    Read from the primary inside the block if the content version changed
+    less than BLOG_REPLICA_PIN_SECONDS ago: a replica may not have the
+    change yet, and what is rendered now gets cached under the new version.
+    """
+    if routers.replicas() and cache.get(BUMPED_KEY):
+        with routers.use_primary():
+            yield
+    else:
+        yield
+
+
+def make_page_key(request, key_params, **kwargs):
+    """
+    Build a cache key out of the request path, the whitelisted query
+    parameters and the view keyword arguments (e.g. tag slug). Any other
+    query parameter is ignored so it can't be used to bust the cache.
+    """
+    parts = [request.path]
+    for param in key_params:
+        parts.append('{}={}'.format(param, request.GET.get(param, '')))
+    for name in sorted(kwargs):
+        parts.append('{}={}'.format(name, kwargs[name]))
+    digest = hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+    return 'blog:page:{}:{}'.format(get_content_version(), digest)
+
+
+def _serialize(response):
+    return {'content': response.content,
+            'content_type': response['Content-Type'],
+            'status': response.status_code}
+
+
+def _deserialize(data):
+    instrumentation.record_cache(True)
+    response = HttpResponse(data['content'],
+                            content_type=data['content_type'],
+                            status=data['status'])
+    response['X-Page-Cache'] = 'hit'
+    return response
+
+
+def cache_page_versioned(key_params=('page',)):
+    """
+    Cache the output of a public view under the current content version.
+
+    Entries are kept for BLOG_PAGE_CACHE_TIMEOUT seconds plus a grace
+    period. Once the timeout passes, a single request acquires a lock and
+    re-renders the page while everybody else keeps getting the stale copy.
+    A request that finds no entry at all waits briefly for whoever holds
+    the lock before rendering the page itself. Pages expire early when a
+    scheduled post is due before the timeout.
+    """
+    # blog.scheduling uses the content version from this module
+    from . import scheduling
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            timeout = getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 0)
+            if not timeout or request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            key = make_page_key(request, key_params, **kwargs)
+            lock_key = key + ':lock'
+            lock_timeout = getattr(settings, 'BLOG_PAGE_CACHE_LOCK_TIMEOUT', 10)
+            grace = getattr(settings, 'BLOG_PAGE_CACHE_GRACE', 60)
+
+            entry = cache.get(key)
+            if entry is not None:
+                if entry['expires'] > time.time():
+                    return _deserialize(entry['response'])
+                if not cache.add(lock_key, True, lock_timeout):
+                    # Somebody else is refreshing it, serve stale.
+                    return _deserialize(entry['response'])
+            elif not cache.add(lock_key, True, lock_timeout):
+                entry = _wait_for(key, lock_key)
+                if entry is not None:
+                    return _deserialize(entry['response'])
+
+            instrumentation.record_cache(False)
+            try:
+                with fresh_reads():
+                    response = view_func(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming:
+                    timeout = scheduling.cache_timeout(timeout)
+                    cache.set(key,
+                              {'expires': time.time() + timeout,
+                               'response': _serialize(response)},
+                              timeout + grace)
+                    response['X-Page-Cache'] = 'miss'
+            finally:
+                cache.delete(lock_key)
+            return response
+        _wrapped_view.key_params = key_params
+        return _wrapped_view
+    return decorator
+
+
+def _wait_for(key, lock_key):
+    """
+    Poll for an entry being rendered by another request. Gives up as
+    soon as the lock is released or BLOG_PAGE_CACHE_LOCK_WAIT passes.
+    """
+    deadline = time.time() + getattr(settings, 'BLOG_PAGE_CACHE_LOCK_WAIT', 2)
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None or cache.get(lock_key) is None:
+            return entry
+    return None
@@ -1,9 +1,51 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import parse_http_date_safe
+from taggit.models import Tag
+
+from .cache import fresh_reads, make_page_key
+from . import instrumentation, scheduling
 from .models import Post
 
 
-class LatestPostFeed(Feed):
+class CachedFeedMixin(object):
+    """
+    Keeps the generated document in the cache under the content version
+    (see blog.cache), so it is only rebuilt after posts or tags change,
+    and answers conditional requests with 304 Not Modified.
+    """
+    def __call__(self, request, *args, **kwargs):
+        key = make_page_key(request, (), **kwargs)
+        entry = cache.get(key)
+        instrumentation.record_cache(entry is not None)
+        if entry is None:
+            with fresh_reads():
+                response = super(CachedFeedMixin, self).__call__(request, *args, **kwargs)
+            entry = {'content': response.content,
+                     'content_type': response['Content-Type'],
+                     'etag': '"{}"'.format(hashlib.md5(response.content).hexdigest()),
+                     'last_modified': response['Last-Modified']}
+            timeout = getattr(settings, 'BLOG_FEED_CACHE_TIMEOUT', 60 * 60 * 24)
+            if timeout:
+                cache.set(key, entry, scheduling.cache_timeout(timeout))
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = entry['last_modified']
+        return get_conditional_response(request,
+                                        etag=entry['etag'],
+                                        last_modified=parse_http_date_safe(entry['last_modified']),
+                                        response=response)
+
+
+class LatestPostFeed(CachedFeedMixin, Feed):
     """
     Django built-in syndication feed framework to generate
     RSS or Atom feeds.
@@ -13,10 +55,49 @@ class LatestPostFeed(Feed):
     description = 'New post on frombitstobytes.com!'
 
     def items(self):
-        return Post.published.all()[:3]
+        return Post.published.summary()[:3]
 
     def item_title(self, item):
         return item.title
 
     def item_description(self, item):
-        return truncatewords(item.body, 30)
+        # Plain-text excerpt computed when the post was saved
+        return item.excerpt
+
+    def item_pubdate(self, item):
+        return item.publish
+
+    def item_updateddate(self, item):
+        return item.updated
+
+
+class AtomLatestPostFeed(LatestPostFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostFeed.description
+
+
+class TagPostFeed(LatestPostFeed):
+    """
+    Latest posts tagged with a specific tag.
+    """
+    def get_object(self, request, tag_slug):
+        return get_object_or_404(Tag, slug=tag_slug)
+
+    def title(self, obj):
+        return 'Blog-frombitstobytes: {}'.format(obj.name)
+
+    def link(self, obj):
+        return reverse('blog:post_list_by_tag', args=[obj.slug])
+
+    def description(self, obj):
+        return 'New post tagged "{}" on frombitstobytes.com!'.format(obj.name)
+
+    def items(self, obj):
+        return Post.published.summary().filter(tagged_items__tag=obj)[:3]
+
+
+class AtomTagPostFeed(TagPostFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
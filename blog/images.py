@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, features
+
+from .cache import bump_content_version
+from .models import PostImage
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = 'derivatives'
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+_executor = None
+
+
+def derivative_widths():
+    return getattr(settings, 'BLOG_IMAGE_WIDTHS', (480, 960, 1600))
+
+
+def webp_supported():
+    return features.check('webp')
+
+
+def render_derivatives(source_path, output_dir, stem, widths, webp):
+    """
+    Write downscaled copies of an image, one per width narrower than the
+    original, plus WebP versions when Pillow supports it. Copies are turned
+    upright according to EXIF; WebP keeps transparency. Runs in a worker
+    process, so it only deals with plain paths and returns plain data.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    derivatives = []
+    with Image.open(source_path) as original:
+        original.load()
+        # Cameras record the orientation in EXIF instead of rotating the pixels
+        image = ImageOps.exif_transpose(original)
+        alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        if alpha:
+            image = image.convert('RGBA')
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for width in sorted(widths):
+            if width >= image.width:
+                break
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+            formats = [('jpg', 'JPEG', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True})]
+            if webp:
+                formats.append(('webp', 'WEBP', {'quality': WEBP_QUALITY, 'method': 6}))
+            for extension, image_format, options in formats:
+                filename = '{}-{}w.{}'.format(stem, width, extension)
+                output = resized
+                if alpha and image_format == 'JPEG':
+                    # JPEG has no alpha channel; transparent areas become white, not black
+                    output = Image.new('RGB', resized.size, (255, 255, 255))
+                    output.paste(resized, mask=resized.getchannel('A'))
+                output.save(os.path.join(output_dir, filename), image_format, **options)
+                derivatives.append({'file': filename, 'width': width, 'height': height,
+                                    'format': extension})
+    return derivatives
+
+
+def derivative_job(image_name):
+    """Arguments for render_derivatives() for a file in default_storage."""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    output_dir = os.path.join(os.path.dirname(default_storage.path(image_name)), DERIVATIVE_DIR)
+    return (default_storage.path(image_name), output_dir, stem,
+            tuple(derivative_widths()), webp_supported())
+
+
+def store_derivatives(image_pk, image_name, derivatives):
+    """Record generated files on the PostImage they belong to."""
+    prefix = os.path.join(os.path.dirname(image_name), DERIVATIVE_DIR, '')
+    files = []
+    for derivative in derivatives:
+        derivative = dict(derivative)
+        derivative['name'] = prefix + derivative.pop('file')
+        files.append(derivative)
+    data = {'source': image_name, 'files': files}
+    # update() rather than save(), so post_save doesn't schedule the work again
+    PostImage.objects.filter(pk=image_pk, image=image_name).update(derivatives=json.dumps(data))
+    transaction.on_commit(bump_content_version)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'BLOG_IMAGE_WORKERS', 2))
+    return _executor
+
+
+def schedule_derivatives(image):
+    """
+    Generate derivatives for a PostImage. With BLOG_IMAGE_ASYNC the work is
+    handed to a process pool once the transaction that saved the image
+    commits, and the admin request returns right away.
+    """
+    if not image.width or image.width <= min(derivative_widths()):
+        # Unreadable, or already smaller than every derivative
+        store_derivatives(image.pk, image.image.name, [])
+        return
+    job = derivative_job(image.image.name)
+    if not getattr(settings, 'BLOG_IMAGE_ASYNC', True):
+        try:
+            store_derivatives(image.pk, image.image.name, render_derivatives(*job))
+        except (IOError, OSError, ValueError):
+            logger.exception('Generating derivatives for %s failed', image.image.name)
+        return
+
+    def done(future):
+        # Runs on the executor's management thread, which has its own
+        # database connection.
+        try:
+            store_derivatives(image.pk, image.image.name, future.result())
+        except Exception:
+            logger.exception('Generating derivatives for %s failed', image.image.name)
+        finally:
+            connection.close()
+
+    def submit():
+        get_executor().submit(render_derivatives, *job).add_done_callback(done)
+
+    # The callback's update has to find the committed row
+    transaction.on_commit(submit)
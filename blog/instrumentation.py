@@ -0,0 +1,145 @@
+"""
+Per-request performance counters, filled in while
+blog.middleware.PerformanceMiddleware is handling a request. Outside of
+such a request every record_*() call is a no-op.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db.backends.utils import CursorDebugWrapper
+from django.template.backends.django import DjangoTemplates
+
+
+_local = threading.local()
+
+
+class RequestMetrics(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.http_time = 0.0
+        self.http_calls = 0
+        self.db_time = 0.0
+        self.queries = []
+
+
+def start():
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def stop():
+    _local.metrics = None
+
+
+def current():
+    return getattr(_local, 'metrics', None)
+
+
+def record_cache(hit):
+    metrics = current()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+@contextmanager
+def outbound_call():
+    """Count the time spent in the block as outbound HTTP."""
+    metrics = current()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.http_time += time.perf_counter() - started
+            metrics.http_calls += 1
+
+
+class TimedCursorWrapper(CursorDebugWrapper):
+    """
+    Debug cursor that adds its queries to the current request's metrics.
+    The query log only keeps milliseconds, too coarse to add up fast queries.
+    """
+    def _record(self, started):
+        duration = time.perf_counter() - started
+        metrics = current()
+        if metrics is not None:
+            metrics.db_time += duration
+            metrics.queries.append({'sql': self.db.queries_log[-1]['sql'] if self.db.queries_log else '',
+                                    'time': round(duration * 1000, 3),
+                                    'alias': self.db.alias})
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursorWrapper, self).execute(sql, params)
+        finally:
+            self._record(started)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self._record(started)
+
+
+@contextmanager
+def timed_queries(connections):
+    """Route the queries of connections through TimedCursorWrapper."""
+    saved = []
+    for connection in connections:
+        saved.append((connection, connection.force_debug_cursor))
+        connection.force_debug_cursor = True
+        connection.make_debug_cursor = functools.partial(TimedCursorWrapper, db=connection)
+    try:
+        yield
+    finally:
+        for connection, force_debug_cursor in saved:
+            connection.force_debug_cursor = force_debug_cursor
+            del connection.make_debug_cursor
+
+
+class TimedTemplate(object):
+    """Template of the Django backend that records its render time."""
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None:
+            return self.template.render(context, request)
+        # Only the outermost render counts, templates rendered while
+        # rendering another one are part of its time.
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    DjangoTemplates backend whose templates report their render time.
+    Note that querysets evaluated inside a template count towards both
+    the template and the database time.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(super(InstrumentedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super(InstrumentedDjangoTemplates, self).get_template(template_name))
@@ -0,0 +1,114 @@
+import logging
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.message import forbid_multi_line_headers
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+
+logger = logging.getLogger(__name__)
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """
+    Store a message in the outbox instead of talking to the SMTP server
+    inside the request. Raises BadHeaderError straight away, like
+    send_mail() would.
+    """
+    forbid_multi_line_headers('Subject', subject, settings.DEFAULT_CHARSET)
+    forbid_multi_line_headers('From', from_email, settings.DEFAULT_CHARSET)
+    return OutboxMessage.objects.create(subject=subject,
+                                        body=message,
+                                        from_email=from_email,
+                                        to=','.join(recipient_list))
+
+
+def retry_delay(attempts):
+    """Exponential backoff: base, 2*base, 4*base... capped at one day."""
+    base = getattr(settings, 'BLOG_OUTBOX_RETRY_DELAY', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 60 * 60 * 24))
+
+
+def claim(outbox_message):
+    """
+    Lease a pending message to this worker for BLOG_OUTBOX_LEASE seconds,
+    so another send_outbox running at the same time doesn't send it too.
+    False if another worker got to it first. A worker that dies while
+    holding the lease leaves the message to be retried when it runs out.
+    """
+    lease = timezone.now() + timedelta(seconds=getattr(settings, 'BLOG_OUTBOX_LEASE', 60 * 5))
+    claimed = OutboxMessage.objects.filter(pk=outbox_message.pk,
+                                           sent__isnull=True,
+                                           next_attempt=outbox_message.next_attempt)\
+                                   .update(next_attempt=lease)
+    outbox_message.next_attempt = lease
+    return bool(claimed)
+
+
+def send(email, connection):
+    """
+    Send email over connection. open() keeps a socket the server has
+    since closed (e.g. after an idle timeout), so when the server turns
+    out to be gone the connection is reopened and the message sent again,
+    once.
+    """
+    connection.open()
+    try:
+        email.send()
+    except smtplib.SMTPServerDisconnected:
+        connection.close()
+        connection.open()
+        email.send()
+
+
+def deliver_outbox(connection=None, batch_size=100):
+    """
+    Send due messages over a single SMTP connection. Failed messages are
+    rescheduled with exponential backoff until BLOG_OUTBOX_MAX_ATTEMPTS
+    is reached. Returns the number of messages sent.
+
+    If a connection is passed in it is left open for the caller to reuse.
+    """
+    max_attempts = getattr(settings, 'BLOG_OUTBOX_MAX_ATTEMPTS', 8)
+    pending = list(OutboxMessage.objects.filter(sent__isnull=True,
+                                                attempts__lt=max_attempts,
+                                                next_attempt__lte=timezone.now())[:batch_size])
+    if not pending:
+        return 0
+
+    own_connection = connection is None
+    if own_connection:
+        connection = get_connection()
+    sent = 0
+    try:
+        for outbox_message in pending:
+            if not claim(outbox_message):
+                continue
+            email = EmailMessage(outbox_message.subject,
+                                 outbox_message.body,
+                                 outbox_message.from_email,
+                                 outbox_message.to.split(','),
+                                 connection=connection)
+            try:
+                send(email, connection)
+            except (smtplib.SMTPException, OSError) as e:
+                logger.warning('Sending outbox message %s failed: %s', outbox_message.pk, e)
+                # Drop the connection so the next message starts a fresh one
+                connection.close()
+                outbox_message.attempts += 1
+                outbox_message.last_error = str(e)
+                outbox_message.next_attempt = timezone.now() + retry_delay(outbox_message.attempts)
+                outbox_message.save(update_fields=['attempts', 'last_error', 'next_attempt'])
+            else:
+                outbox_message.attempts += 1
+                outbox_message.sent = timezone.now()
+                outbox_message.save(update_fields=['attempts', 'sent'])
+                sent += 1
+    finally:
+        if own_connection:
+            connection.close()
+    return sent
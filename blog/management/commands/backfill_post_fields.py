@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.cache import bump_content_version
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Compute sanitized body HTML, excerpt, word count and reading time for existing posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts loaded and updated per transaction.')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every post, not only those never rendered.')
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(body_html='')
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = 0
+        while True:
+            # Walk the table by primary key, so every batch is an index seek
+            batch = list(queryset.filter(pk__gt=last_pk)
+                                 .order_by('pk')
+                                 .only('pk', 'body')[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for post in batch:
+                    post.update_derived_fields()
+                    # update() skips save() and its signals
+                    Post.objects.filter(pk=post.pk).update(body_html=post.body_html,
+                                                           excerpt=post.excerpt,
+                                                           word_count=post.word_count,
+                                                           reading_time=post.reading_time)
+            updated += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write('Updated {} posts'.format(updated))
+        if updated:
+            transaction.on_commit(bump_content_version)
+        self.stdout.write(self.style.SUCCESS('Done, {} posts updated.'.format(updated)))
@@ -0,0 +1,35 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from blog import images
+from blog.models import PostImage
+
+
+class Command(BaseCommand):
+    help = 'Generate resized and WebP copies of post images in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes (default: one per CPU).')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate derivatives that already exist.')
+
+    def handle(self, *args, **options):
+        post_images = [image for image in PostImage.objects.only('pk', 'image', 'derivatives')
+                       if options['force'] or image.needs_derivatives()]
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(images.render_derivatives,
+                                       *images.derivative_job(image.image.name)): image
+                       for image in post_images}
+            for future in as_completed(futures):
+                image = futures[future]
+                try:
+                    images.store_derivatives(image.pk, image.image.name, future.result())
+                except (IOError, OSError, ValueError) as e:
+                    self.stderr.write('{}: {}'.format(image.image.name, e))
+                    continue
+                done += 1
+        self.stdout.write(self.style.SUCCESS('Done, {} of {} images processed.'.format(
+            done, len(post_images))))
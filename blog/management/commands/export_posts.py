@@ -0,0 +1,36 @@
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management.base import BaseCommand
+
+from blog import archive
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Write posts with their tags and images as JSON Lines, optionally copying their media files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-',
+                            help='File to write to (default: standard output).')
+        parser.add_argument('--media-dir',
+                            help='Copy the images and uploads the posts use into this directory.')
+        parser.add_argument('--status', action='append',
+                            choices=[status for status, label in Post.STATUS_CHOICE],
+                            help='Only export posts with this status (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Threads copying media files.')
+
+    def handle(self, *args, **options):
+        stream = self.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        media = set()
+        try:
+            for name in archive.export_posts(stream, options['batch_size'], options['status']):
+                if options['media_dir']:
+                    media.add(name)
+        finally:
+            if options['output'] != '-':
+                stream.close()
+        if options['media_dir']:
+            copied = archive.copy_media(media, default_storage, FileSystemStorage(location=options['media_dir']),
+                                        options['workers'])
+            self.stderr.write('Copied {} of {} media files'.format(len(copied), len(media)))
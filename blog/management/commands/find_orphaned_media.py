@@ -0,0 +1,69 @@
+import json
+import os
+import time
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from blog.models import Post, PostImage
+from blog.storage import referenced_media_names
+
+
+# Unfinished uploads younger than this are left alone
+TEMP_FILE_GRACE = 60 * 60 * 24
+
+
+def thumbnail_name(name):
+    # Same naming as ckeditor_uploader.utils.get_thumb_filename()
+    return '{0}_thumb{1}'.format(*os.path.splitext(name))
+
+
+class Command(BaseCommand):
+    help = ('List media files under images/ and CKEDITOR_UPLOAD_PATH that no '
+            'Post.body or PostImage refers to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete the orphaned files instead of only listing them.')
+
+    def referenced(self):
+        names = set()
+        for image, derivatives in PostImage.objects.values_list('image', 'derivatives').iterator():
+            names.add(image)
+            if derivatives:
+                names.update(derivative['name'] for derivative in json.loads(derivatives)['files'])
+        for body in Post.objects.values_list('body', flat=True).iterator():
+            for name in referenced_media_names(body):
+                name = unquote(name)
+                names.add(name)
+                names.add(thumbnail_name(name))
+        return names
+
+    def stored(self):
+        for directory in ('images', settings.CKEDITOR_UPLOAD_PATH):
+            root = default_storage.path(directory)
+            for dirpath, dirnames, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    if filename.startswith('.upload-') and time.time() - os.path.getmtime(path) < TEMP_FILE_GRACE:
+                        continue
+                    yield os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/'), path
+
+    def handle(self, *args, **options):
+        referenced = self.referenced()
+        count = 0
+        size = 0
+        for name, path in self.stored():
+            if name in referenced:
+                continue
+            count += 1
+            size += os.path.getsize(path)
+            if options['delete']:
+                os.remove(path)
+                self.stdout.write('Deleted {}'.format(name))
+            else:
+                self.stdout.write(name)
+        self.stdout.write(self.style.SUCCESS('{} orphaned files, {:.1f} MB{}.'.format(
+            count, size / 1024 / 1024, ' deleted' if options['delete'] else '')))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import archive
+
+
+class Command(BaseCommand):
+    help = ('Load posts written by export_posts. Posts that already exist are skipped, '
+            'so an interrupted import can be run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='JSON Lines file, or - for standard input.')
+        parser.add_argument('--media-dir',
+                            help='Directory with the media files written by export_posts --media-dir.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Posts per transaction.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Threads copying media files.')
+
+    def handle(self, *args, **options):
+        media_source = FileSystemStorage(location=options['media_dir']) if options['media_dir'] else None
+        importer = archive.PostImporter(media_source, options['workers'])
+        stream = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8')
+        try:
+            for imported, skipped in importer.run(stream, options['batch_size']):
+                self.stdout.write('Imported {} posts, skipped {}'.format(imported, skipped))
+        except (ValueError, KeyError) as e:
+            raise CommandError('Invalid archive: {!r}'.format(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS('Done, {} posts imported, {} already present.'.format(
+            importer.imported, importer.skipped)))
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from blog.cache import cache_is_shared
+from blog.scheduling import publish_due, next_scheduled_publish, scheduler_interval
+
+
+class Command(BaseCommand):
+    help = 'Publish scheduled posts whose publish date has passed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, waking up when the next post is due '
+                                 'or every --interval seconds at the latest.')
+        parser.add_argument('--interval', type=float, default=scheduler_interval(),
+                            help='Longest sleep in --loop mode; posts scheduled by '
+                                 'other processes are noticed after at most this long.')
+        parser.add_argument('--force', action='store_true',
+                            help='Run with a per-process cache (development); the web '
+                                 'server then shows new posts once its cached pages expire.')
+
+    def handle(self, *args, **options):
+        # The web workers have to see the content version bumped here,
+        # unless they don't cache pages at all
+        page_cache = getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 0)
+        if page_cache and not cache_is_shared() and not options['force']:
+            raise CommandError('publish_scheduled needs a cache shared with the web server; '
+                               'CACHES["default"] keeps entries per process. Use --force '
+                               'in development.')
+        try:
+            while True:
+                published = publish_due()
+                if published:
+                    self.stdout.write('Published {} posts'.format(published))
+                if not options['loop']:
+                    break
+                delay = options['interval']
+                upcoming = next_scheduled_publish()
+                if upcoming is not None:
+                    delay = min(delay, max(0, (upcoming - timezone.now()).total_seconds()))
+                time.sleep(delay)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from blog.related import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts of every published post in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes (default: one per CPU).')
+
+    def handle(self, *args, **options):
+        count = rebuild(workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS('Done, related posts of {} posts computed.'.format(count)))
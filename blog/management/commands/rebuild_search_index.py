@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog import search
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.clear()
+        last_pk = 0
+        indexed = 0
+        while True:
+            batch = list(Post.objects.filter(pk__gt=last_pk)
+                                     .order_by('pk')
+                                     .prefetch_related('tags')[:options['batch_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                for post in batch:
+                    backend.index(post)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write('Indexed {} posts'.format(indexed))
+        self.stdout.write(self.style.SUCCESS('Done, {} posts indexed.'.format(indexed)))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import TagStat
+from blog.tagstats import refresh_tag_stats
+
+
+class Command(BaseCommand):
+    help = 'Recount published posts per tag from scratch.'
+
+    def handle(self, *args, **options):
+        refresh_tag_stats()
+        self.stdout.write(self.style.SUCCESS('Done, {} tags counted.'.format(TagStat.objects.count())))
@@ -0,0 +1,46 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.cache import bump_content_version
+from blog.models import Post
+from blog.rendering import render_body_html
+
+
+class Command(BaseCommand):
+    help = ('Highlight the code snippets of existing posts again, in parallel, '
+            'after a change of BLOG_CODE_STYLE or of Pygments.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes (default: one per CPU).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts loaded and updated per transaction.')
+
+    def handle(self, *args, **options):
+        # Only posts with code blocks come out differently
+        queryset = Post.objects.filter(body__contains='<code')
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                # Walk the table by primary key, so every batch is an index seek
+                batch = list(queryset.filter(pk__gt=last_pk)
+                                     .order_by('pk')
+                                     .values_list('pk', 'body')[:batch_size])
+                if not batch:
+                    break
+                rendered = executor.map(render_body_html, [body for pk, body in batch],
+                                        chunksize=max(1, len(batch) // 32))
+                with transaction.atomic():
+                    for (pk, body), body_html in zip(batch, rendered):
+                        # update() skips save() and its signals
+                        Post.objects.filter(pk=pk).update(body_html=body_html)
+                updated += len(batch)
+                last_pk = batch[-1][0]
+                self.stdout.write('Highlighted {} posts'.format(updated))
+        if updated:
+            transaction.on_commit(bump_content_version)
+        self.stdout.write(self.style.SUCCESS('Done, {} posts updated.'.format(updated)))
@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure throughput, latency percentiles, query counts and peak memory of '
+            'every route, optionally comparing against an earlier JSON report.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Timed requests per route.')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed requests per route before measuring.')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only benchmark this route (repeatable).')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request.')
+        parser.add_argument('--host', default='localhost',
+                            help='Host header; must be in ALLOWED_HOSTS.')
+        parser.add_argument('--label', default='',
+                            help='Name of this run, stored in the report.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+        parser.add_argument('--compare', help='Earlier JSON report to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative growth of p95 latency and peak memory.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.run(requests=options['requests'], warmup=options['warmup'],
+                                   only=options['routes'], cold=cache.clear if options['cold'] else None,
+                                   host=options['host'], label=options['label'], stdout=self.stdout)
+        except ValueError as e:
+            raise CommandError(e)
+        if report['not_covered']:
+            self.stderr.write('Routes without a benchmark: {}'.format(', '.join(report['not_covered'])))
+        if options['output']:
+            benchmark.save_report(report, options['output'])
+            self.stdout.write('Report written to {}'.format(options['output']))
+        if options['compare']:
+            regressions = benchmark.compare(report, benchmark.load_report(options['compare']),
+                                            options['threshold'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError('{} regressions against {}'.format(len(regressions), options['compare']))
+            self.stdout.write(self.style.SUCCESS('No regressions against {}.'.format(options['compare'])))
@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Time anonymous requests to the public pages with the lean middleware '
+            "and with Django's session, CSRF, auth and message middleware.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per route and middleware variant.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.middleware_overhead(options['requests'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            benchmark.save_report(report, options['output'])
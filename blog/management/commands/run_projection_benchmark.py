@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Show the memory the post list, feed and sitemap querysets use with and '
+            'without the summary projection as post bodies grow.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 16384, 131072],
+                            help='Body sizes in characters.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.projection_memory(options['sizes'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            benchmark.save_report(report, options['output'])
@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Split post_list render time into the site chrome and the content, '
+            'with and without fragment caching.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.render_breakdown(options['iterations'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            benchmark.save_report(report, options['output'])
@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Run reader and writer processes against the SQLite database with '
+            "SQLite's defaults and with BLOG_SQLITE_PRAGMAS, and compare throughput.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Reading processes.')
+        parser.add_argument('--writers', type=int, default=1, help='Writing processes.')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds each profile runs.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.sqlite_concurrency(options['readers'], options['writers'],
+                                                  options['duration'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            benchmark.save_report(report, options['output'])
@@ -0,0 +1,30 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Fill an empty database with a reproducible synthetic blog for run_benchmark.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=5000)
+        parser.add_argument('--images', type=int, default=20,
+                            help='Number of distinct image files shared by the posts.')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Random seed; the same seed gives the same data.')
+
+    def handle(self, *args, **options):
+        try:
+            benchmark.seed_dataset(posts=options['posts'], tags=options['tags'],
+                                   images=options['images'], seed=options['seed'],
+                                   stdout=self.stdout)
+        except ValueError as e:
+            raise CommandError(e)
+        # Posts were bulk inserted, bypassing the signals that keep these up to date
+        call_command('rebuild_tag_stats', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        # After the tag statistics, which weigh the shared tags
+        call_command('rebuild_related_posts', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Done, {} posts created.'.format(options['posts'])))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from blog.mail import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued contact form messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll the outbox every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between polls in --loop mode.')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        # One SMTP connection for the whole run. deliver_outbox() reopens
+        # it when a send finds that the server has dropped it. Several
+        # workers may run; each message is leased to one of them.
+        connection = get_connection()
+        try:
+            while True:
+                sent = deliver_outbox(connection, batch_size=options['batch_size'])
+                if sent:
+                    self.stdout.write('Sent {} messages'.format(sent))
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
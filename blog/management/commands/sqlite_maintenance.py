@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.sqlite import CHECKPOINT_MODES, maintain, sqlite_aliases
+
+
+class Command(BaseCommand):
+    help = ('Checkpoint the write-ahead log of the SQLite databases into their main '
+            'files and run PRAGMA optimize.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append',
+                            help='Database alias (repeatable, default: every SQLite database).')
+        parser.add_argument('--mode', default='TRUNCATE', choices=CHECKPOINT_MODES,
+                            help='Checkpoint mode; TRUNCATE also shrinks the -wal file.')
+        parser.add_argument('--no-optimize', action='store_false', dest='optimize',
+                            help='Only checkpoint.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and repeat every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=300,
+                            help='Seconds between runs in --loop mode.')
+
+    def handle(self, *args, **options):
+        aliases = options['database'] or sqlite_aliases()
+        unknown = set(aliases) - set(sqlite_aliases())
+        if unknown:
+            raise CommandError('Not SQLite databases: {}'.format(', '.join(sorted(unknown))))
+        try:
+            while True:
+                for alias in aliases:
+                    busy, frames, checkpointed = maintain(alias, options['mode'], options['optimize'])
+                    self.stdout.write('{}: {} of {} WAL frames checkpointed{}'.format(
+                        alias, checkpointed, frames, ' (busy)' if busy else ''))
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,50 @@
+import base64
+import hashlib
+import os
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.staticfiles import VENDOR_ASSETS
+
+
+VENDOR_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           'static')
+
+
+def integrity(algorithm, content):
+    return '{}-{}'.format(algorithm, base64.b64encode(hashlib.new(algorithm, content).digest()).decode())
+
+
+class Command(BaseCommand):
+    help = 'Download the pinned third-party CSS, JS and fonts into blog/static/vendor/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Download files that are already present.')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds to wait for each download.')
+
+    def handle(self, *args, **options):
+        fetched = 0
+        for path, url, expected in VENDOR_ASSETS:
+            target = os.path.join(VENDOR_ROOT, *path.split('/'))
+            if os.path.exists(target) and not options['force']:
+                continue
+            try:
+                with urlopen(url, timeout=options['timeout']) as response:
+                    content = response.read()
+            except (IOError, OSError) as e:
+                raise CommandError('{}: {}'.format(url, e))
+            if expected:
+                actual = integrity(expected.split('-', 1)[0], content)
+                if actual != expected:
+                    raise CommandError('{}: expected {}, got {}'.format(url, expected, actual))
+            else:
+                # Unpinned: print the hash, so it can be added to VENDOR_ASSETS
+                self.stdout.write('{} {}'.format(path, integrity('sha384', content)))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as target_file:
+                target_file.write(content)
+            fetched += 1
+        self.stdout.write(self.style.SUCCESS('Done, {} files downloaded.'.format(fetched)))
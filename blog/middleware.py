@@ -0,0 +1,199 @@
+import functools
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_cache_control
+
+from . import instrumentation, routers, scheduling
+
+
+logger = logging.getLogger('blog.performance')
+slow_logger = logging.getLogger('blog.performance.slow')
+
+
+class PerformanceMiddleware(object):
+    """
+    Measure every request: database time and queries, template render
+    time, page cache hits and misses and outbound HTTP calls. The numbers
+    are sent back in a Server-Timing header (BLOG_SERVER_TIMING) and
+    logged as one JSON line on the blog.performance logger. Requests
+    slower than BLOG_SLOW_REQUEST_MS are logged again, with their SQL, on
+    blog.performance.slow.
+
+    Put it first in MIDDLEWARE, so it covers the other middleware too.
+    Template time needs the blog.instrumentation.InstrumentedDjangoTemplates
+    backend. Streamed responses are only measured until they are returned.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = instrumentation.start()
+        try:
+            with instrumentation.timed_queries(connections.all()):
+                response = self.get_response(request)
+        finally:
+            instrumentation.stop()
+        total = time.perf_counter() - metrics.started
+
+        if getattr(settings, 'BLOG_SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(metrics, total)
+        data = summary(request, response, metrics, total)
+        logger.info(json.dumps(data, sort_keys=True))
+        threshold = getattr(settings, 'BLOG_SLOW_REQUEST_MS', 1000)
+        if threshold and data['total_ms'] >= threshold:
+            data['sql'] = metrics.queries
+            slow_logger.warning(json.dumps(data, sort_keys=True))
+        return response
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Read-your-writes for blog.routers.ReplicaRouter. Requests that may
+    write (anything but GET and HEAD) and those under BLOG_PRIMARY_PATHS,
+    like the admin, read from the primary only. After a request wrote to
+    the database the client gets a cookie that keeps its reads on the
+    primary for BLOG_REPLICA_PIN_SECONDS, long enough for the replicas
+    to catch up. Does nothing when there are no BLOG_DATABASE_REPLICAS.
+    """
+    cookie_name = 'blog_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not routers.replicas():
+            return self.get_response(request)
+        routers.reset()
+        if request.method not in ('GET', 'HEAD') or self.cookie_name in request.COOKIES or \
+                request.path_info.startswith(tuple(getattr(settings, 'BLOG_PRIMARY_PATHS', ()))):
+            routers.pin()
+        try:
+            response = self.get_response(request)
+            if routers.has_written():
+                response.set_cookie(self.cookie_name, '1', httponly=True,
+                                    max_age=getattr(settings, 'BLOG_REPLICA_PIN_SECONDS', 5))
+        finally:
+            routers.reset()
+        return response
+
+
+class PublicReadMiddleware(object):
+    """
+    Marks safe requests to the views in BLOG_PUBLIC_VIEWS that carry no
+    session cookie as public reads. The session, CSRF, authentication
+    and message middleware below are replaced by the Lean* subclasses,
+    which let public reads through untouched: no session is loaded or
+    saved, no CSRF token made, request.user is anonymous and there are
+    no messages. Without Set-Cookie or Vary: Cookie the response gets a
+    Cache-Control: public header of BLOG_PUBLIC_CACHE_MAX_AGE seconds,
+    so shared caches may keep it.
+
+    Put it before SessionMiddleware. Public views must not use the
+    session, messages or {% csrf_token %}.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.public_read = is_public_read(request)
+        if not request.public_read:
+            return self.get_response(request)
+        request.user = AnonymousUser()
+        response = self.get_response(request)
+        max_age = getattr(settings, 'BLOG_PUBLIC_CACHE_MAX_AGE', 0)
+        if max_age and response.status_code == 200 and not response.cookies and \
+                not response.has_header('Cache-Control') and not response.has_header('Vary'):
+            patch_cache_control(response, public=True, max_age=scheduling.cache_timeout(max_age))
+        return response
+
+
+@functools.lru_cache(maxsize=4096)
+def view_name(path):
+    """URL name of the view serving path, or None; remembered per path."""
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return None
+
+
+@receiver(setting_changed)
+def reset_view_names(**kwargs):
+    if kwargs['setting'] == 'ROOT_URLCONF':
+        view_name.cache_clear()
+
+
+def is_public_read(request):
+    if request.method not in ('GET', 'HEAD') or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return False
+    return view_name(request.path_info) in getattr(settings, 'BLOG_PUBLIC_VIEWS', ())
+
+
+class LeanMiddlewareMixin(object):
+    """Skip the middleware for public reads, see PublicReadMiddleware."""
+    def __call__(self, request):
+        if getattr(request, 'public_read', False):
+            return self.get_response(request)
+        return super(LeanMiddlewareMixin, self).__call__(request)
+
+
+class LeanSessionMiddleware(LeanMiddlewareMixin, SessionMiddleware):
+    pass
+
+
+class LeanCsrfViewMiddleware(LeanMiddlewareMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # View middleware is called by the handler, outside of __call__
+        if getattr(request, 'public_read', False):
+            return None
+        return super(LeanCsrfViewMiddleware, self).process_view(request, callback, callback_args,
+                                                                callback_kwargs)
+
+
+class LeanAuthenticationMiddleware(LeanMiddlewareMixin, AuthenticationMiddleware):
+    pass
+
+
+class LeanMessageMiddleware(LeanMiddlewareMixin, MessageMiddleware):
+    pass
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def server_timing(metrics, total):
+    return ', '.join([
+        'db;dur={};desc="{} queries"'.format(_ms(metrics.db_time), len(metrics.queries)),
+        'tpl;dur={}'.format(_ms(metrics.template_time)),
+        'cache;desc="hit={} miss={}"'.format(metrics.cache_hits, metrics.cache_misses),
+        'http;dur={};desc="{} calls"'.format(_ms(metrics.http_time), metrics.http_calls),
+        'total;dur={}'.format(_ms(total)),
+    ])
+
+
+def summary(request, response, metrics, total):
+    return {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'total_ms': _ms(total),
+        'db_ms': _ms(metrics.db_time),
+        'queries': len(metrics.queries),
+        'template_ms': _ms(metrics.template_time),
+        'cache_hits': metrics.cache_hits,
+        'cache_misses': metrics.cache_misses,
+        'http_ms': _ms(metrics.http_time),
+        'http_calls': metrics.http_calls,
+    }
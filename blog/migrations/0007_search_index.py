@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 14:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models, OperationalError
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    """
+    Create the FTS5 index on SQLite builds that support it. Other
+    databases use the SearchTerm table instead.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE blog_post_fts '
+                           'USING fts5(title, subtitle, body, tags)')
+        except OperationalError:
+            # SQLite compiled without FTS5
+            pass
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS blog_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.FloatField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='blog.Post')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchterm',
+            unique_together=set([('term', 'post')]),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
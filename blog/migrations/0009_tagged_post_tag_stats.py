@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 14:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+import taggit.managers
+
+
+def _post_content_type(apps):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    return ContentType.objects.filter(app_label='blog', model='post').first()
+
+
+def move_tags_to_tagged_post(apps, schema_editor):
+    """Copy generic TaggedItem rows of posts to TaggedPost and count them."""
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    TagStat = apps.get_model('blog', 'TagStat')
+    content_type = _post_content_type(apps)
+    if content_type is not None:
+        items = TaggedItem.objects.filter(content_type=content_type)
+        TaggedPost.objects.bulk_create(
+            [TaggedPost(tag_id=tag_id, content_object_id=object_id)
+             for tag_id, object_id in items.values_list('tag_id', 'object_id').distinct()])
+        items.delete()
+    stats = TaggedPost.objects.filter(content_object__status='published')\
+                              .values('tag_id')\
+                              .annotate(post_count=Count('content_object', distinct=True),
+                                        latest_publish=Max('content_object__publish'))
+    TagStat.objects.bulk_create([TagStat(**row) for row in stats])
+
+
+def move_tags_to_tagged_item(apps, schema_editor):
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    content_type = _post_content_type(apps)
+    if content_type is not None:
+        TaggedItem.objects.bulk_create(
+            [TaggedItem(tag_id=tag_id, object_id=object_id, content_type=content_type)
+             for tag_id, object_id in TaggedPost.objects.values_list('tag_id', 'content_object_id')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0002_auto_20150616_2121'),
+        ('blog', '0008_postimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaggedPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagStat',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='blog_stat', serialize=False, to='taggit.Tag')),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('latest_publish', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('-post_count',),
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='tags',
+            field=taggit.managers.TaggableManager(help_text='A comma-separated list of tags.', through='blog.TaggedPost', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AddIndex(
+            model_name='tagstat',
+            index=models.Index(fields=['-post_count'], name='blog_tagstat_count_idx'),
+        ),
+        migrations.AddField(
+            model_name='taggedpost',
+            name='content_object',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tagged_items', to='blog.Post'),
+        ),
+        migrations.AddField(
+            model_name='taggedpost',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blog_taggedpost_items', to='taggit.Tag'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedpost',
+            unique_together=set([('tag', 'content_object')]),
+        ),
+        migrations.RunPython(move_tags_to_tagged_post, move_tags_to_tagged_item),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 14:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.utils import timezone
+
+
+def _recount_tags(apps):
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    TagStat = apps.get_model('blog', 'TagStat')
+    TagStat.objects.all().delete()
+    stats = TaggedPost.objects.filter(content_object__status='published')\
+                              .values('tag_id')\
+                              .annotate(post_count=Count('content_object', distinct=True),
+                                        latest_publish=Max('content_object__publish'))
+    TagStat.objects.bulk_create([TagStat(**row) for row in stats])
+
+
+def schedule_future_posts(apps, schema_editor):
+    """Published posts with a future date wait for publish_scheduled now."""
+    Post = apps.get_model('blog', 'Post')
+    if Post.objects.filter(status='published', publish__gt=timezone.now()).update(status='scheduled'):
+        _recount_tags(apps)
+
+
+def publish_scheduled_posts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    if Post.objects.filter(status='scheduled').update(status='published'):
+        _recount_tags(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_tagged_post_tag_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('scheduled', 'Scheduled'), ('published', 'Published'), ('trashed', 'Trashed')], default='draft', max_length=10),
+        ),
+        migrations.RunPython(schedule_future_posts, publish_scheduled_posts),
+    ]
@@ -1,3 +1,5 @@
+import json
+
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -6,9 +8,25 @@ from django.core.urlresolvers import reverse
 from ckeditor.fields import RichTextField
 from ckeditor_uploader.fields import RichTextUploadingField
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItemBase
+
+from .rendering import render_post_body
+
+
+# Columns that grow with the post; only the detail page needs them
+BODY_FIELDS = ('body', 'body_html')
+
+
+class PostQuerySet(models.QuerySet):
+    def summary(self):
+        """
+        Posts without their body columns, for post lists, feeds and search results.
+        Reading a deferred column costs one query per post.
+        """
+        return self.defer(*BODY_FIELDS)
 
 
-class PublishedManager(models.Manager):
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     """
     Custom manager for retrieving all post with
     status 'published'.
@@ -21,6 +39,7 @@ class PublishedManager(models.Manager):
 class Post(models.Model):
     STATUS_CHOICE = (
         ('draft', 'Draft'),
+        ('scheduled', 'Scheduled'),
         ('published', 'Published'),
         ('trashed', 'Trashed')
     )
@@ -37,12 +56,56 @@ class Post(models.Model):
     status = models.CharField(max_length=10,
                               choices=STATUS_CHOICE,
                               default='draft')
+    # Derived from body every time the post is saved
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt = models.TextField(blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=0, editable=False)
 
     objects = models.Manager()  # default manager
     published = PublishedManager()  # custom manager
 
-    # taggit
-    tags = TaggableManager()
+    # taggit, through a plain foreign key instead of the generic relation
+    tags = TaggableManager(through='TaggedPost')
+
+    def update_derived_fields(self):
+        """
+        Render body once, so views and feeds can read the sanitized
+        HTML, excerpt and reading time instead of processing it per request.
+        """
+        rendered = render_post_body(self.body)
+        self.body_html = rendered.html
+        self.excerpt = rendered.excerpt
+        self.word_count = rendered.word_count
+        self.reading_time = rendered.reading_time
+
+    def update_schedule(self, now=None):
+        """
+        A post published with a future date is 'scheduled' until the
+        publish_scheduled command publishes it, so PublishedManager never
+        has to compare against the current time. A scheduled post whose
+        date has passed is published right away.
+        """
+        now = now or timezone.now()
+        if self.status == 'published' and self.publish > now:
+            self.status = 'scheduled'
+        elif self.status == 'scheduled' and self.publish <= now:
+            self.status = 'published'
+
+    def save(self, *args, **kwargs):
+        self.update_derived_fields()
+        self.update_schedule()
+        super(Post, self).save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super(Post, cls).from_db(db, field_names, values)
+        post._saved_ranking = post.ranking_state()
+        return post
+
+    def ranking_state(self):
+        """What related posts depend on besides tags, see blog.signals."""
+        return self.__dict__.get('status'), self.__dict__.get('publish')
 
     def get_absolute_url(self):
         return reverse('blog:post_detail',
@@ -53,17 +116,85 @@ class Post(models.Model):
 
     class Meta:
         ordering = ('-publish',)
+        indexes = [
+            # PublishedManager filter plus newest-first (keyset) ordering
+            models.Index(fields=['status', '-publish', '-id'],
+                         name='blog_post_status_publish_idx'),
+            # post_detail lookup by slug and publish date range
+            models.Index(fields=['slug', 'publish'],
+                         name='blog_post_slug_publish_idx'),
+            # Admin date hierarchy, filtered and probed by publish ranges
+            models.Index(fields=['publish'],
+                         name='blog_post_publish_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class TaggedPost(TaggedItemBase):
+    """
+    Tag assignment of a post. A real foreign key to Post, so filtering
+    by tag is an indexed join rather than one on content type and object id.
+    """
+    content_object = models.ForeignKey(Post, related_name='tagged_items')
+
+    class Meta:
+        unique_together = ('tag', 'content_object')
+
+
+class TagStat(models.Model):
+    """
+    Number of published posts and latest publish date per tag, kept up
+    to date by blog.tagstats so tag pages don't aggregate per request.
+    """
+    tag = models.OneToOneField(Tag, primary_key=True, related_name='blog_stat')
+    post_count = models.PositiveIntegerField(default=0)
+    latest_publish = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-post_count',)
+        indexes = [
+            models.Index(fields=['-post_count'],
+                         name='blog_tagstat_count_idx'),
+        ]
+
+    def __str__(self):
+        return '{} ({})'.format(self.tag, self.post_count)
+
+
+class RelatedPost(models.Model):
+    """
+    One of the BLOG_RELATED_POSTS published posts most similar to a
+    published post, scored by shared tags. Maintained by blog.related so
+    post_detail reads them with one query.
+    """
+    post = models.ForeignKey(Post, related_name='related_entries')
+    related = models.ForeignKey(Post, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ('-score',)
+        unique_together = ('post', 'related')
+        indexes = [
+            # post_detail: best entries of one post
+            models.Index(fields=['post', '-score'],
+                         name='blog_related_post_score_idx'),
+        ]
+
+
 class PostImage(models.Model):
     """
     Model responsible for storing images.
     """
     post = models.ForeignKey(Post)
-    image = models.ImageField(upload_to='images/')
+    image = models.ImageField(upload_to='images/',
+                              width_field='width',
+                              height_field='height')
+    width = models.PositiveIntegerField(null=True, editable=False)
+    height = models.PositiveIntegerField(null=True, editable=False)
+    # JSON written by blog.images: source file name and resized copies
+    derivatives = models.TextField(blank=True, editable=False)
     image_title = models.CharField(max_length=200)
     image_author = models.CharField(max_length=150)
     image_description = models.CharField(max_length=250, blank=True)
@@ -72,4 +203,64 @@ class PostImage(models.Model):
     def __str__(self):
         return self.image_title
 
+    def needs_derivatives(self):
+        """Whether derivatives were never generated for the current file."""
+        if not self.image:
+            return False
+        return json.loads(self.derivatives or '{}').get('source') != self.image.name
+
+    def get_derivatives(self, format=None):
+        """
+        Resized copies of the current image, narrowest first, optionally
+        only those in the given format ('jpg' or 'webp').
+        """
+        if not self.derivatives:
+            return []
+        data = json.loads(self.derivatives)
+        if data['source'] != self.image.name:
+            # Generated for a previous upload
+            return []
+        return [derivative for derivative in data['files']
+                if format is None or derivative['format'] == format]
+
+
+class SearchTerm(models.Model):
+    """
+    Inverted index entry used by the pure-Python search backend
+    when SQLite FTS5 is not available.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, related_name='search_terms')
+    weight = models.FloatField()
+
+    class Meta:
+        unique_together = ('term', 'post')
+
+    def __str__(self):
+        return self.term
+
+
+class OutboxMessage(models.Model):
+    """
+    Email waiting to be delivered by the send_outbox worker.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    # Comma-separated list of recipients
+    to = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
 
+    class Meta:
+        ordering = ('next_attempt',)
+        indexes = [
+            models.Index(fields=['sent', 'next_attempt'],
+                         name='blog_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return self.subject
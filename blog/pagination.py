@@ -0,0 +1,138 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+# Largest value of a signed 64-bit column, or of an SQL LIMIT/OFFSET
+MAX_BIGINT = 2 ** 63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(post):
+    """Opaque cursor pointing at a post's (publish, id) position."""
+    value = '{}|{}'.format(post.publish.isoformat(), post.pk)
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        publish, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        publish = parse_datetime(publish)
+        pk = int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if publish is None or not -MAX_BIGINT - 1 <= pk <= MAX_BIGINT:
+        raise InvalidCursor(cursor)
+    return publish, pk
+
+
+class KeysetPage(object):
+    """
+    A page of posts produced by KeysetPaginator. Mimics the parts of
+    django.core.paginator.Page the templates use, but links to its
+    neighbours with cursors instead of page numbers.
+    """
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<KeysetPage of {} items>'.format(len(self))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        """Whether older posts exist."""
+        return self._has_next
+
+    def has_previous(self):
+        """Whether newer posts exist."""
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next() and self.object_list:
+            return encode_cursor(self.object_list[-1])
+        return ''
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return encode_cursor(self.object_list[0])
+        return ''
+
+
+class KeysetPaginator(object):
+    """
+    Seek-based paginator over posts ordered newest first on (publish, id).
+
+    Unlike django.core.paginator.Paginator it never runs a COUNT(*) and
+    never uses OFFSET, so every page costs the same no matter how deep in
+    the archive it is.
+    """
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def _fetch(self, queryset):
+        items = list(queryset[:self.per_page + 1])
+        return items[:self.per_page], len(items) > self.per_page
+
+    def first_page(self):
+        items, has_more = self._fetch(self.object_list.order_by('-publish', '-id'))
+        return KeysetPage(items, has_next=has_more, has_previous=False)
+
+    def page_after(self, cursor):
+        """Posts older than the cursor."""
+        publish, pk = decode_cursor(cursor)
+        queryset = self.object_list.filter(Q(publish__lt=publish) |
+                                           Q(publish=publish, id__lt=pk))
+        items, has_more = self._fetch(queryset.order_by('-publish', '-id'))
+        return KeysetPage(items, has_next=has_more, has_previous=True)
+
+    def page_before(self, cursor):
+        """Posts newer than the cursor."""
+        publish, pk = decode_cursor(cursor)
+        queryset = self.object_list.filter(Q(publish__gt=publish) |
+                                           Q(publish=publish, id__gt=pk))
+        items, has_more = self._fetch(queryset.order_by('publish', 'id'))
+        items.reverse()
+        return KeysetPage(items, has_next=True, has_previous=has_more)
+
+    def page_number(self, number):
+        """
+        Compatibility path for old ?page=N links. Still uses an offset,
+        but skips the count and hands out cursors for the neighbouring
+        pages so crawlers move over to the seek-based links.
+        """
+        ordered = self.object_list.order_by('-publish', '-id')
+        if number <= 1:
+            return self.first_page()
+        offset = (number - 1) * self.per_page
+        items, has_more = [], False
+        # Past that the database rejects the OFFSET; it has no such rows anyway
+        if offset + self.per_page < MAX_BIGINT:
+            items, has_more = self._fetch(ordered[offset:])
+        if not items:
+            # If page is out of range (e.g. 9999), deliver the oldest posts.
+            items = list(self.object_list.order_by('publish', 'id')[:self.per_page])
+            items.reverse()
+            has_more = False
+        return KeysetPage(items, has_next=has_more, has_previous=True)
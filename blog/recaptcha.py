@@ -0,0 +1,84 @@
+import http.client
+import json
+import logging
+import threading
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+
+from . import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+
+_local = threading.local()
+
+
+def _get_connection(url):
+    """
+    Return this thread's keep-alive connection to the verification
+    endpoint, so TCP and TLS handshakes are paid once per worker thread
+    rather than once per submission.
+    """
+    conn = getattr(_local, 'connection', None)
+    timeout = getattr(settings, 'RECAPTCHA_TIMEOUT', 3)
+    if conn is None or _local.netloc != (url.scheme, url.netloc) or conn.timeout != timeout:
+        if conn is not None:
+            conn.close()
+        conn_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        conn = conn_class(url.netloc, timeout=timeout)
+        _local.connection = conn
+        _local.netloc = (url.scheme, url.netloc)
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, 'connection', None)
+    if conn is not None:
+        conn.close()
+        _local.connection = None
+
+
+def verify(recaptcha_response, remote_ip=None):
+    """
+    Check a g-recaptcha-response token. Returns False on a failed check as
+    well as on any network error or timeout, so a slow endpoint can hold a
+    worker for at most RECAPTCHA_TIMEOUT seconds.
+    """
+    url = urlsplit(getattr(settings, 'RECAPTCHA_VERIFY_URL', DEFAULT_VERIFY_URL))
+    values = {
+        'secret': settings.GOOGLE_RECAPTCHA_SECRET_KEY,
+        'response': recaptcha_response or '',
+    }
+    if remote_ip:
+        values['remoteip'] = remote_ip
+    body = urlencode(values)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    with instrumentation.outbound_call():
+        return _post(url, body, headers)
+
+
+def _post(url, body, headers):
+    # A kept-alive connection may have been dropped by the server in the
+    # meantime, so retry once on a fresh one.
+    for attempt in range(2):
+        conn = _get_connection(url)
+        try:
+            conn.request('POST', url.path or '/', body=body, headers=headers)
+            response = conn.getresponse()
+            result = json.loads(response.read().decode())
+            return bool(result.get('success'))
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                http.client.CannotSendRequest):
+            close_connection()
+            if attempt:
+                logger.warning('reCAPTCHA verification failed: connection dropped')
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            # Includes socket.timeout
+            close_connection()
+            logger.warning('reCAPTCHA verification failed: %s', e)
+            return False
+    return False
@@ -0,0 +1,241 @@
+"""
+Related posts: for every published post the BLOG_RELATED_POSTS published
+posts sharing the most tags, stored in RelatedPost. Each shared tag adds
+a weight that is higher the rarer the tag is, and the sum is boosted for
+posts published close to each other, up to twice for the same day. The
+score is symmetric, so when a post changes only its own list, the lists
+it was in and the lists of the posts it shares a tag with need a look.
+
+update_post() does that when the tags, status or publish date of a post
+change (see blog.signals), once per post inside deferred_updates();
+rebuild() recomputes everything in a process pool. Tag weights follow the tag
+statistics, which drift a little between full rebuilds.
+"""
+import heapq
+import math
+import multiprocessing
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import Post, RelatedPost, TaggedPost, TagStat
+
+
+# Posts per query in `IN (...)` lookups, below SQLite's 999 parameters
+CHUNK_SIZE = 500
+
+
+def related_limit():
+    return getattr(settings, 'BLOG_RELATED_POSTS', 5)
+
+
+def half_life():
+    return getattr(settings, 'BLOG_RELATED_HALF_LIFE_DAYS', 365)
+
+
+def tag_weight(post_count):
+    # A tag on a handful of posts says more than one on half the blog
+    return 1 / math.log(2 + post_count)
+
+
+def related_scores(post_id, publish, tag_ids, posts_by_tag, publish_times, weights, days):
+    """
+    {post id: score} of every other post sharing a tag with post_id.
+    publish and publish_times are POSIX timestamps.
+    """
+    shared = defaultdict(float)
+    for tag_id in tag_ids:
+        weight = weights[tag_id]
+        for other in posts_by_tag.get(tag_id, ()):
+            shared[other] += weight
+    shared.pop(post_id, None)
+    half_life = days * 86400
+    return {other: weight * (1 + 0.5 ** (abs(publish - publish_times[other]) / half_life))
+            for other, weight in shared.items()}
+
+
+def top(scores, limit):
+    """The limit best (score, post id) pairs, newer posts first on ties."""
+    return heapq.nlargest(limit, ((score, pk) for pk, score in scores.items()))
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _scores_from_db(post_id):
+    publish = Post.published.filter(pk=post_id).values_list('publish', flat=True).first()
+    if publish is None:
+        return {}
+    tag_ids = list(TaggedPost.objects.filter(content_object_id=post_id).values_list('tag_id', flat=True))
+    counts = dict(TagStat.objects.filter(tag_id__in=tag_ids).values_list('tag_id', 'post_count'))
+    weights = {tag_id: tag_weight(counts.get(tag_id, 1)) for tag_id in tag_ids}
+    posts_by_tag = defaultdict(list)
+    publish_times = {}
+    rows = TaggedPost.objects.filter(tag_id__in=tag_ids, content_object__status='published')\
+                             .exclude(content_object_id=post_id)\
+                             .values_list('tag_id', 'content_object_id', 'content_object__publish')
+    for tag_id, other, other_publish in rows:
+        posts_by_tag[tag_id].append(other)
+        publish_times[other] = other_publish.timestamp()
+    return related_scores(post_id, publish.timestamp(), tag_ids, posts_by_tag, publish_times,
+                          weights, half_life())
+
+
+def _store(post_id, entries):
+    RelatedPost.objects.filter(post_id=post_id).delete()
+    RelatedPost.objects.bulk_create([RelatedPost(post_id=post_id, related_id=related_id, score=score)
+                                     for score, related_id in entries])
+
+
+def holders(post_id):
+    """Posts whose list includes post_id."""
+    return set(RelatedPost.objects.filter(related_id=post_id).values_list('post_id', flat=True))
+
+
+def refresh_lists(post_ids):
+    """Recompute the lists of post_ids from scratch."""
+    limit = related_limit()
+    with transaction.atomic():
+        for post_id in post_ids:
+            _store(post_id, top(_scores_from_db(post_id), limit))
+
+
+def update_post(post_id):
+    """
+    Bring the index up to date after the tags, status or publish date of
+    a post changed (or it was deleted).
+    """
+    limit = related_limit()
+    with transaction.atomic():
+        scores = _scores_from_db(post_id)
+        _store(post_id, top(scores, limit))
+        # Its score in the lists it's in changed, or it has to leave them
+        containing = holders(post_id)
+        refresh_lists(containing)
+        # Lists it may enter now
+        candidates = {pk: score for pk, score in scores.items() if pk not in containing}
+        for chunk in _chunks(sorted(candidates)):
+            lists = {row['post_id']: row for row in
+                     RelatedPost.objects.filter(post_id__in=chunk)
+                                        .values('post_id')
+                                        .annotate(entries=Count('pk'), lowest=Min('score'))
+                                        .order_by()}
+            for pk in chunk:
+                row = lists.get(pk)
+                if row is not None and row['entries'] >= limit:
+                    if candidates[pk] <= row['lowest']:
+                        continue
+                    RelatedPost.objects.filter(post_id=pk).order_by('score', 'related_id').first().delete()
+                RelatedPost.objects.create(post_id=pk, related_id=post_id, score=candidates[pk])
+
+
+_pending = threading.local()
+
+
+@contextmanager
+def deferred_updates():
+    """
+    Collect the schedule_update() calls made inside the block and update
+    each post once when the outermost block ends, e.g. for an admin save
+    that changes a post and its tags.
+    """
+    depth = getattr(_pending, 'depth', 0)
+    if not depth:
+        _pending.posts = []
+    _pending.depth = depth + 1
+    try:
+        yield
+    finally:
+        _pending.depth = depth
+        posts = _pending.posts
+        if not depth:
+            _pending.posts = []
+    if not depth:
+        for post_id in posts:
+            update_post(post_id)
+
+
+def schedule_update(post_id):
+    """update_post() now, or at the end of the enclosing deferred_updates()."""
+    if getattr(_pending, 'depth', 0):
+        if post_id not in _pending.posts:
+            _pending.posts.append(post_id)
+    else:
+        update_post(post_id)
+
+
+# Filled in each worker of rebuild() by _init_worker()
+_index = None
+
+
+def load_index():
+    """Everything rebuild() needs about the published posts, in plain data."""
+    publish_times = {pk: publish.timestamp() for pk, publish in
+                     Post.published.order_by().values_list('pk', 'publish')}
+    posts_by_tag = defaultdict(list)
+    tags_of_post = defaultdict(list)
+    rows = TaggedPost.objects.filter(content_object__status='published')\
+                             .order_by('tag_id', '-content_object_id')\
+                             .values_list('tag_id', 'content_object_id')
+    for tag_id, post_id in rows:
+        posts_by_tag[tag_id].append(post_id)
+        tags_of_post[post_id].append(tag_id)
+    weights = {tag_id: tag_weight(len(post_ids)) for tag_id, post_ids in posts_by_tag.items()}
+    return {'publish_times': publish_times, 'posts_by_tag': dict(posts_by_tag),
+            'tags_of_post': dict(tags_of_post), 'weights': weights,
+            'limit': related_limit(), 'days': half_life()}
+
+
+def _init_worker(index):
+    global _index
+    _index = index
+
+
+def top_related_chunk(post_ids):
+    """[(post id, [(score, related id), ...]), ...] from the worker's index."""
+    index = _index
+    return [(post_id, top(related_scores(post_id, index['publish_times'][post_id],
+                                         index['tags_of_post'].get(post_id, ()),
+                                         index['posts_by_tag'], index['publish_times'],
+                                         index['weights'], index['days']),
+                          index['limit']))
+            for post_id in post_ids]
+
+
+def rebuild(workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Recompute every list in a pool of worker processes (one per CPU by
+    default, in this process with workers=1) and replace the index in
+    one transaction. Returns the number of posts indexed.
+    """
+    index = load_index()
+    chunks = list(_chunks(sorted(index['publish_times']), chunk_size))
+    if workers == 1:
+        _init_worker(index)
+        results = map(top_related_chunk, chunks)
+        pool = None
+    else:
+        # multiprocessing.Pool, as ProcessPoolExecutor has no initializer
+        # before Python 3.7; every worker gets the index once.
+        pool = multiprocessing.Pool(workers, _init_worker, (index,))
+        results = pool.imap_unordered(top_related_chunk, chunks)
+    try:
+        with transaction.atomic():
+            RelatedPost.objects.all().delete()
+            for result in results:
+                RelatedPost.objects.bulk_create([
+                    RelatedPost(post_id=post_id, related_id=related_id, score=score)
+                    for post_id, entries in result
+                    for score, related_id in entries])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return len(index['publish_times'])
@@ -0,0 +1,228 @@
+import math
+import re
+from collections import namedtuple
+from html import escape, unescape
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.utils.text import Truncator
+
+try:
+    import pygments
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import TextLexer, get_lexer_by_name, guess_lexer
+    from pygments.util import ClassNotFound
+except ImportError:
+    pygments = None
+
+
+# Average adult reading speed used for reading time estimates
+WORDS_PER_MINUTE = 200
+# Number of words kept in the plain-text excerpt
+EXCERPT_WORDS = 30
+
+# Elements dropped together with everything inside them
+DROP_CONTENT_TAGS = {'script', 'style', 'object', 'embed', 'applet', 'base', 'meta', 'link',
+                     'svg', 'math', 'template', 'noscript', 'title'}
+# Elements CKEditor produces, with the attributes each may keep besides
+# GLOBAL_ATTRIBUTES. Other elements are unwrapped: their tags dropped,
+# their contents kept.
+ALLOWED_TAGS = {
+    'a': {'href', 'name', 'target', 'rel'},
+    'abbr': set(), 'acronym': set(), 'address': set(), 'b': set(), 'big': set(),
+    'blockquote': {'cite'}, 'br': set(), 'caption': set(), 'center': set(), 'cite': set(),
+    'code': set(), 'col': {'span', 'width'}, 'colgroup': {'span', 'width'}, 'dd': set(),
+    'del': {'cite', 'datetime'}, 'dfn': set(), 'div': set(), 'dl': set(), 'dt': set(), 'em': set(),
+    'figcaption': set(), 'figure': set(), 'font': {'color', 'face', 'size'},
+    'h1': set(), 'h2': set(), 'h3': set(), 'h4': set(), 'h5': set(), 'h6': set(), 'hr': set(), 'i': set(),
+    'iframe': {'src', 'width', 'height', 'frameborder', 'allowfullscreen', 'allow', 'scrolling'},
+    'img': {'src', 'alt', 'width', 'height'}, 'ins': {'cite', 'datetime'}, 'kbd': set(),
+    'li': {'value'}, 'mark': set(), 'ol': {'start', 'type', 'reversed'}, 'p': set(), 'pre': set(),
+    'q': {'cite'}, 's': set(), 'samp': set(), 'small': set(), 'span': set(), 'strike': set(),
+    'strong': set(), 'sub': set(), 'sup': set(),
+    'table': {'border', 'cellpadding', 'cellspacing', 'summary', 'width'},
+    'tbody': set(), 'td': {'colspan', 'rowspan', 'width', 'height', 'valign'}, 'tfoot': set(),
+    'th': {'colspan', 'rowspan', 'scope', 'width', 'height', 'valign'}, 'thead': set(),
+    'tr': set(), 'tt': set(), 'u': set(), 'ul': {'type'}, 'var': set(),
+}
+GLOBAL_ATTRIBUTES = {'class', 'id', 'style', 'title', 'dir', 'lang', 'align'}
+URL_ATTRIBUTES = {'href', 'src', 'cite'}
+SAFE_URL = re.compile(r'^(?!(?:javascript|vbscript|data):)', re.IGNORECASE)
+# Embedded frames run in the site's origin unless they load another one
+SAFE_FRAME_URL = re.compile(r'^(?:https?:|//|/(?!/)|[^:/?#]+(?:[/?#]|$))', re.IGNORECASE)
+# Inline styles that run code or load URLs in some browsers
+UNSAFE_STYLE = re.compile(r'expression|javascript:|vbscript:|behavior|-moz-binding|url\(', re.IGNORECASE)
+# HTML5 elements that never have a closing tag
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+             'param', 'source', 'track', 'wbr'}
+# Elements that separate words in the extracted text
+BLOCK_TAGS = {'p', 'br', 'div', 'li', 'pre', 'tr', 'td', 'th', 'blockquote',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# CKEditor's codesnippet plugin marks the language as <code class="language-...">
+LANGUAGE_CLASS = re.compile(r'(?:^|\s)language-([\w+#.-]+)')
+
+RenderedBody = namedtuple('RenderedBody', ['html', 'text', 'excerpt', 'word_count', 'reading_time'])
+
+
+def highlight_code(code, language=None):
+    """
+    HTML of a code snippet colored by Pygments in the BLOG_CODE_STYLE
+    style. Styles are inline, so pages need no stylesheet or script for
+    it. Without a language it's guessed; without Pygments the code is
+    only escaped.
+    """
+    if pygments is None:
+        return escape(code, quote=False)
+    # Keep the snippet's leading and trailing newlines as they are
+    options = {'stripnl': False, 'ensurenl': False}
+    try:
+        lexer = get_lexer_by_name(language, **options) if language else guess_lexer(code, **options)
+    except ClassNotFound:
+        lexer = TextLexer(**options)
+    formatter = HtmlFormatter(nowrap=True, noclasses=True,
+                              style=getattr(settings, 'BLOG_CODE_STYLE', 'default'))
+    html = pygments.highlight(code, lexer, formatter)
+    # The formatter ends every line, the last one included
+    if not code.endswith('\n') and html.endswith('\n'):
+        html = html[:-1]
+    return html
+
+
+class BodySanitizer(HTMLParser):
+    """
+    Re-emits CKEditor HTML keeping only the ALLOWED_TAGS and their
+    attributes, without javascript: URLs or frames of the site's own
+    origin, collecting the visible text on the way. With
+    highlight, the contents of <pre><code> blocks are syntax highlighted.
+    """
+    def __init__(self, highlight=True):
+        super().__init__(convert_charrefs=False)
+        self.html = []
+        self.text = []
+        self.dropping = 0
+        self.highlight = highlight
+        self.pre_depth = 0
+        # Text of the code block being collected, and its language
+        self.code = None
+        self.language = None
+
+    def handle_starttag(self, tag, attrs, closed=False):
+        if self.code is not None:
+            # Markup inside a code block is dropped, only its text is kept
+            return
+        if tag in DROP_CONTENT_TAGS:
+            if not closed and tag not in VOID_TAGS:
+                self.dropping += 1
+            return
+        if self.dropping:
+            return
+        if tag not in ALLOWED_TAGS:
+            return
+        parts = [tag]
+        for name, value in attrs:
+            if name not in GLOBAL_ATTRIBUTES and name not in ALLOWED_TAGS[tag]:
+                continue
+            if value is None:
+                parts.append(name)
+                continue
+            if not self.allowed_value(tag, name, value):
+                continue
+            parts.append('{}="{}"'.format(name, escape(value, quote=True)))
+        self.html.append('<{}{}>'.format(' '.join(parts), ' /' if closed else ''))
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag == 'pre' and not closed:
+            self.pre_depth += 1
+        elif tag == 'code' and not closed and self.pre_depth and self.highlight:
+            match = LANGUAGE_CLASS.search(dict(attrs).get('class') or '')
+            self.language = match.group(1).lower() if match else None
+            self.code = []
+
+    @staticmethod
+    def allowed_value(tag, name, value):
+        if name in URL_ATTRIBUTES:
+            url = re.sub(r'[\s\x00-\x1f]', '', value)
+            if tag == 'iframe':
+                return bool(SAFE_FRAME_URL.match(url))
+            return bool(SAFE_URL.match(url))
+        if name == 'style':
+            return not UNSAFE_STYLE.search(value)
+        return True
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, closed=True)
+
+    def end_code(self):
+        code = ''.join(self.code)
+        self.code = None
+        self.html.append(highlight_code(code, self.language))
+        self.text.append(code)
+
+    def handle_endtag(self, tag):
+        if self.code is not None:
+            if tag != 'code':
+                return
+            self.end_code()
+        if tag == 'pre' and self.pre_depth:
+            self.pre_depth -= 1
+        if tag in DROP_CONTENT_TAGS:
+            if self.dropping and tag not in VOID_TAGS:
+                self.dropping -= 1
+            return
+        if not self.dropping and tag in ALLOWED_TAGS:
+            self.html.append('</{}>'.format(tag))
+            if tag in BLOCK_TAGS:
+                self.text.append(' ')
+
+    def handle_data(self, data):
+        if self.code is not None:
+            self.code.append(data)
+        elif not self.dropping:
+            # Data has no markup in it, only needs re-escaping of stray
+            # characters the parser let through.
+            self.html.append(data.replace('<', '&lt;').replace('>', '&gt;'))
+            self.text.append(data)
+
+    def handle_entityref(self, name):
+        if self.code is not None:
+            self.code.append(unescape('&{};'.format(name)))
+        elif not self.dropping:
+            self.html.append('&{};'.format(name))
+            self.text.append(unescape('&{};'.format(name)))
+
+    def handle_charref(self, name):
+        if self.code is not None:
+            self.code.append(unescape('&#{};'.format(name)))
+        elif not self.dropping:
+            self.html.append('&#{};'.format(name))
+            self.text.append(unescape('&#{};'.format(name)))
+
+
+    def close(self):
+        super().close()
+        if self.code is not None:
+            self.end_code()
+
+
+def render_post_body(body, highlight=True):
+    """
+    Sanitize a post body and derive its plain-text excerpt, word count
+    and reading time (in minutes). Code blocks are highlighted unless
+    only the text is needed.
+    """
+    parser = BodySanitizer(highlight)
+    parser.feed(body or '')
+    parser.close()
+    text = ' '.join(''.join(parser.text).split())
+    word_count = len(text.split())
+    return RenderedBody(html=''.join(parser.html),
+                        text=text,
+                        excerpt=Truncator(text).words(EXCERPT_WORDS, truncate=' ...'),
+                        word_count=word_count,
+                        reading_time=max(1, math.ceil(word_count / WORDS_PER_MINUTE)))
+
+
+def render_body_html(body):
+    """Sanitized and highlighted body HTML, for worker processes."""
+    return render_post_body(body).html
@@ -0,0 +1,96 @@
+"""
+Primary/replica database routing. Reads of the public content (posts,
+their images and tags, tag statistics, sites) go to one of the aliases in
+BLOG_DATABASE_REPLICAS; everything else, and every write, goes to the
+primary ('default'). Once a thread has written, its reads stay on the
+primary too, so a request sees its own writes. Across requests the same
+is done by blog.middleware.ReplicaPinningMiddleware.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+PRIMARY = 'default'
+
+# (app label, model name) read from the replicas
+REPLICA_MODELS = {
+    ('blog', 'post'),
+    ('blog', 'postimage'),
+    ('blog', 'taggedpost'),
+    ('blog', 'tagstat'),
+    ('taggit', 'tag'),
+    ('sites', 'site'),
+}
+
+_local = threading.local()
+
+
+def replicas():
+    return list(getattr(settings, 'BLOG_DATABASE_REPLICAS', ()))
+
+
+def pin():
+    """Send this thread's reads to the primary until reset()."""
+    _local.pinned = True
+
+
+def reset():
+    _local.pinned = False
+    _local.wrote = False
+    _local.replica = None
+
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+
+def has_written():
+    return getattr(_local, 'wrote', False)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block."""
+    pinned = is_pinned()
+    pin()
+    try:
+        yield
+    finally:
+        _local.pinned = pinned
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases:
+            return None
+        if is_pinned():
+            return PRIMARY
+        if (model._meta.app_label, model._meta.model_name) not in REPLICA_MODELS:
+            return PRIMARY
+        # One replica per request, they may lag behind by different amounts
+        replica = getattr(_local, 'replica', None)
+        if replica not in aliases:
+            replica = _local.replica = random.choice(aliases)
+        return replica
+
+    def db_for_write(self, model, **hints):
+        if not replicas():
+            return None
+        # Also for instances read from a replica
+        _local.wrote = True
+        pin()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        aliases = set(replicas()) | {PRIMARY}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
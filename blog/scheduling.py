@@ -0,0 +1,76 @@
+"""
+Scheduled publishing. Posts with a publish date in the future wait with
+status 'scheduled' (see Post.update_schedule()) and publish_due() flips
+them to 'published' when their time comes, invalidating the caches at
+that moment. Requests only ever filter on status, so their queries and
+cached pages don't depend on the current time.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_content_version, get_content_version
+from .models import Post, TaggedPost
+from .tagstats import refresh_tag_stats
+from . import related
+
+
+NEXT_PUBLISH_KEY = 'blog:next-publish:{}'
+NEXT_PUBLISH_TIMEOUT = 60 * 60 * 24
+
+
+def scheduler_interval():
+    """Longest time (seconds) between two publish_due() runs."""
+    return getattr(settings, 'BLOG_SCHEDULER_INTERVAL', 60)
+
+
+def publish_due(now=None):
+    """Publish the scheduled posts whose date has passed, returns how many."""
+    now = now or timezone.now()
+    due = Post.objects.filter(status='scheduled', publish__lte=now)
+    pks = list(due.order_by().values_list('pk', flat=True))
+    if not pks:
+        return 0
+    # A single UPDATE; an editor may have moved a post meanwhile, hence
+    # the repeated conditions. Search and tag assignments don't change;
+    # updated moves, for the sitemap's lastmod and Last-Modified.
+    published = due.filter(pk__in=pks).update(status='published', updated=now)
+    if published:
+        refresh_tag_stats(TaggedPost.objects.filter(content_object_id__in=pks)
+                                            .values_list('tag_id', flat=True))
+        for pk in pks:
+            related.update_post(pk)
+        transaction.on_commit(bump_content_version)
+    return published
+
+
+def next_scheduled_publish():
+    """
+    Publish date of the next scheduled post, or None. Cached under the
+    content version, which changes whenever a post is saved.
+    """
+    key = NEXT_PUBLISH_KEY.format(get_content_version())
+    entry = cache.get(key)
+    if entry is None:
+        entry = {'publish': Post.objects.filter(status='scheduled')
+                                        .order_by('publish')
+                                        .values_list('publish', flat=True)
+                                        .first()}
+        cache.set(key, entry, NEXT_PUBLISH_TIMEOUT)
+    return entry['publish']
+
+
+def cache_timeout(timeout, now=None):
+    """
+    Shorten timeout (seconds) so that content cached now expires when the
+    next scheduled post goes out.
+    """
+    upcoming = next_scheduled_publish()
+    now = now or timezone.now()
+    if upcoming is None:
+        return timeout
+    if upcoming <= now:
+        # Due, but publish_due() hasn't run yet; it will within an interval
+        return max(1, min(timeout, int(scheduler_interval())))
+    return max(1, min(timeout, int((upcoming - now).total_seconds()) + 1))
@@ -0,0 +1,286 @@
+import base64
+import binascii
+import math
+import re
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import Count
+from django.dispatch import receiver
+from django.utils.html import escape
+
+from .models import Post, SearchTerm
+from .rendering import render_post_body
+
+
+FTS_TABLE = 'blog_post_fts'
+# Relative weight of a match in each indexed field
+FIELD_WEIGHTS = (('title', 10.0), ('subtitle', 5.0), ('body', 1.0), ('tags', 3.0))
+SNIPPET_WORDS = 24
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+SearchResult = namedtuple('SearchResult', ['post', 'score', 'snippet'])
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class SearchPage(object):
+    """One page of ranked results plus the cursor of the next page."""
+    def __init__(self, results, next_cursor):
+        self.results = results
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    def has_next(self):
+        return bool(self.next_cursor)
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower())
+
+
+def encode_cursor(score, pk):
+    value = '{!r}|{}'.format(score, pk)
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return float(score), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def _highlight(word, terms):
+    parts = []
+    position = 0
+    for match in WORD_RE.finditer(word):
+        parts.append(escape(word[position:match.start()]))
+        if match.group().lower() in terms:
+            parts.append('<mark>{}</mark>'.format(escape(match.group())))
+        else:
+            parts.append(escape(match.group()))
+        position = match.end()
+    parts.append(escape(word[position:]))
+    return ''.join(parts)
+
+
+def make_snippet(text, terms):
+    """Plain-text fallback snippet around the first matching word."""
+    words = text.split()
+    start = next((i for i, word in enumerate(words) if terms.intersection(tokenize(word))), 0)
+    start = max(0, start - SNIPPET_WORDS // 4)
+    snippet = ' '.join(_highlight(word, terms) for word in words[start:start + SNIPPET_WORDS])
+    if start > 0:
+        snippet = '&hellip; ' + snippet
+    if start + SNIPPET_WORDS < len(words):
+        snippet += ' &hellip;'
+    return snippet
+
+
+def _document(post):
+    return {
+        'title': post.title,
+        'subtitle': post.subtitle,
+        'body': render_post_body(post.body, highlight=False).text,
+        'tags': ' '.join(tag.name for tag in post.tags.all()),
+    }
+
+
+class FTS5Backend(object):
+    """
+    SQLite FTS5 virtual table created by migration 0007, with the post
+    id as rowid. Results are ranked with bm25().
+    """
+
+    def index(self, post):
+        document = _document(post)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [post.pk])
+            cursor.execute('INSERT INTO {} (rowid, title, subtitle, body, tags) '
+                           'VALUES (%s, %s, %s, %s, %s)'.format(FTS_TABLE),
+                           [post.pk, document['title'], document['subtitle'],
+                            document['body'], document['tags']])
+
+    def remove(self, post_pk):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [post_pk])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+
+    def match_expression(self, terms):
+        # Quote every term, so user input can't inject FTS5 query syntax
+        return ' '.join('"{}"'.format(term) for term in terms)
+
+    def filter_queryset(self, queryset, terms):
+        # RawSQL would be wrapped in a second pair of parentheses and
+        # compared as a scalar, so the subquery goes in through extra().
+        return queryset.extra(
+            where=['{0}.id IN (SELECT rowid FROM {1} WHERE {1} MATCH %s)'.format(
+                connection.ops.quote_name(Post._meta.db_table), FTS_TABLE)],
+            params=[self.match_expression(terms)])
+
+    def search(self, terms, limit, after=None):
+        weights = ', '.join(str(weight) for field, weight in FIELD_WEIGHTS)
+        # Snippet markers are control characters, so the text can be
+        # escaped before they are turned into <mark> tags.
+        sql = ('SELECT * FROM ('
+               '  SELECT {0}.rowid AS pk, bm25({0}, {1}) AS score,'
+               '         snippet({0}, 2, char(2), char(3), char(1), {2}) AS snippet'
+               '  FROM {0} JOIN blog_post ON blog_post.id = {0}.rowid'
+               '  WHERE {0} MATCH %s AND blog_post.status = %s'
+               ') '.format(FTS_TABLE, weights, SNIPPET_WORDS))
+        params = [self.match_expression(terms), 'published']
+        if after:
+            sql += 'WHERE score > %s OR (score = %s AND pk > %s) '
+            params += [after[0], after[0], after[1]]
+        sql += 'ORDER BY score, pk LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return [(pk, score, escape(snippet).replace('\x02', '<mark>')
+                                           .replace('\x03', '</mark>')
+                                           .replace('\x01', '&hellip;'))
+                for pk, score, snippet in rows]
+
+
+class PythonBackend(object):
+    """
+    Inverted index in the SearchTerm table, one row per post and term,
+    ranked with a weighted tf-idf computed in Python.
+    """
+
+    def index(self, post):
+        weights = defaultdict(float)
+        document = _document(post)
+        for field, weight in FIELD_WEIGHTS:
+            for term in tokenize(document[field]):
+                weights[term[:SearchTerm._meta.get_field('term').max_length]] += weight
+        SearchTerm.objects.filter(post_id=post.pk).delete()
+        SearchTerm.objects.bulk_create([SearchTerm(term=term, post_id=post.pk, weight=weight)
+                                        for term, weight in weights.items()])
+
+    def remove(self, post_pk):
+        SearchTerm.objects.filter(post_id=post_pk).delete()
+
+    def clear(self):
+        SearchTerm.objects.all().delete()
+
+    def _matching(self, terms):
+        # Posts containing every term
+        return SearchTerm.objects.filter(term__in=terms)\
+                                 .values('post_id')\
+                                 .annotate(matched=Count('term', distinct=True))\
+                                 .filter(matched=len(set(terms)))\
+                                 .values('post_id')
+
+    def filter_queryset(self, queryset, terms):
+        return queryset.filter(pk__in=self._matching(terms))
+
+    def search(self, terms, limit, after=None):
+        published = Post.published.filter(pk__in=self._matching(terms)).values('pk')
+        rows = SearchTerm.objects.filter(term__in=terms, post__in=published)\
+                                 .values_list('post_id', 'term', 'weight')
+        total = Post.published.count() or 1
+        document_frequency = dict(SearchTerm.objects.filter(term__in=terms, post__in=Post.published.all())
+                                                    .values_list('term')
+                                                    .annotate(Count('post_id')))
+        scores = defaultdict(float)
+        for post_pk, term, weight in rows:
+            idf = math.log(1 + total / document_frequency[term])
+            # Negated, so lower is better as with bm25()
+            scores[post_pk] -= weight * idf
+        ranked = sorted((score, pk) for pk, score in scores.items())
+        if after:
+            ranked = [item for item in ranked if item > after]
+        return [(pk, score, None) for score, pk in ranked[:limit]]
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'BLOG_SEARCH_BACKEND', 'auto')
+        if name == 'auto':
+            name = 'fts5' if fts5_table_exists() else 'python'
+        _backend = FTS5Backend() if name == 'fts5' else PythonBackend()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(**kwargs):
+    global _backend
+    if kwargs.get('setting', 'BLOG_SEARCH_BACKEND') == 'BLOG_SEARCH_BACKEND':
+        _backend = None
+
+
+def fts5_table_exists():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        return FTS_TABLE in connection.introspection.table_names(cursor)
+
+
+def index_post(post):
+    get_backend().index(post)
+
+
+def remove_post(post_pk):
+    get_backend().remove(post_pk)
+
+
+def filter_queryset(queryset, query):
+    """Restrict a Post queryset to posts matching every word of query."""
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+    return get_backend().filter_queryset(queryset, terms)
+
+
+def search(query, per_page=10, cursor=None):
+    """
+    Ranked search over published posts. Returns a SearchPage of
+    SearchResult; pass its next_cursor back in to get the next page.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return SearchPage([], '')
+    after = decode_cursor(cursor) if cursor else None
+    rows = get_backend().search(terms, per_page + 1, after)
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    posts = Post.published.select_related('author')
+    if all(snippet is not None for pk, score, snippet in rows):
+        # Bodies are only needed to build snippets the index didn't
+        posts = posts.summary()
+    posts = posts.in_bulk([pk for pk, score, snippet in rows])
+    results = []
+    for pk, score, snippet in rows:
+        post = posts.get(pk)
+        if post is None:
+            continue
+        if snippet is None:
+            snippet = make_snippet(render_post_body(post.body, highlight=False).text, set(terms))
+        results.append(SearchResult(post, score, snippet))
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if has_next else ''
+    return SearchPage(results, next_cursor)
@@ -0,0 +1,130 @@
+import threading
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from taggit.models import Tag
+
+from .cache import bump_content_version
+from .models import Post, PostImage, TaggedPost
+from . import search, images, tagstats, related, sqlite
+
+
+# Posts being deleted, see update_related_of_deleted_post()
+_deleting = threading.local()
+# Posts whose tags taggit is changing, see update_related_of_retagged_post()
+_tagging = threading.local()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=TaggedPost)
+@receiver(post_delete, sender=TaggedPost)
+def invalidate_page_cache(sender, **kwargs):
+    """
+    Any change to the content makes every cached page stale, once it
+    commits: a page rendered before that would be cached under the new
+    version with the old rows.
+    """
+    transaction.on_commit(bump_content_version)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_index(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=TaggedPost)
+@receiver(post_delete, sender=TaggedPost)
+def reindex_tagged_post(sender, instance, **kwargs):
+    """Tag names are part of the search index."""
+    post = Post.objects.filter(pk=instance.content_object_id).first()
+    if post is not None:
+        search.index_post(post)
+
+
+@receiver(post_save, sender=Post)
+def update_tag_stats_of_post(sender, instance, raw=False, **kwargs):
+    """Status and publish date of a post count towards its tags."""
+    if not raw:
+        tagstats.refresh_tag_stats(instance.tagged_items.values_list('tag_id', flat=True))
+
+
+@receiver(post_save, sender=TaggedPost)
+@receiver(post_delete, sender=TaggedPost)
+def update_tag_stats_of_tag(sender, instance, raw=False, **kwargs):
+    # Deleting a post cascades to its TaggedPost rows, which lands here too
+    if not raw:
+        tagstats.refresh_tag_stats([instance.tag_id])
+
+
+# After update_tag_stats_*, related posts are scored with the new counts
+@receiver(post_save, sender=Post)
+def update_related_of_post(sender, instance, created=False, raw=False, **kwargs):
+    # Body and title edits don't move a post in anybody's list
+    state = instance.ranking_state()
+    if not raw and (created or state != getattr(instance, '_saved_ranking', None)):
+        related.schedule_update(instance.pk)
+    instance._saved_ranking = state
+
+
+@receiver(post_save, sender=TaggedPost)
+@receiver(post_delete, sender=TaggedPost)
+def update_related_of_tagged_post(sender, instance, raw=False, **kwargs):
+    post_id = instance.content_object_id
+    if raw or post_id in getattr(_deleting, 'posts', {}) or post_id in getattr(_tagging, 'posts', ()):
+        return
+    related.schedule_update(post_id)
+
+
+@receiver(m2m_changed, sender=TaggedPost)
+def update_related_of_retagged_post(sender, instance, action, reverse, pk_set, **kwargs):
+    """post.tags.add()/remove()/clear() write a row per tag; update once."""
+    if reverse or not isinstance(instance, Post):
+        return
+    if not hasattr(_tagging, 'posts'):
+        _tagging.posts = set()
+    if action.startswith('pre_'):
+        _tagging.posts.add(instance.pk)
+    else:
+        _tagging.posts.discard(instance.pk)
+        if pk_set or action == 'post_clear':
+            related.schedule_update(instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def collect_related_of_deleted_post(sender, instance, **kwargs):
+    if not hasattr(_deleting, 'posts'):
+        _deleting.posts = {}
+    _deleting.posts[instance.pk] = related.holders(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def update_related_of_deleted_post(sender, instance, **kwargs):
+    """
+    The cascade removes the post's entries. The lists it was in are
+    refilled once it's gone, its tag assignments are skipped meanwhile.
+    """
+    related.refresh_lists(_deleting.posts.pop(instance.pk, ()))
+
+
+@receiver(post_save, sender=PostImage)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and instance.needs_derivatives():
+        images.schedule_derivatives(instance)
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    sqlite.configure_connection(sender, connection)
@@ -1,5 +1,17 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sites.shortcuts import get_current_site
+from django.db.models import Count, Max, F
+from django.http import StreamingHttpResponse, Http404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import escape
+from django.views.decorators.http import condition
+
 from .models import Post
+from .pagination import MAX_BIGINT
 
 
 class PostSitemap(Sitemap):
@@ -14,4 +26,117 @@ class PostSitemap(Sitemap):
 
     def lastmod(self, obj):
         """Return last modification of a post."""
-        return obj.publish
+        return obj.updated
+
+
+def shard_size():
+    return getattr(settings, 'BLOG_SITEMAP_SHARD_SIZE', 1000)
+
+
+def shard_queryset(shard):
+    """
+    Published posts of a shard. Shards are fixed primary key ranges, so a
+    new post only ever changes the last shard and the others stay cacheable.
+    """
+    size = shard_size()
+    return Post.published.filter(pk__gt=shard * size, pk__lte=(shard + 1) * size)
+
+
+def shard_rows(shard):
+    """The only columns a shard's <url> entries need, by primary key."""
+    return shard_queryset(shard).order_by('pk').values_list('slug', 'publish', 'updated')
+
+
+def shard_stats():
+    """Newest update and number of posts for every non-empty shard."""
+    return Post.published.annotate(shard=(F('id') - 1) / shard_size())\
+                         .order_by()\
+                         .values('shard')\
+                         .annotate(lastmod=Max('updated'), count=Count('id'))\
+                         .order_by('shard')
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _w3c_date(value):
+    if not value:
+        return ''
+    return timezone.localtime(value, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+def _index_stats(request):
+    if not hasattr(request, '_sitemap_stats'):
+        request._sitemap_stats = list(shard_stats())
+    return request._sitemap_stats
+
+
+def _index_etag(request):
+    return _etag('index', shard_size(),
+                 *['{shard}:{count}:{lastmod}'.format(**stats) for stats in _index_stats(request)])
+
+
+def _index_last_modified(request):
+    return max((stats['lastmod'] for stats in _index_stats(request)), default=None)
+
+
+@condition(etag_func=_index_etag, last_modified_func=_index_last_modified)
+def sitemap_index(request):
+    """Sitemap index listing one sitemap per non-empty shard."""
+    base = '{}://{}'.format(request.scheme, get_current_site(request).domain)
+
+    def generate():
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for stats in _index_stats(request):
+            yield ('<sitemap><loc>{}{}</loc><lastmod>{}</lastmod></sitemap>\n'.format(
+                base, reverse('sitemap_posts', args=[stats['shard']]), _w3c_date(stats['lastmod'])))
+        yield '</sitemapindex>\n'
+    return StreamingHttpResponse(generate(), content_type='application/xml')
+
+
+def _shard_stats(request, shard):
+    if not hasattr(request, '_sitemap_shard'):
+        if int(shard) * shard_size() >= MAX_BIGINT:
+            # No primary key that large; the database would reject the bound
+            raise Http404('Empty sitemap shard')
+        request._sitemap_shard = shard_queryset(int(shard)).aggregate(lastmod=Max('updated'),
+                                                                      count=Count('id'))
+    return request._sitemap_shard
+
+
+def _shard_etag(request, shard):
+    stats = _shard_stats(request, shard)
+    return _etag('posts', shard_size(), shard, stats['count'], stats['lastmod'])
+
+
+def _shard_last_modified(request, shard):
+    return _shard_stats(request, shard)['lastmod']
+
+
+@condition(etag_func=_shard_etag, last_modified_func=_shard_last_modified)
+def sitemap_shard(request, shard):
+    """
+    One shard of the post sitemap, streamed straight from a database
+    iterator over the few columns a <url> entry needs.
+    """
+    if not _shard_stats(request, shard)['count']:
+        raise Http404('Empty sitemap shard')
+    base = '{}://{}'.format(request.scheme, get_current_site(request).domain)
+    rows = shard_rows(int(shard)).iterator()
+
+    def generate():
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for slug, publish, updated in rows:
+            location = reverse('blog:post_detail', args=[publish.year,
+                                                         publish.strftime('%m'),
+                                                         publish.strftime('%d'),
+                                                         slug])
+            yield ('<url><loc>{}{}</loc><lastmod>{}</lastmod>'
+                   '<changefreq>{}</changefreq><priority>{}</priority></url>\n'.format(
+                       base, escape(location), _w3c_date(updated),
+                       PostSitemap.changefreq, PostSitemap.priority))
+        yield '</urlset>\n'
+    return StreamingHttpResponse(generate(), content_type='application/xml')
@@ -0,0 +1,68 @@
+"""
+SQLite production profile. Every new connection gets BLOG_SQLITE_PRAGMAS
+(see blog.signals): write-ahead logging, so readers and the writer don't
+block each other, synchronous=NORMAL, which is safe with WAL, a memory
+map and a larger page cache, and a busy timeout for concurrent writers.
+The sqlite_maintenance command checkpoints the WAL and runs
+`PRAGMA optimize`.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+
+
+# Applied in this order; journal_mode first, the others may depend on it
+DEFAULT_PRAGMAS = OrderedDict([
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('busy_timeout', 5000),
+    ('cache_size', -64000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'memory'),
+])
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+def pragmas():
+    return getattr(settings, 'BLOG_SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+
+
+def apply_pragmas(cursor, values=None):
+    """Set pragmas on a DB-API cursor; returns {name: value read back}."""
+    values = pragmas() if values is None else values
+    applied = OrderedDict()
+    for name, value in values.items():
+        # Names and values come from settings, not from users
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.execute('PRAGMA {}'.format(name))
+        row = cursor.fetchone()
+        applied[name] = row[0] if row else None
+    return applied
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if connection.vendor == 'sqlite' and pragmas():
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor)
+
+
+def sqlite_aliases():
+    return [alias for alias in connections if connections[alias].vendor == 'sqlite']
+
+
+def maintain(alias='default', mode='TRUNCATE', optimize=True):
+    """
+    Checkpoint the WAL of a database into its main file and, with
+    optimize, let SQLite refresh the statistics it deems stale. Returns
+    (busy, WAL frames, frames checkpointed).
+    """
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError('Unknown checkpoint mode {!r}'.format(mode))
+    with connections[alias].cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint({})'.format(mode))
+        result = tuple(cursor.fetchone())
+        if optimize:
+            cursor.execute('PRAGMA optimize')
+    return result
@@ -0,0 +1,162 @@
+import gzip
+import posixpath
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Third-party assets copied into blog/static/vendor/ by
+# `manage.py vendor_static`: (static path, source URL, SRI hash or None).
+# Paths keep each project's own layout, so relative url()s in their
+# stylesheets still point at the right files.
+VENDOR_ASSETS = (
+    ('vendor/jquery/jquery.min.js',
+     'https://code.jquery.com/jquery-3.2.1.min.js',
+     'sha256-hwg4gsxgFZhOsEEamdOYGBf13FyQuiTwlAQgxVSNgt4='),
+    ('vendor/bootstrap/js/bootstrap.min.js',
+     'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/js/bootstrap.min.js',
+     'sha384-Tc5IQib027qvyjSMfHjOMaLkfuWVxZxUPnCJA7l2mCWNIpG9mGCD8wGNIcPD7Txa'),
+    ('vendor/bootstrap/css/bootstrap.min.css',
+     'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/css/bootstrap.min.css',
+     'sha384-BVYiiSIFeK1dGmJRAkycuHAHRg32OmUcww7on3RYdg4Va+PmSTsz/K68vbdEjh4u'),
+) + tuple(
+    ('vendor/bootstrap/fonts/glyphicons-halflings-regular.' + extension,
+     'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/fonts/glyphicons-halflings-regular.' + extension,
+     None)
+    for extension in ('eot', 'svg', 'ttf', 'woff', 'woff2')
+) + (
+    ('vendor/font-awesome/css/font-awesome.min.css',
+     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css',
+     None),
+) + tuple(
+    ('vendor/font-awesome/fonts/fontawesome-webfont.' + extension,
+     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/fonts/fontawesome-webfont.' + extension,
+     None)
+    for extension in ('eot', 'svg', 'ttf', 'woff', 'woff2')
+) + (
+    ('vendor/cookieconsent/cookieconsent.min.css',
+     'https://cdnjs.cloudflare.com/ajax/libs/cookieconsent2/3.0.3/cookieconsent.min.css',
+     None),
+    ('vendor/cookieconsent/cookieconsent.min.js',
+     'https://cdnjs.cloudflare.com/ajax/libs/cookieconsent2/3.0.3/cookieconsent.min.js',
+     None),
+) + tuple(
+    # Latin subsets of the Google Fonts the theme uses, see css/fonts.css
+    ('vendor/fonts/{}-latin-{}-{}.woff2'.format(family, weight, style),
+     'https://cdn.jsdelivr.net/npm/@fontsource/{0}@4.5.0/files/{0}-latin-{1}-{2}.woff2'.format(
+         family, weight, style),
+     None)
+    for family, weights in (('lora', (400, 700)), ('open-sans', (300, 400, 600, 700, 800)))
+    for weight in weights
+    for style in ('normal', 'italic')
+)
+
+# Text formats worth sending compressed; images and fonts already are
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.xml', '.json', '.map', '.ico', '.eot', '.ttf')
+MIN_COMPRESS_SIZE = 256
+
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+SOURCE_MAP_RE = re.compile(r'/[*/]# sourceMappingURL=[^\n]*')
+
+
+def get_bundles():
+    return getattr(settings, 'BLOG_STATIC_BUNDLES', {})
+
+
+def rebase_css_urls(content, source, bundle):
+    """
+    Rewrite relative url()s of a stylesheet at source so they still
+    resolve when its rules are served from bundle.
+    """
+    def rebase(match):
+        quote, url = match.groups()
+        if re.match(r'^([a-z][a-z0-9+.-]*:|/|#)', url, re.I):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        rebased = posixpath.relpath(target, posixpath.dirname(bundle) or '.')
+        return 'url({0}{1}{2}{0})'.format(quote, rebased, suffix)
+    return CSS_URL_RE.sub(rebase, content)
+
+
+def concatenate(bundle, sources):
+    """Contents of sources, a list of (path, text) pairs, as one file."""
+    parts = []
+    for path, text in sources:
+        # Maps of the individual files would not match the bundle
+        text = SOURCE_MAP_RE.sub('', text).strip()
+        if bundle.endswith('.css'):
+            parts.append(rebase_css_urls(text, path, bundle))
+        else:
+            # A file without a trailing semicolon must not run into the next
+            parts.append(text + ';')
+    return '\n'.join(parts) + '\n'
+
+
+def compressed_copies(content):
+    """(suffix, bytes) of the precompressed variants worth keeping."""
+    copies = [('.gz', gzip.compress(content, 9))]
+    if brotli is not None:
+        copies.append(('.br', brotli.compress(content)))
+    return [(suffix, data) for suffix, data in copies if len(data) < len(content)]
+
+
+class BundledManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that, at collectstatic time, first concatenates the
+    BLOG_STATIC_BUNDLES into single files, then hashes everything as usual
+    and finally writes .gz (and, with the brotli module, .br) copies next
+    to the hashed files, for the web server to serve with gzip_static /
+    brotli_static and far-future expiry headers.
+    """
+
+    def build_bundles(self, paths):
+        for bundle, sources in get_bundles().items():
+            missing = [source for source in sources if source not in paths]
+            if missing:
+                raise ValueError('Bundle {} is missing {} (run `manage.py vendor_static`?)'.format(
+                    bundle, ', '.join(missing)))
+            texts = []
+            for source in sources:
+                storage, path = paths[source]
+                with storage.open(path) as source_file:
+                    texts.append((source, source_file.read().decode('utf-8')))
+            if self.exists(bundle):
+                self.delete(bundle)
+            self.save(bundle, ContentFile(concatenate(bundle, texts).encode('utf-8')))
+            yield bundle
+
+    def compress(self, name):
+        if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as original:
+            content = original.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for suffix, data in compressed_copies(content):
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self.save(name + suffix, ContentFile(data))
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        paths = OrderedDict(paths)
+        for bundle in self.build_bundles(paths):
+            paths[bundle] = (self, bundle)
+        processed = OrderedDict()
+        for name, hashed_name, post_processed in super(BundledManifestStaticFilesStorage, self)\
+                .post_process(paths, dry_run, **options):
+            if isinstance(hashed_name, str):
+                processed[hashed_name] = True
+            yield name, hashed_name, post_processed
+        for hashed_name in processed:
+            self.compress(hashed_name)
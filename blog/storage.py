@@ -0,0 +1,94 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files after the SHA-256 of their
+    content, e.g. images/ab/ab12...ef.jpg. The digest is computed while
+    the upload is streamed to a temporary file chunk by chunk, and a file
+    that is already stored is not written a second time.
+
+    Only the top directory of the requested name is kept, so the same
+    screenshot uploaded through CKEditor on different days (uploads/
+    2017/05/11/...) still ends up as one file. CKEditor thumbnails of a
+    stored original (<digest>_thumb.<ext> next to <digest>.<ext>) are
+    kept under that name; any other upload is hashed, whatever its name.
+    """
+    chunk_size = 64 * 1024
+    thumbnail_re = re.compile(r'^([0-9a-f]{64})_thumb(\.[^./]*)?$')
+
+    def is_thumbnail(self, name):
+        name = name.replace('\\', '/')
+        directory, basename = os.path.split(name)
+        match = self.thumbnail_re.match(basename)
+        if not match:
+            return False
+        digest, extension = match.group(1), match.group(2) or ''
+        if os.path.basename(directory) != digest[:2]:
+            return False
+        return self.exists(os.path.join(directory, digest + extension))
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content has been hashed
+        if self.is_thumbnail(name):
+            return name
+        return super(ContentAddressedStorage, self).get_available_name(name, max_length)
+
+    def top_dir(self, name):
+        name = name.replace('\\', '/')
+        return name.split('/', 1)[0] if '/' in name else ''
+
+    def hashed_name(self, name, digest):
+        top_dir = self.top_dir(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(top_dir, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        if self.is_thumbnail(name):
+            if self.exists(name):
+                return name
+            return super(ContentAddressedStorage, self)._save(name, content)
+
+        top_dir = self.path(self.top_dir(name))
+        os.makedirs(top_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        # Temporary file in the same file system, so it can be renamed
+        # into place atomically.
+        descriptor, temp_path = tempfile.mkstemp(prefix='.upload-', dir=top_dir)
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            final_name = self.hashed_name(name, digest.hexdigest())
+            final_path = self.path(final_name)
+            if os.path.exists(final_path):
+                # Duplicate upload
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(temp_path, final_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(final_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return final_name.replace('\\', '/')
+
+
+def referenced_media_names(body, media_url=None):
+    """
+    Storage names of the media files a post body links to, for instance
+    'uploads/ab/ab12...ef.png' for src="/media/uploads/ab/ab12...ef.png".
+    """
+    media_url = media_url or settings.MEDIA_URL
+    pattern = re.compile(r'''(?:src|href)\s*=\s*["'](?:https?://[^/"']+)?{}([^"'?#]+)'''.format(
+        re.escape(media_url)))
+    return set(pattern.findall(body or ''))
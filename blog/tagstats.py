@@ -0,0 +1,60 @@
+import math
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import TaggedPost, TagStat
+
+
+CLOUD_SIZES = 5
+
+
+def refresh_tag_stats(tag_ids=None):
+    """
+    Recount published posts for the given tags, or for every tag. Only
+    the rows of the tags involved in a change are touched, each with one
+    aggregate over the tag's TaggedPost rows.
+    """
+    assignments = TaggedPost.objects.filter(content_object__status='published')
+    if tag_ids is not None:
+        tag_ids = set(tag_ids)
+        if not tag_ids:
+            return
+        assignments = assignments.filter(tag_id__in=tag_ids)
+    rows = assignments.values('tag_id')\
+                      .annotate(post_count=Count('content_object', distinct=True),
+                                latest_publish=Max('content_object__publish'))\
+                      .order_by()
+    with transaction.atomic():
+        counted = set()
+        for row in rows:
+            TagStat.objects.update_or_create(tag_id=row['tag_id'],
+                                             defaults={'post_count': row['post_count'],
+                                                       'latest_publish': row['latest_publish']})
+            counted.add(row['tag_id'])
+        # Tags without published posts don't get a row
+        stale = TagStat.objects.exclude(tag_id__in=counted)
+        if tag_ids is not None:
+            stale = stale.filter(tag_id__in=tag_ids)
+        stale.delete()
+
+
+def tag_cloud(limit=None):
+    """
+    TagStats of the most used tags in alphabetical order, each with a
+    size from 1 to CLOUD_SIZES on a logarithmic scale of its post count.
+    """
+    stats = TagStat.objects.select_related('tag').order_by('-post_count', 'tag__name')
+    if limit:
+        stats = stats[:limit]
+    stats = list(stats)
+    if not stats:
+        return []
+    smallest = math.log(min(stat.post_count for stat in stats))
+    spread = math.log(max(stat.post_count for stat in stats)) - smallest
+    for stat in stats:
+        if spread:
+            stat.size = 1 + int(round((math.log(stat.post_count) - smallest) / spread * (CLOUD_SIZES - 1)))
+        else:
+            stat.size = 1
+    return sorted(stats, key=lambda stat: stat.tag.name.lower())
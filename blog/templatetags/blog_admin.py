@@ -0,0 +1,102 @@
+import datetime
+
+from django import template
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+from django.utils.translation import ugettext as _
+
+from ..admin import date_range
+
+register = template.Library()
+
+
+def _has_rows(queryset, field_name, *parts):
+    start, end = date_range(*parts)
+    return queryset.filter(**{field_name + '__gte': start, field_name + '__lt': end}).exists()
+
+
+def _edge(queryset, field_name, ordering):
+    value = queryset.order_by(ordering).values_list(field_name, flat=True).first()
+    if value is not None and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def range_date_hierarchy(cl):
+    """
+    Django's date_hierarchy, with the choices found by probing each year,
+    month or day with an indexed range query instead of listing distinct
+    dates, which reads every row. Filtering is done by RangeDateChangeList.
+    """
+    if not cl.date_hierarchy:
+        return {'show': False}
+    field_name = cl.date_hierarchy
+    year_field = '%s__year' % field_name
+    month_field = '%s__month' % field_name
+    day_field = '%s__day' % field_name
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    day_lookup = cl.params.get(day_field)
+    queryset = cl.queryset.order_by()
+
+    def link(filters):
+        return cl.get_query_string(filters, ['%s__' % field_name])
+
+    if not year_lookup:
+        # Both ends come from the index, one row each
+        first = _edge(queryset, field_name, field_name)
+        last = _edge(queryset, field_name, '-' + field_name)
+        if first is None:
+            return {'show': True, 'choices': []}
+        if first.year == last.year:
+            year_lookup = first.year
+            if first.month == last.month:
+                month_lookup = first.month
+        else:
+            return {
+                'show': True,
+                'choices': [{
+                    'link': link({year_field: str(year)}),
+                    'title': str(year),
+                } for year in range(first.year, last.year + 1)
+                    if _has_rows(queryset, field_name, year)]
+            }
+
+    year, month = int(year_lookup), month_lookup and int(month_lookup)
+    if month and day_lookup:
+        day = datetime.date(year, month, int(day_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup, month_field: month_lookup}),
+                'title': capfirst(formats.date_format(day, 'YEAR_MONTH_FORMAT'))
+            },
+            'choices': [{'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT'))}]
+        }
+    elif month:
+        start = datetime.date(year, month, 1)
+        days = [start + datetime.timedelta(days=offset) for offset in range(31)]
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup}),
+                'title': str(year_lookup)
+            },
+            'choices': [{
+                'link': link({year_field: year_lookup, month_field: month_lookup, day_field: day.day}),
+                'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT'))
+            } for day in days
+                if day.month == month and _has_rows(queryset, field_name, year, month, day.day)]
+        }
+    return {
+        'show': True,
+        'back': {
+            'link': link({}),
+            'title': _('All dates')
+        },
+        'choices': [{
+            'link': link({year_field: year_lookup, month_field: month}),
+            'title': capfirst(formats.date_format(datetime.date(year, month, 1), 'YEAR_MONTH_FORMAT'))
+        } for month in range(1, 13) if _has_rows(queryset, field_name, year, month)]
+    }
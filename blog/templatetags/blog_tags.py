@@ -0,0 +1,127 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from django.utils.html import escape, format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from .. import instrumentation
+from ..staticfiles import BundledManifestStaticFilesStorage, VENDOR_ASSETS, get_bundles
+
+register = template.Library()
+
+
+def _candidates(image, format='jpg'):
+    """(url, width) pairs for an image, narrowest first, original last."""
+    candidates = [(default_storage.url(derivative['name']), derivative['width'])
+                  for derivative in image.get_derivatives(format)]
+    if format == 'jpg' or not candidates:
+        candidates.append((image.image.url, image.width))
+    return candidates
+
+
+@register.filter
+def srcset(image, format='jpg'):
+    """
+    srcset attribute value listing the resized copies of a PostImage.
+    Usage: <img src="{{ image.image.url }}" srcset="{{ image|srcset }}">
+    """
+    if not image:
+        return ''
+    return ', '.join('{} {}w'.format(url, width) if width else url
+                     for url, width in _candidates(image, format))
+
+
+@register.simple_tag
+def responsive_background(image, selector):
+    """
+    <style> block giving selector the smallest copy of image that still
+    covers the viewport width, for CSS backgrounds where srcset can't be used.
+    """
+    if not image:
+        return ''
+    rules = []
+    previous_width = None
+    for url, width in _candidates(image):
+        rule = "{} {{ background-image: url('{}'); }}".format(selector, escape(url))
+        if previous_width:
+            rule = '@media (min-width: {}px) {{ {} }}'.format(previous_width + 1, rule)
+        rules.append(rule)
+        previous_width = width
+    return format_html('<style>{}</style>', mark_safe('\n'.join(rules)))
+
+
+def _source_tags(source):
+    """
+    (url, extra attributes) of one bundle source. Vendored files that
+    `manage.py vendor_static` hasn't fetched yet come from their CDN.
+    """
+    for path, url, expected in VENDOR_ASSETS:
+        if path == source and not finders.find(source):
+            if expected:
+                return url, format_html(' integrity="{}" crossorigin="anonymous"', expected)
+            return url, ''
+    return static(source), ''
+
+
+@register.simple_tag
+def static_bundle(name):
+    """
+    <link> or <script> tag for one of the BLOG_STATIC_BUNDLES. The hashed
+    bundle is only built by collectstatic with the bundling storage, so
+    elsewhere (development, tests) every source file gets its own tag.
+    """
+    if isinstance(staticfiles_storage, BundledManifestStaticFilesStorage):
+        tags = [(static(name), '')]
+    else:
+        tags = [_source_tags(source) for source in get_bundles()[name]]
+    if name.endswith('.css'):
+        return format_html_join('\n', '<link rel="stylesheet" href="{}"{}>', tags)
+    return format_html_join('\n', '<script src="{}"{} defer></script>', tags)
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        timeout = getattr(settings, 'BLOG_FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+        if not timeout:
+            return self.nodelist.render(context)
+        values = '|'.join(str(variable.resolve(context)) for variable in self.vary_on)
+        # The shared cache outlives a deploy, the templates and static names don't
+        key = 'blog:fragment:{}:{}:{}'.format(getattr(settings, 'BLOG_FRAGMENT_CACHE_VERSION', ''), self.name,
+                                              hashlib.md5(values.encode('utf-8')).hexdigest())
+        content = cache.get(key)
+        instrumentation.record_cache(content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, timeout)
+        return content
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Cache the enclosed part of a template for BLOG_FRAGMENT_CACHE_TIMEOUT
+    seconds, keyed by BLOG_FRAGMENT_CACHE_VERSION, its name and the values
+    of the given variables.
+    Usage: {% cachedfragment "pagination" page.number %}...{% endcachedfragment %}
+
+    Only for markup that is the same for every visitor, the fragments
+    are shared between users.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2 or bits[1][0] not in '"\'' or bits[1][0] != bits[1][-1]:
+        raise template.TemplateSyntaxError('{} needs a quoted fragment name'.format(bits[0]))
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    return FragmentCacheNode(nodelist, bits[1][1:-1],
+                             [parser.compile_filter(bit) for bit in bits[2:]])
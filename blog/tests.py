@@ -1,16 +1,88 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory
 from django.utils import timezone
 # from django.core.urlresolvers import reverse  # Deprecated since version 1.10
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse
 from django.core.paginator import Paginator, InvalidPage
 from django.core.mail import send_mail, BadHeaderError
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.files.storage import default_storage, FileSystemStorage
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.conf import settings
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template import Context, Template
+from django.db import connection, router, transaction
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core import mail
+from unittest import mock, skipUnless
+from io import StringIO, BytesIO
+from PIL import Image
+from concurrent.futures import Future
+import base64
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+import socketserver
+import sqlite3
+import threading
+import json
+import time
 
 
-from blog.models import Post, PostImage
+from taggit.models import Tag
+
+from blog.models import Post, PostImage, OutboxMessage, TagStat, RelatedPost
+from blog.mail import queue_mail, deliver_outbox
+from blog import mail as mail_utils
+from blog import recaptcha, search
+from blog.storage import ContentAddressedStorage
+from blog.staticfiles import BundledManifestStaticFilesStorage, brotli
 from blog.forms import ContactForm
-from blog import sitemaps, feeds
+from blog import sitemaps, feeds, views, benchmark, archive, routers, scheduling, related, images
+from blog import sqlite as sqlite_profile
+from blog.rendering import render_post_body
+from blog.middleware import ReplicaPinningMiddleware
+from blog.cache import bump_content_version, cache_page_versioned, get_content_version, make_page_key
+from blog.pagination import KeysetPaginator, encode_cursor
+
+
+def make_image(name, width, height, image_format='JPEG'):
+    """Uploaded image file of the given size."""
+    content = BytesIO()
+    Image.new('RGB', (width, height), (200, 100, 50)).save(content, image_format)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+def temporary_media_root(test_class):
+    """Class decorator: the tests upload to a MEDIA_ROOT of their own, removed afterwards."""
+    media_root = tempfile.mkdtemp()
+    test_class = override_settings(MEDIA_ROOT=media_root)(test_class)
+    tear_down_class = test_class.tearDownClass
+
+    def tearDownClass(cls):
+        try:
+            tear_down_class()
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+    test_class.tearDownClass = classmethod(tearDownClass)
+    return test_class
+
+
+def run_commit_hooks():
+    """Run the transaction.on_commit() callbacks; TestCase never commits."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for savepoints, callback in callbacks:
+        callback()
 
 
 class PostListTest(TestCase):
@@ -18,6 +90,8 @@ class PostListTest(TestCase):
     def setUp(self):
         self.c = Client()
         self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        # Pages cached by other tests would bypass template rendering
+        cache.clear()
 
     def test_post_list_access(self):
         """Get a page which shows all blog post at url/blog/."""
@@ -190,6 +264,70 @@ class TestAdminPanel(TestCase):
             assert resp.status_code == 200
 
 
+@temporary_media_root
+class PostChangeListTest(TestCase):
+    """Testing the Post changelist on large tables."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.posts = [Post.objects.create(title='Post {}'.format(n), slug='post-{}'.format(n),
+                                          author=self.user, body='Long body', status='published',
+                                          publish=timezone.make_aware(timezone.datetime(year, month, 10)))
+                      for n, (year, month) in enumerate([(2016, 5), (2017, 3), (2017, 3), (2017, 8)])]
+
+    def test_changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/blog/post/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 4)
+        sql = [query['sql'] for query in queries.captured_queries if '"blog_post"' in query['sql']]
+        self.assertFalse([query for query in sql if '"blog_post"."body' in query])
+        self.assertFalse([query for query in sql if 'django_datetime' in query or 'DISTINCT' in query])
+        self.assertFalse([query for query in sql if 'COUNT' in query and 'LIMIT' not in query])
+
+    @override_settings(BLOG_ADMIN_COUNT_LIMIT=2)
+    def test_capped_count(self):
+        response = self.client.get('/admin/blog/post/')
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertContains(response, 'More than 2 matches')
+        response = self.client.get('/admin/blog/post/', {'publish__year': 2016})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertNotContains(response, 'More than 2 matches')
+
+    def test_date_hierarchy(self):
+        response = self.client.get('/admin/blog/post/')
+        self.assertEqual([choice['title'] for choice in response.context['choices']], ['2016', '2017'])
+        response = self.client.get('/admin/blog/post/', {'publish__year': 2017})
+        self.assertEqual(set(response.context['cl'].result_list), set(self.posts[1:]))
+        self.assertEqual([choice['title'] for choice in response.context['choices']],
+                         ['March 2017', 'August 2017'])
+        response = self.client.get('/admin/blog/post/', {'publish__year': 2017, 'publish__month': 3})
+        self.assertEqual(set(response.context['cl'].result_list), set(self.posts[1:3]))
+        self.assertEqual([choice['title'] for choice in response.context['choices']], ['March 10'])
+        response = self.client.get('/admin/blog/post/', {'publish__year': 2017, 'publish__month': 3,
+                                                         'publish__day': 11})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+        response = self.client.get('/admin/blog/post/', {'publish__year': 2017, 'publish__month': 13})
+        self.assertRedirects(response, '/admin/blog/post/?e=1', fetch_redirect_response=False)
+
+    @override_settings(BLOG_ADMIN_INLINE_IMAGES=1)
+    def test_image_inline(self):
+        post = self.posts[0]
+        PostImage.objects.create(post=post, image=make_image('foo.jpg', 10, 10),
+                                 image_title='test0', image_author='someone')
+        response = self.client.get('/admin/blog/post/{}/change/'.format(post.pk))
+        self.assertContains(response, 'postimage_set-TOTAL_FORMS')
+        self.assertContains(response, '1 image<')
+        PostImage.objects.create(post=post, image=make_image('bar.jpg', 10, 10),
+                                 image_title='test1', image_author='someone')
+        response = self.client.get('/admin/blog/post/{}/change/'.format(post.pk))
+        self.assertNotContains(response, 'postimage_set-TOTAL_FORMS')
+        self.assertContains(response, '/admin/blog/postimage/?post__id__exact={}'.format(post.pk))
+        response = self.client.get('/admin/blog/postimage/', {'post__id__exact': post.pk})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+
 class ContactFormTest(TestCase):
     """Testing contact form."""
     """
@@ -208,6 +346,7 @@ class ContactFormTest(TestCase):
         self.assertTrue(error_occured)
 
 
+@temporary_media_root
 class PostDetailTest(TestCase):
 
     def setUp(self):
@@ -235,6 +374,7 @@ class PostDetailTest(TestCase):
         should return 404."""
         self.post.status = 'draft'
         self.post.save()
+        run_commit_hooks()
 
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 404)
@@ -301,3 +441,1511 @@ class TestLatestPostsFeed(TestCase):
         self.assertNumQueries(1)
 
 
+class PageCacheTest(TestCase):
+    """Testing versioned full-page cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.c = Client()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.post = Post.objects.create(title='Test this', slug='test-this', body='Test',
+                                        author=self.user, status='published')
+
+    def test_second_request_is_served_from_cache(self):
+        first = self.c.get(reverse('blog:post_list'))
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            second = self.c.get(reverse('blog:post_list'))
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(first.content, second.content)
+
+    def test_version_never_expires_on_file_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': cache_dir}}):
+            version = get_content_version()
+            bump_content_version()
+            bump_content_version()
+            later = time.time() + 60 * 60 * 24
+            with mock.patch('django.core.cache.backends.filebased.time.time', return_value=later):
+                self.assertEqual(get_content_version(), version + 2)
+
+    def test_page_number_is_part_of_the_key(self):
+        self.c.get(reverse('blog:post_list'))
+        response = self.c.get(reverse('blog:post_list'), {'page': 2})
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        # Unknown parameters must not create new entries
+        response = self.c.get(reverse('blog:post_list'), {'utm_source': 'x'})
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    def test_saving_post_invalidates_cache(self):
+        self.c.get(reverse('blog:post_list'))
+        version = get_content_version()
+        self.post.title = 'Changed title'
+        self.post.save()
+        self.assertEqual(get_content_version(), version)
+        run_commit_hooks()
+        self.assertGreater(get_content_version(), version)
+        response = self.c.get(reverse('blog:post_list'))
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Changed title')
+
+    def test_tagging_post_invalidates_cache(self):
+        self.c.get(reverse('blog:post_list'))
+        self.post.tags.add('django')
+        run_commit_hooks()
+        response = self.c.get(reverse('blog:post_list'))
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'django')
+
+    @override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        self.c.get(reverse('blog:post_list'))
+        response = self.c.get(reverse('blog:post_list'))
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_stale_entry_is_served_while_another_request_refreshes(self):
+        response = self.c.get(reverse('blog:post_list'))
+        key = make_page_key(response.wsgi_request, views.post_list.key_params)
+        entry = cache.get(key)
+        entry['expires'] = 0
+        cache.set(key, entry)
+        # Pretend another worker is already re-rendering the page
+        cache.add(key + ':lock', True)
+        with self.assertNumQueries(0):
+            response = self.c.get(reverse('blog:post_list'))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0, BLOG_PUBLIC_CACHE_MAX_AGE=0)
+class PostListQueryCountTest(TestCase):
+    """The number of queries must not grow with posts or tags per page."""
+
+    def setUp(self):
+        self.c = Client()
+
+    def create_posts(self, number_of_posts, number_of_tags):
+        for post_num in range(Post.objects.count(), Post.objects.count() + number_of_posts):
+            user = User.objects.create_user(username='user{}'.format(post_num))
+            post = Post.objects.create(title='Test', slug='test{}'.format(post_num), body='Test',
+                                       author=user, status='published')
+            post.tags.add(*['tag{}'.format(tag_num) for tag_num in range(number_of_tags)])
+
+    def test_post_list_query_budget(self):
+        # posts with authors, tags
+        self.create_posts(1, 1)
+        with self.assertNumQueries(2):
+            self.c.get(reverse('blog:post_list'))
+        self.create_posts(5, 4)
+        with self.assertNumQueries(2):
+            self.c.get(reverse('blog:post_list'))
+
+    def test_post_list_by_tag_query_budget(self):
+        # tag, posts with authors, tags
+        self.create_posts(1, 1)
+        with self.assertNumQueries(3):
+            self.c.get(reverse('blog:post_list_by_tag', args=['tag0']))
+        self.create_posts(5, 4)
+        with self.assertNumQueries(3):
+            self.c.get(reverse('blog:post_list_by_tag', args=['tag0']))
+
+    @override_settings(BLOG_PAGINATION='offset')
+    def test_offset_pagination_query_budget(self):
+        # count, posts with authors, tags
+        self.create_posts(5, 4)
+        with self.assertNumQueries(3):
+            self.c.get(reverse('blog:post_list'))
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0, BLOG_PAGINATION='keyset')
+class KeysetPaginationTest(TestCase):
+    """Testing cursor based pagination of the post list."""
+
+    def setUp(self):
+        self.c = Client()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        publish = timezone.now()
+        # 12 posts, two of them sharing the same publish date
+        self.posts = [Post.objects.create(title='Test {}'.format(post_num), slug='test{}'.format(post_num),
+                                          body='Test', author=self.user, status='published',
+                                          publish=publish - timezone.timedelta(days=post_num // 2 * 2))
+                      for post_num in range(12)]
+        self.expected = list(Post.published.order_by('-publish', '-id'))
+
+    def test_walk_forward_and_back(self):
+        paginator = KeysetPaginator(Post.published.all(), 5)
+        page = paginator.first_page()
+        seen = list(page)
+        self.assertFalse(page.has_previous())
+        while page.has_next():
+            page = paginator.page_after(page.next_cursor)
+            seen.extend(page)
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(len(page), 2)
+        page = paginator.page_before(page.previous_cursor)
+        self.assertEqual(list(page), self.expected[5:10])
+
+    def test_no_count_query(self):
+        response = self.c.get(reverse('blog:post_list'))
+        cursor = response.context['posts'].next_cursor
+        with self.assertNumQueries(2):
+            response = self.c.get(reverse('blog:post_list'), {'after': cursor})
+        self.assertEqual(list(response.context['posts']), self.expected[5:10])
+        self.assertContains(response, '?after=')
+        self.assertContains(response, '?before=')
+
+    def test_old_page_links_still_work(self):
+        response = self.c.get(reverse('blog:post_list'), {'page': 2})
+        self.assertEqual(list(response.context['posts']), self.expected[5:10])
+        self.assertEqual(response.context['posts'].next_cursor, encode_cursor(self.expected[9]))
+        # If page is out of range, deliver oldest posts
+        response = self.c.get(reverse('blog:post_list'), {'page': 9999})
+        self.assertEqual(list(response.context['posts']), self.expected[7:])
+        self.assertFalse(response.context['posts'].has_next())
+        response = self.c.get(reverse('blog:post_list'), {'page': 10 ** 20})
+        self.assertEqual(list(response.context['posts']), self.expected[7:])
+
+    def test_invalid_cursor_delivers_first_page(self):
+        response = self.c.get(reverse('blog:post_list'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['posts']), self.expected[:5])
+        huge = '{}|{}'.format(self.expected[0].publish.isoformat(), 2 ** 63)
+        response = self.c.get(reverse('blog:post_list'),
+                              {'after': base64.urlsafe_b64encode(huge.encode()).decode()})
+        self.assertEqual(list(response.context['posts']), self.expected[:5])
+
+
+class SummaryProjectionTest(TestCase):
+    """Lists, feeds and sitemaps don't load post bodies."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='test', password='test')
+        self.post = Post.objects.create(title='Summary post', slug='summary-post', author=self.user,
+                                        body='<p>{}</p>'.format('long body ' * 500), status='published')
+        self.post.tags.add('python')
+
+    def assertNoBodyLoaded(self, queries):
+        selects = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT') and 'FROM "blog_post"' in query['sql']]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertNotIn('"blog_post"."body', sql)
+
+    def test_summary_defers_body(self):
+        post = Post.published.summary().get(pk=self.post.pk)
+        self.assertEqual(post.get_deferred_fields(), {'body', 'body_html'})
+        self.assertEqual(post.title, 'Summary post')
+
+    def test_views(self):
+        for url in (reverse('blog:post_list'), reverse('blog:post_feed'),
+                    reverse('blog:post_feed_by_tag', args=['python']), reverse('blog:post_search') + '?q=summary'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, 'Summary post')
+            self.assertNoBodyLoaded(queries)
+        shard = (self.post.pk - 1) // sitemaps.shard_size()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('sitemap_posts', args=[shard]))
+            self.assertIn(self.post.slug, b''.join(response.streaming_content).decode())
+        self.assertNoBodyLoaded(queries)
+
+    def test_projection_benchmark(self):
+        report = benchmark.projection_memory(body_sizes=(10, 10000))
+        small, large = report['body_sizes'][10], report['body_sizes'][10000]
+        for name in ('post_list', 'feed', 'sitemap'):
+            self.assertEqual(small[name]['summary']['fetched_bytes'], large[name]['summary']['fetched_bytes'])
+            self.assertGreater(large[name]['full']['fetched_bytes'], small[name]['full']['fetched_bytes'] + 10000)
+        self.assertIn('long body', Post.objects.get(pk=self.post.pk).body)
+
+
+@temporary_media_root
+class PostDetailLookupTest(TestCase):
+    """post_detail matches the publish day as a datetime range."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.post = Post.objects.create(title='Test this', slug='test-this', body='Test', author=self.user,
+                                        status='published',
+                                        publish=timezone.make_aware(timezone.datetime(2017, 5, 11, 23, 59)))
+        PostImage.objects.create(post=self.post, image=make_image('foo.jpg', 10, 10),
+                                 image_title='test0', image_author='someone')
+
+    def test_day_boundaries(self):
+        response = self.client.get('/2017/05/11/test-this/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/2017/05/12/test-this/').status_code, 404)
+        self.assertEqual(self.client.get('/2017/05/10/test-this/').status_code, 404)
+
+    def test_invalid_date(self):
+        self.assertEqual(self.client.get('/2017/02/31/test-this/').status_code, 404)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite specific')
+class PostIndexQueryPlanTest(TestCase):
+    """The public queries must be answered from the composite indexes."""
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+    def test_published_list_uses_status_publish_index(self):
+        plan = self.query_plan(Post.published.order_by('-publish', '-id')[:6])
+        self.assertIn('blog_post_status_publish_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_detail_lookup_uses_slug_publish_index(self):
+        day_start = timezone.make_aware(timezone.datetime(2017, 5, 11))
+        plan = self.query_plan(Post.objects.filter(slug='test-this', status='published',
+                                                   publish__gte=day_start,
+                                                   publish__lt=day_start + timezone.timedelta(days=1)))
+        self.assertIn('blog_post_slug_publish_idx', plan)
+
+
+class PostDerivedFieldsTest(TestCase):
+    """Body derived fields are computed once when a post is saved."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+
+    def test_fields_computed_on_save(self):
+        body = '<p>{}</p>'.format(' '.join(['word'] * 450))
+        post = Post.objects.create(title='Test', slug='test', body=body, author=self.user)
+        self.assertEqual(post.word_count, 450)
+        self.assertEqual(post.reading_time, 3)
+        self.assertEqual(post.excerpt, ' '.join(['word'] * 30) + ' ...')
+        self.assertEqual(post.body_html, body)
+
+    def test_body_html_is_sanitized(self):
+        post = Post.objects.create(title='Test', slug='test', author=self.user,
+                                   body='<p onclick="steal()">Hi <a href="javascript:alert(1)">there</a></p>'
+                                        '<script>alert(1)</script><pre><code>a &lt; b</code></pre>')
+        self.assertEqual(post.body_html, '<p>Hi <a>there</a></p><pre><code>a &lt; b</code></pre>')
+        self.assertEqual(post.excerpt, 'Hi there a < b')
+
+    def test_only_allowed_markup_is_kept(self):
+        payloads = {
+            '<iframe srcdoc="<script>alert(1)</script>"></iframe>': '<iframe></iframe>',
+            '<iframe src="javascript:alert(1)"></iframe>': '<iframe></iframe>',
+            '<iframe src="data:text/html,x"></iframe>': '<iframe></iframe>',
+            '<svg><a><animate attributeName="href" values="javascript:alert(1)"/>'
+            '<set attributeName="href" to="javascript:alert(1)"/></a></svg>': '',
+            '<math><mi xlink:href="javascript:alert(1)">x</mi></math>': '',
+            '<a href=" java&#x09;script:alert(1)">x</a>': '<a>x</a>',
+            '<img src="x.png" onerror="alert(1)">': '<img src="x.png">',
+            '<p style="background: url(javascript:alert(1))">x</p>': '<p>x</p>',
+            '<form action="/x"><button formaction="/y">Go</button></form>': 'Go',
+        }
+        for body, html in payloads.items():
+            self.assertEqual(render_post_body(body).html, html, body)
+        body = ('<p style="text-align: center">A <a href="/about/" target="_blank">link</a></p>'
+                '<iframe src="https://www.youtube.com/embed/x" width="560" allowfullscreen></iframe>'
+                '<table border="1"><tbody><tr><td colspan="2">Cell</td></tr></tbody></table>')
+        self.assertEqual(render_post_body(body).html, body)
+
+    def test_feed_uses_excerpt(self):
+        post = Post.objects.create(title='Test', slug='test', body='<p>Feed <b>text</b></p>',
+                                   author=self.user, status='published')
+        self.assertEqual(feeds.LatestPostFeed().item_description(post), 'Feed text')
+
+    def test_backfill_command(self):
+        post = Post.objects.create(title='Test', slug='test', body='<p>One two three</p>', author=self.user)
+        Post.objects.filter(pk=post.pk).update(body_html='', excerpt='', word_count=0, reading_time=0)
+        call_command('backfill_post_fields', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>One two three</p>')
+        self.assertEqual(post.word_count, 3)
+        self.assertEqual(post.reading_time, 1)
+
+
+
+@temporary_media_root
+class CodeHighlightTest(TestCase):
+    """Code snippets are highlighted on the server when a post is saved."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.body = ('<pre><code class="language-python">if a &lt; b:\n    print("<b>hi</b>")</code></pre>'
+                     '<pre><code class="language-nosuch"><script>x</script>a &amp; b</code></pre>')
+
+    def test_highlighted_on_save(self):
+        post = Post.objects.create(title='Test', slug='test', body=self.body, author=self.user,
+                                   status='published')
+        self.assertIn('<code class="language-python"><span style="color: #008000; font-weight: bold">if</span>',
+                      post.body_html)
+        self.assertIn('&lt;', post.body_html)
+        self.assertNotIn('<b>', post.body_html)
+        # Unknown language: text only, markup inside the block stays escaped or dropped
+        self.assertIn('<code class="language-nosuch">xa &amp; b</code>', post.body_html)
+        self.assertEqual(post.excerpt, 'if a < b: print("hi") xa & b')
+        self.assertEqual(search.search('print')[0].post, post)
+
+    def test_rehighlight_command(self):
+        post = Post.objects.create(title='Test', slug='test', body=self.body, author=self.user)
+        Post.objects.filter(pk=post.pk).update(body_html='')
+        version = get_content_version()
+        with override_settings(BLOG_CODE_STYLE='monokai'):
+            call_command('rehighlight_posts', workers=1, stdout=StringIO())
+        run_commit_hooks()
+        post.refresh_from_db()
+        self.assertIn('<span style="color: #66d9ef">if</span>', post.body_html)
+        self.assertNotEqual(get_content_version(), version)
+
+    def test_no_highlighter_script(self):
+        post = Post.objects.create(title='Test', slug='test', body=self.body, author=self.user,
+                                   status='published')
+        PostImage.objects.create(post=post, image=make_image('header.jpg', 40, 30),
+                                 image_title='Header', image_author='Me')
+        response = self.client.get(post.get_absolute_url())
+        self.assertNotContains(response, 'hljs')
+        self.assertNotContains(response, 'highlight.pack.js')
+
+
+class StubVerifierHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the reCAPTCHA siteverify endpoint."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        token = parse_qs(self.rfile.read(length).decode()).get('response', [''])[0]
+        self.server.clients.add(self.client_address)
+        if token == 'slow':
+            time.sleep(0.5)
+        body = json.dumps({'success': token == 'good'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server that accepts and stores every message."""
+
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply(b'220 localhost SMTP sink')
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    data.append(data_line)
+                self.server.messages.append(b''.join(data))
+                self.reply(b'250 OK')
+                if getattr(self.server, 'idle_timeout', False):
+                    # Hang up without a word, as after an idle timeout
+                    break
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                break
+            else:
+                self.reply(b'250 OK')
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The client gave up on a slow response
+        pass
+
+
+class ContactPipelineTest(TestCase):
+    """Contact form verifies over a pooled connection and queues mail."""
+
+    def setUp(self):
+        self.verifier = ThreadingServer(('127.0.0.1', 0), StubVerifierHandler)
+        self.verifier.clients = set()
+        self.smtp = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPSinkHandler)
+        self.smtp.daemon_threads = True
+        self.smtp.connections = 0
+        self.smtp.messages = []
+        for server in (self.verifier, self.smtp):
+            threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        verify_url = 'http://127.0.0.1:{}/recaptcha/api/siteverify'.format(self.verifier.server_port)
+        self.settings_override = override_settings(RECAPTCHA_VERIFY_URL=verify_url,
+                                                   RECAPTCHA_TIMEOUT=0.2,
+                                                   EMAIL_HOST='127.0.0.1',
+                                                   EMAIL_PORT=self.smtp.server_address[1],
+                                                   EMAIL_HOST_USER='',
+                                                   EMAIL_HOST_PASSWORD='',
+                                                   EMAIL_USE_TLS=False)
+        self.settings_override.enable()
+        self.form_data = {'name': 'Test', 'email': 'test@test.com', 'subject': 'Hello',
+                          'message': 'Test message', 'g-recaptcha-response': 'good'}
+
+    def tearDown(self):
+        self.settings_override.disable()
+        recaptcha.close_connection()
+        for server in (self.verifier, self.smtp):
+            server.shutdown()
+            server.server_close()
+
+    def test_verification_reuses_connection(self):
+        self.assertTrue(recaptcha.verify('good'))
+        self.assertFalse(recaptcha.verify('bad'))
+        self.assertTrue(recaptcha.verify('good'))
+        self.assertEqual(len(self.verifier.clients), 1)
+
+    def test_verification_timeout(self):
+        started = time.time()
+        with self.assertLogs('blog.recaptcha', 'WARNING'):
+            self.assertFalse(recaptcha.verify('slow'))
+        self.assertLess(time.time() - started, 0.5)
+        # Next call gets a fresh connection
+        self.assertTrue(recaptcha.verify('good'))
+
+    def test_contact_queues_message(self):
+        response = self.client.post(reverse('contact'), self.form_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        outbox_message = OutboxMessage.objects.get()
+        self.assertEqual(outbox_message.subject, 'Hello')
+        self.assertIn('Test message', outbox_message.body)
+
+    def test_contact_rejected_by_verifier(self):
+        self.form_data['g-recaptcha-response'] = 'bad'
+        self.client.post(reverse('contact'), self.form_data)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_header_injection(self):
+        self.assertRaises(BadHeaderError, queue_mail, 'Header\nInjection', 'Message',
+                          'from@example.com', ['to@example.com'])
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+    def test_outbox_delivered_over_one_connection(self):
+        for num in range(3):
+            queue_mail('Subject {}'.format(num), 'Message', 'from@example.com', ['to@example.com'])
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertFalse(OutboxMessage.objects.filter(sent__isnull=True).exists())
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                       BLOG_OUTBOX_RETRY_DELAY=30)
+    def test_failed_delivery_is_retried_with_backoff(self):
+        outbox_message = queue_mail('Subject', 'Message', 'from@example.com', ['to@example.com'])
+        # Nothing listens on port 1
+        with self.settings(EMAIL_PORT=1), self.assertLogs('blog.mail', 'WARNING'):
+            self.assertEqual(deliver_outbox(), 0)
+        outbox_message.refresh_from_db()
+        self.assertEqual(outbox_message.attempts, 1)
+        self.assertIsNone(outbox_message.sent)
+        self.assertGreater(outbox_message.next_attempt, timezone.now() + timezone.timedelta(seconds=25))
+        # Not due yet
+        self.assertEqual(deliver_outbox(), 0)
+        OutboxMessage.objects.update(next_attempt=timezone.now())
+        self.assertEqual(deliver_outbox(), 1)
+        self.assertEqual(len(self.smtp.messages), 1)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+    def test_dropped_connection_is_reopened(self):
+        self.smtp.idle_timeout = True
+        queue_mail('First', 'Message', 'from@example.com', ['to@example.com'])
+        queue_mail('Second', 'Message', 'from@example.com', ['to@example.com'])
+        self.assertEqual(deliver_outbox(), 2)
+        self.assertEqual(self.smtp.connections, 2)
+        self.assertEqual(list(OutboxMessage.objects.values_list('attempts', flat=True)), [1, 1])
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+    def test_message_is_sent_by_one_worker(self):
+        first = queue_mail('First', 'Message', 'from@example.com', ['to@example.com'])
+        second = queue_mail('Second', 'Message', 'from@example.com', ['to@example.com'])
+        claim = mail_utils.claim
+
+        def claim_after_other_worker(outbox_message):
+            if outbox_message.pk == first.pk:
+                # Another worker, which listed the same rows, leases the second one
+                self.assertTrue(claim(OutboxMessage.objects.get(pk=second.pk)))
+            return claim(outbox_message)
+        with mock.patch.object(mail_utils, 'claim', side_effect=claim_after_other_worker):
+            self.assertEqual(deliver_outbox(), 1)
+        self.assertEqual(len(self.smtp.messages), 1)
+        self.assertIsNone(OutboxMessage.objects.get(pk=second.pk).sent)
+
+
+class SearchTestMixin(object):
+    """Search behaviour shared by both index backends."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.in_title = Post.objects.create(title='Python generators', slug='a', author=self.user,
+                                            body='<p>Lazy sequences explained.</p>', status='published')
+        self.in_body = Post.objects.create(title='Iterators', slug='b', author=self.user,
+                                           body='<p>Every generator in Python is an iterator.</p>',
+                                           status='published')
+        self.draft = Post.objects.create(title='Python draft', slug='c', author=self.user,
+                                         body='<p>Python</p>', status='draft')
+        self.tagged = Post.objects.create(title='Unrelated', slug='d', author=self.user,
+                                          body='<p>Nothing here</p>', status='published')
+        self.tagged.tags.add('python')
+
+    def test_ranking_and_drafts(self):
+        results = [result.post for result in search.search('python')]
+        self.assertEqual(results[0], self.in_title)
+        self.assertIn(self.in_body, results)
+        self.assertIn(self.tagged, results)
+        self.assertNotIn(self.draft, results)
+
+    def test_all_words_must_match(self):
+        results = [result.post for result in search.search('python iterator')]
+        self.assertEqual(results, [self.in_body])
+
+    def test_snippet_highlights_match(self):
+        result = search.search('iterator')[0]
+        self.assertIn('<mark>iterator</mark>', result.snippet)
+
+    def test_queries_dont_grow_with_results(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(search.search('python')), 3)
+        for n in range(5):
+            Post.objects.create(title='Python {}'.format(n), slug='python-{}'.format(n), author=self.user,
+                                body='<p>More Python</p>', status='published')
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(len(search.search('python')), 8)
+
+    def test_index_follows_saves(self):
+        self.in_body.body = '<p>Rewritten</p>'
+        self.in_body.save()
+        self.assertEqual(len(search.search('iterator')), 0)
+        self.in_title.delete()
+        self.assertEqual([result.post for result in search.search('generators')], [])
+
+    def test_cursor_pagination(self):
+        first = search.search('python', per_page=2)
+        self.assertTrue(first.has_next())
+        second = search.search('python', per_page=2, cursor=first.next_cursor)
+        self.assertFalse(second.has_next())
+        seen = [result.post for result in first] + [result.post for result in second]
+        self.assertEqual(set(seen), {self.in_title, self.in_body, self.tagged})
+
+    def test_search_view(self):
+        response = self.client.get(reverse('blog:post_search'), {'q': 'generators'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Python generators')
+        response = self.client.get(reverse('blog:post_search'), {'q': 'python', 'after': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.login(username='test', password='test')
+        response = self.client.get('/admin/blog/post/', {'q': 'python'})
+        self.assertEqual(set(response.context['cl'].result_list),
+                         {self.in_title, self.in_body, self.draft, self.tagged})
+
+
+def sqlite_has_fts5():
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(a)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+@skipUnless(sqlite_has_fts5(), 'SQLite FTS5 not available')
+@override_settings(BLOG_SEARCH_BACKEND='fts5')
+class FTS5SearchTest(SearchTestMixin, TestCase):
+    pass
+
+
+@override_settings(BLOG_SEARCH_BACKEND='python')
+class PythonSearchTest(SearchTestMixin, TestCase):
+    pass
+
+
+@override_settings(BLOG_SITEMAP_SHARD_SIZE=2)
+class ShardedSitemapTest(TestCase):
+    """Sitemap index with streamed, conditionally served shards."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.posts = [Post.objects.create(title='Test', slug='test{}'.format(post_num), body='Test',
+                                          author=self.user, status='published')
+                      for post_num in range(5)]
+        self.posts[4].status = 'draft'
+        self.posts[4].save()
+        self.shards = [pk_shard for pk_shard in sorted({(post.pk - 1) // 2 for post in self.posts[:4]})]
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_index_lists_non_empty_shards(self):
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(response.status_code, 200)
+        content = self.content(response)
+        for shard in self.shards:
+            self.assertIn('/sitemap-posts-{}.xml</loc>'.format(shard), content)
+        self.assertEqual(content.count('<sitemap>'), len(self.shards))
+
+    def test_shard_contains_published_posts_only(self):
+        shard = (self.posts[0].pk - 1) // 2
+        response = self.client.get(reverse('sitemap_posts', args=[shard]))
+        self.assertTrue(response.streaming)
+        content = self.content(response)
+        for post in Post.published.filter(pk__gt=shard * 2, pk__lte=shard * 2 + 2):
+            self.assertIn(post.get_absolute_url(), content)
+        draft_shard = (self.posts[4].pk - 1) // 2
+        if draft_shard not in self.shards:
+            self.assertEqual(self.client.get(reverse('sitemap_posts', args=[draft_shard])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('sitemap_posts', args=[10 ** 20])).status_code, 404)
+
+    def test_conditional_get(self):
+        url = reverse('sitemap_posts', args=[(self.posts[0].pk - 1) // 2])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_update_changes_only_its_shard(self):
+        first = reverse('sitemap_posts', args=[(self.posts[0].pk - 1) // 2])
+        last = reverse('sitemap_posts', args=[(self.posts[3].pk - 1) // 2])
+        etags = {url: self.client.get(url)['ETag'] for url in (first, last)}
+        Post.objects.filter(pk=self.posts[3].pk).update(updated=timezone.now() + timezone.timedelta(seconds=5))
+        self.assertEqual(self.client.get(first, HTTP_IF_NONE_MATCH=etags[first]).status_code, 304)
+        self.assertEqual(self.client.get(last, HTTP_IF_NONE_MATCH=etags[last]).status_code, 200)
+
+
+class CachedFeedTest(TestCase):
+    """Feeds are cached, served conditionally and share invalidation."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.post = Post.objects.create(title='Test this', slug='test-this', body='<p>Feed body</p>',
+                                        author=self.user, status='published')
+        self.post.tags.add('django')
+        self.untagged = Post.objects.create(title='Untagged', slug='untagged', body='Test',
+                                            author=self.user, status='published')
+
+    def test_feed_is_cached(self):
+        first = self.client.get(reverse('blog:post_feed'))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('blog:post_feed'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertTrue(second.has_header('Last-Modified'))
+
+    def test_conditional_requests(self):
+        response = self.client.get(reverse('blog:post_feed'))
+        self.assertEqual(self.client.get(reverse('blog:post_feed'),
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('blog:post_feed'),
+                                         HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_invalidated_on_change(self):
+        etag = self.client.get(reverse('blog:post_feed'))['ETag']
+        self.post.title = 'New title'
+        self.post.save()
+        run_commit_hooks()
+        response = self.client.get(reverse('blog:post_feed'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'New title')
+
+    def test_atom_feed(self):
+        response = self.client.get(reverse('blog:post_feed_atom'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('application/atom+xml'))
+        self.assertContains(response, 'Feed body')
+
+    def test_tag_feeds(self):
+        for name in ('blog:post_feed_by_tag', 'blog:post_feed_atom_by_tag'):
+            response = self.client.get(reverse(name, args=['django']))
+            self.assertContains(response, 'Test this')
+            self.assertNotContains(response, 'Untagged')
+        self.assertEqual(self.client.get(reverse('blog:post_feed_by_tag', args=['missing'])).status_code, 404)
+
+
+@temporary_media_root
+@override_settings(BLOG_IMAGE_ASYNC=False, BLOG_IMAGE_WIDTHS=(100, 200, 400))
+class ImageDerivativeTest(TestCase):
+    """Resized copies of post images are generated on upload."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.post = Post.objects.create(title='Test this', slug='test-this', body='Test',
+                                        author=self.user, status='published')
+
+    @override_settings(BLOG_IMAGE_ASYNC=True)
+    def test_async_work_waits_for_commit(self):
+        submitted = []
+
+        class Executor(object):
+            def submit(self, *args):
+                submitted.append(args)
+                return Future()
+
+        with mock.patch('blog.images.get_executor', Executor):
+            with transaction.atomic():
+                PostImage.objects.create(post=self.post, image=make_image('header.jpg', 300, 150),
+                                         image_title='test', image_author='someone')
+                self.assertEqual(submitted, [])
+            run_commit_hooks()
+        self.assertEqual(len(submitted), 1)
+
+    def test_derivatives_generated_on_upload(self):
+        image = PostImage.objects.create(post=self.post, image=make_image('header.jpg', 300, 150),
+                                         image_title='test', image_author='someone')
+        self.assertEqual((image.width, image.height), (300, 150))
+        image.refresh_from_db()
+        jpegs = image.get_derivatives('jpg')
+        self.assertEqual([(d['width'], d['height']) for d in jpegs], [(100, 50), (200, 100)])
+        for derivative in image.get_derivatives():
+            with Image.open(default_storage.path(derivative['name'])) as resized:
+                self.assertEqual(resized.width, derivative['width'])
+
+    def test_orientation_and_transparency(self):
+        rotated = os.path.join(settings.MEDIA_ROOT, 'rotated.jpg')
+        exif = Image.Exif()
+        # Orientation: rotate 90 degrees clockwise to display
+        exif[0x0112] = 6
+        Image.new('RGB', (300, 150), (200, 100, 50)).save(rotated, 'JPEG', exif=exif.tobytes())
+        derivatives = images.render_derivatives(rotated, settings.MEDIA_ROOT, 'rotated', (100,), False)
+        self.assertEqual([(d['width'], d['height']) for d in derivatives], [(100, 200)])
+
+        transparent = os.path.join(settings.MEDIA_ROOT, 'transparent.png')
+        Image.new('RGBA', (300, 150), (0, 0, 0, 0)).save(transparent, 'PNG')
+        derivatives = images.render_derivatives(transparent, settings.MEDIA_ROOT, 'transparent', (100,),
+                                                images.webp_supported())
+        for derivative in derivatives:
+            with Image.open(os.path.join(settings.MEDIA_ROOT, derivative['file'])) as resized:
+                if derivative['format'] == 'jpg':
+                    self.assertEqual(resized.getpixel((50, 25)), (255, 255, 255))
+                else:
+                    self.assertEqual(resized.mode, 'RGBA')
+                    self.assertEqual(resized.getpixel((50, 25))[3], 0)
+
+    def test_replaced_image_gets_new_derivatives(self):
+        image = PostImage.objects.create(post=self.post, image=make_image('header.jpg', 300, 150),
+                                         image_title='test', image_author='someone')
+        image.refresh_from_db()
+        image.image = make_image('other.jpg', 150, 150)
+        image.save()
+        image.refresh_from_db()
+        self.assertEqual([d['width'] for d in image.get_derivatives('jpg')], [100])
+
+    def test_srcset_in_detail_page(self):
+        image = PostImage.objects.create(post=self.post, image=make_image('header.jpg', 300, 150),
+                                         image_title='test', image_author='someone')
+        image.refresh_from_db()
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, image.get_derivatives('jpg')[0]['name'])
+        self.assertContains(response, '(min-width: 101px)')
+
+    def test_backfill_command(self):
+        image = PostImage.objects.create(post=self.post, image=make_image('header.jpg', 300, 150),
+                                         image_title='test', image_author='someone')
+        PostImage.objects.filter(pk=image.pk).update(derivatives='')
+        call_command('build_image_derivatives', workers=2, stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(len(image.get_derivatives('jpg')), 2)
+
+
+class ContentAddressedStorageTest(TestCase):
+    """Uploads are named by content hash and never stored twice."""
+
+    def setUp(self):
+        self.storage = ContentAddressedStorage(location=tempfile.mkdtemp(), base_url='/media/')
+
+    def tearDown(self):
+        shutil.rmtree(self.storage.location)
+
+    def test_duplicate_content_is_stored_once(self):
+        first = self.storage.save('uploads/2017/05/11/a.png', ContentFile(b'same bytes'))
+        second = self.storage.save('uploads/2018/01/01/b.PNG', ContentFile(b'same bytes'))
+        third = self.storage.save('uploads/2018/01/01/c.png', ContentFile(b'other bytes'))
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first, 'uploads/{}/{}.png'.format(digest[:2], digest))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        files = [name for dirpath, dirnames, names in os.walk(self.storage.location) for name in names]
+        self.assertEqual(len(files), 2)
+
+    def test_large_upload_is_streamed_in_chunks(self):
+        upload = TemporaryUploadedFile('big.jpg', 'image/jpeg', 0, None)
+        content = os.urandom(1024) * 300
+        upload.write(content)
+        upload.flush()
+        name = self.storage.save('images/big.jpg', upload)
+        upload.close()
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), content)
+        self.assertIn(hashlib.sha256(content).hexdigest(), name)
+
+    def test_thumbnails_keep_their_name(self):
+        original = self.storage.save('uploads/2017/05/11/a.png', ContentFile(b'original'))
+        thumbnail = original.replace('.png', '_thumb.png')
+        self.assertEqual(self.storage.save(thumbnail, ContentFile(b'thumb')), thumbnail)
+        self.assertEqual(self.storage.save(thumbnail, ContentFile(b'thumb')), thumbnail)
+
+    def test_uploads_named_like_thumbnails_are_hashed(self):
+        first = self.storage.save('uploads/2017/05/11/logo_thumb.png', ContentFile(b'old logo'))
+        second = self.storage.save('uploads/2017/05/11/logo_thumb.png', ContentFile(b'new logo'))
+        self.assertEqual(second, 'uploads/{0[0]}{0[1]}/{0}.png'.format(hashlib.sha256(b'new logo').hexdigest()))
+        self.assertNotEqual(first, second)
+        # Without a stored original, a digest-like name is hashed too
+        orphan = 'uploads/{}/{}_thumb.png'.format('cd', 'cd' * 32)
+        self.assertNotEqual(self.storage.save(orphan, ContentFile(b'thumb')), orphan)
+
+
+@temporary_media_root
+class OrphanedMediaTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+
+    def test_orphans_are_found(self):
+        used = default_storage.save('uploads/2017/05/11/used.png', ContentFile(b'used'))
+        orphan = default_storage.save('uploads/2017/05/11/orphan.png', ContentFile(b'orphan'))
+        Post.objects.create(title='Test', slug='test', author=self.user,
+                            body='<p><img src="{}{}"></p>'.format(settings.MEDIA_URL, used))
+        out = StringIO()
+        call_command('find_orphaned_media', stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertNotIn(used, out.getvalue())
+        self.assertEqual(default_storage.path(used), os.path.join(settings.MEDIA_ROOT, used))
+        call_command('find_orphaned_media', delete=True, stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(used))
+
+
+@override_settings(BLOG_STATIC_BUNDLES={'css/site.css': ('vendor/lib/css/lib.css', 'css/theme.css'),
+                                        'js/site.js': ('vendor/lib/lib.js', 'js/theme.js')})
+class StaticBundleTest(TestCase):
+    """collectstatic bundles, hashes and precompresses the site assets."""
+
+    def setUp(self):
+        cache.clear()
+        self.storage = BundledManifestStaticFilesStorage(location=tempfile.mkdtemp(), base_url='/static/')
+        sources = {
+            'vendor/lib/css/lib.css': '.icon { background: url("../img/icon.png"); }\n'
+                                      '/*# sourceMappingURL=lib.css.map */',
+            'vendor/lib/img/icon.png': 'png',
+            'css/theme.css': 'body { font-family: serif; }\n' * 20,
+            'vendor/lib/lib.js': 'var lib = 1',
+            'js/theme.js': 'lib += 1;\n' * 50,
+        }
+        for name, content in sources.items():
+            self.storage.save(name, ContentFile(content.encode()))
+        self.paths = {name: (self.storage, name) for name in sources}
+
+    def tearDown(self):
+        shutil.rmtree(self.storage.location)
+
+    def test_bundles_are_hashed_and_compressed(self):
+        list(self.storage.post_process(self.paths))
+        css = self.storage.stored_name('css/site.css')
+        self.assertRegex(css, r'^css/site\.[0-9a-f]{12}\.css$')
+        with self.storage.open(css) as bundle:
+            content = bundle.read()
+        # url() rebased onto the bundle's directory, then hashed
+        self.assertIn(self.storage.stored_name('vendor/lib/img/icon.png').split('/')[-1].encode(), content)
+        self.assertIn(b'url("../vendor/lib/img/icon.', content)
+        self.assertNotIn(b'sourceMappingURL', content)
+        with self.storage.open(css + '.gz') as compressed:
+            self.assertEqual(gzip.decompress(compressed.read()), content)
+        self.assertEqual(self.storage.exists(css + '.br'), brotli is not None)
+        with self.storage.open(self.storage.stored_name('js/site.js')) as bundle:
+            self.assertIn(b'var lib = 1;\nlib += 1;', bundle.read())
+
+    def test_missing_source_is_reported(self):
+        del self.paths['vendor/lib/lib.js']
+        with self.assertRaisesRegex(ValueError, 'vendor/lib/lib.js'):
+            list(self.storage.post_process(self.paths))
+
+    def test_sources_are_linked_without_bundling_storage(self):
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, '<link rel="stylesheet" href="/static/css/theme.css">', html=True)
+        self.assertContains(response, '<script src="/static/vendor/lib/lib.js" defer></script>', html=True)
+        self.assertNotContains(response, 'code.jquery.com')
+
+    @override_settings(BLOG_STATIC_BUNDLES={'css/site.css': ('css/blog.css',),
+                                            'js/site.js': ('vendor/jquery/jquery.min.js', 'js/clean-blog.min.js')})
+    def test_missing_vendored_files_come_from_cdn(self):
+        with mock.patch('blog.templatetags.blog_tags.finders.find', return_value=None):
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, '<script src="https://code.jquery.com/jquery-3.2.1.min.js" '
+                                      'integrity="sha256-hwg4gsxgFZhOsEEamdOYGBf13FyQuiTwlAQgxVSNgt4=" '
+                                      'crossorigin="anonymous" defer></script>', html=True)
+        self.assertContains(response, '<script src="/static/js/clean-blog.min.js" defer></script>', html=True)
+        cache.clear()
+        with mock.patch('blog.templatetags.blog_tags.finders.find', return_value='/found'):
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, '<script src="/static/vendor/jquery/jquery.min.js" defer></script>', html=True)
+
+
+class TagStatTest(TestCase):
+    """Per-tag counts follow post and tag changes without request-time aggregation."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.post = Post.objects.create(title='First', slug='first', author=self.user, body='Body',
+                                        status='published')
+        self.post.tags.add('django', 'python')
+
+    def stats(self):
+        return dict(TagStat.objects.values_list('tag__name', 'post_count'))
+
+    def test_counts_follow_changes(self):
+        draft = Post.objects.create(title='Draft', slug='draft', author=self.user, body='Body')
+        draft.tags.add('django')
+        self.assertEqual(self.stats(), {'django': 1, 'python': 1})
+        draft.status = 'published'
+        draft.save()
+        self.assertEqual(self.stats(), {'django': 2, 'python': 1})
+        self.assertEqual(TagStat.objects.get(tag__name='django').latest_publish, draft.publish)
+        self.post.tags.remove('python')
+        self.assertEqual(self.stats(), {'django': 2})
+        draft.delete()
+        self.assertEqual(self.stats(), {'django': 1})
+
+    def test_tag_index_reads_stats(self):
+        # Looked up once per content version, to cap the page cache timeout
+        scheduling.next_scheduled_publish()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('blog:tag_index'))
+        self.assertContains(response, reverse('blog:post_list_by_tag', args=['django']))
+        self.assertTemplateUsed(response, 'blog/post/tags.html')
+
+    def test_tag_list_uses_direct_join(self):
+        response = self.client.get(reverse('blog:post_list_by_tag', args=['django']))
+        self.assertContains(response, 'First')
+        sql = str(Post.published.filter(tagged_items__tag__slug='django').query)
+        self.assertIn('blog_taggedpost', sql)
+        self.assertNotIn('django_content_type', sql)
+
+
+@temporary_media_root
+class BenchmarkTest(TestCase):
+    """The benchmark seeds a reproducible dataset and covers every route."""
+
+    def test_every_route_is_benchmarked(self):
+        benchmark.seed_dataset(posts=30, tags=8, images=1, seed=3)
+        call_command('rebuild_tag_stats', stdout=StringIO())
+        first = list(Post.objects.order_by('pk').values_list('title', 'status'))
+        report = benchmark.run(requests=2, warmup=0, host='testserver')
+        self.assertEqual(report['not_covered'], [])
+        self.assertEqual(report['dataset']['posts'], 30)
+        for route, result in report['routes'].items():
+            self.assertEqual(result['status'], 200, route)
+            self.assertEqual(set(result['latency_ms']), {'mean', 'p50', 'p95', 'p99', 'max'})
+
+        slower = json.loads(json.dumps(report))
+        slower['routes']['post_detail']['queries'] += 5
+        self.assertEqual(benchmark.compare(report, report), [])
+        self.assertEqual(len(benchmark.compare(slower, report)), 1)
+
+        # Same seed, same data
+        Post.objects.all().delete()
+        User.objects.filter(username=benchmark.BENCH_USERNAME).delete()
+        Tag.objects.all().delete()
+        benchmark.seed_dataset(posts=30, tags=8, images=1, seed=3)
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('title', 'status')), first)
+
+    def test_seeding_builds_derived_tables(self):
+        call_command('seed_benchmark_data', posts=20, tags=4, images=1, stdout=StringIO())
+        self.assertTrue(TagStat.objects.exists())
+        self.assertTrue(RelatedPost.objects.exists())
+
+
+@override_settings(MIDDLEWARE=['blog.middleware.PerformanceMiddleware'] + settings.MIDDLEWARE,
+                   BLOG_SLOW_REQUEST_MS=1000)
+class PerformanceMiddlewareTest(TestCase):
+    """Requests report their database, template, cache and HTTP time."""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        Post.objects.create(title='First', slug='first', author=user, body='Body', status='published')
+
+    def timing(self, response):
+        return dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('blog.performance', 'INFO') as logs:
+            response = self.client.get(reverse('blog:post_list'))
+        timing = self.timing(response)
+        self.assertIn('queries', timing['db'])
+        # The page itself and four chrome fragments
+        self.assertEqual(timing['cache'], 'desc="hit=0 miss=5"')
+        self.assertNotEqual(timing['tpl'], 'dur=0.0')
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(data['path'], reverse('blog:post_list'))
+        self.assertGreater(data['queries'], 0)
+        self.assertGreater(data['db_ms'], 0)
+        self.assertNotIn('sql', data)
+
+        with self.assertLogs('blog.performance', 'INFO'):
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertEqual(self.timing(response)['cache'], 'desc="hit=1 miss=0"')
+
+    def test_outbound_http_is_timed(self):
+        with socketserver.TCPServer(('127.0.0.1', 0), BaseHTTPRequestHandler) as closed:
+            port = closed.server_address[1]
+        data = {'name': 'Test', 'email': 'test@test.com', 'subject': 'Hello',
+                'message': 'Test message', 'g-recaptcha-response': 'good'}
+        with override_settings(RECAPTCHA_VERIFY_URL='http://127.0.0.1:{}/'.format(port)), \
+                self.assertLogs('blog.recaptcha', 'WARNING'), \
+                self.assertLogs('blog.performance', 'INFO'):
+            response = self.client.post(reverse('contact'), data)
+        recaptcha.close_connection()
+        self.assertIn('desc="1 calls"', self.timing(response)['http'])
+
+    @override_settings(BLOG_SLOW_REQUEST_MS=0.001)
+    def test_slow_requests_log_sql(self):
+        # The slow line propagates to blog.performance, next to the normal one
+        with self.assertLogs('blog.performance', 'INFO') as logs:
+            self.client.get(reverse('blog:post_list'))
+        slow = [record for record in logs.records if record.name == 'blog.performance.slow']
+        data = json.loads(slow[0].getMessage())
+        self.assertTrue(any('blog_post' in query['sql'] for query in data['sql']))
+
+
+class FragmentCacheTest(TestCase):
+    """Chrome fragments are rendered once per combination of their vary values."""
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, **context):
+        return Template('{% load blog_tags %}{% cachedfragment "test" number %}'
+                        '{{ number }} {{ other }}{% endcachedfragment %}').render(Context(context))
+
+    def test_fragment_is_cached_per_vary_value(self):
+        self.assertEqual(self.render(number=1, other='a'), '1 a')
+        self.assertEqual(self.render(number=1, other='b'), '1 a')
+        self.assertEqual(self.render(number=2, other='b'), '2 b')
+        with self.settings(BLOG_FRAGMENT_CACHE_TIMEOUT=0):
+            self.assertEqual(self.render(number=1, other='c'), '1 c')
+        # A new release renders its own fragments
+        with self.settings(BLOG_FRAGMENT_CACHE_VERSION='next'):
+            self.assertEqual(self.render(number=1, other='d'), '1 d')
+
+    def test_render_breakdown(self):
+        user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        Post.objects.create(title='First', slug='first', author=user, body='Body', status='published')
+        report = benchmark.render_breakdown(iterations=2)
+        for label in ('fragments_uncached', 'fragments_cached'):
+            self.assertEqual(set(report[label]['chrome_ms']), set(benchmark.CHROME_TEMPLATES))
+            self.assertGreater(report[label]['page_ms'], report[label]['chrome_total_ms'])
+
+
+@temporary_media_root
+class PostArchiveTest(TestCase):
+    """Posts survive an export and import round trip, and imports can be resumed."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.media_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.media_dir)
+
+    def test_export_by_status(self):
+        Post.objects.create(title='Later', slug='later', author=self.user, body='Later', status='published',
+                            publish=timezone.now() + timezone.timedelta(days=1))
+        Post.objects.create(title='Draft', slug='draft', author=self.user, body='Draft')
+        export = StringIO()
+        call_command('export_posts', '--status', 'scheduled', stdout=export, stderr=StringIO())
+        self.assertEqual([json.loads(line)['slug'] for line in export.getvalue().splitlines()], ['later'])
+
+    def test_round_trip(self):
+        post = Post.objects.create(title='Archived post', slug='archived', author=self.user,
+                                   body='<p>Python archive</p>', status='published')
+        post.tags.add('django', 'python')
+        PostImage.objects.create(post=post, image=make_image('header.jpg', 40, 30),
+                                 image_title='Header', image_author='Me')
+        Post.objects.create(title='Draft', slug='draft', author=self.user, body='Draft')
+        export = StringIO()
+        call_command('export_posts', media_dir=self.media_dir, stdout=export, stderr=StringIO())
+        self.assertEqual(len(export.getvalue().splitlines()), 2)
+        updated = Post.objects.get(slug='archived').updated
+
+        Post.objects.all().delete()
+        Tag.objects.all().delete()
+        lines = export.getvalue().splitlines(True)
+        # An import interrupted after the first post, then run again
+        archive.PostImporter().import_batch([json.loads(lines[0])])
+        importer = archive.PostImporter(FileSystemStorage(location=self.media_dir))
+        list(importer.run(lines, batch_size=1))
+        self.assertEqual((importer.imported, importer.skipped), (1, 1))
+
+        post = Post.objects.get(slug='archived')
+        self.assertEqual(post.updated, updated)
+        self.assertEqual(post.body_html, '<p>Python archive</p>')
+        self.assertEqual(sorted(post.tags.names()), ['django', 'python'])
+        self.assertEqual(PostImage.objects.get(post=post).width, 40)
+        self.assertEqual(dict(TagStat.objects.values_list('tag__name', 'post_count')),
+                         {'django': 1, 'python': 1})
+        self.assertEqual([result.post for result in search.search('archive')], [post])
+
+    def test_resumed_import_finishes_interrupted_one(self):
+        post = Post.objects.create(title='Archived post', slug='archived', author=self.user,
+                                   body='Archive', status='published')
+        post.tags.add('python')
+        other = Post.objects.create(title='Other post', slug='other', author=self.user,
+                                    body='Other', status='published')
+        other.tags.add('python')
+        export = StringIO()
+        call_command('export_posts', stdout=export, stderr=StringIO())
+
+        Post.objects.all().delete()
+        Tag.objects.all().delete()
+        lines = export.getvalue().splitlines(True)
+        # Every batch imported, then stopped before the final updates
+        archive.PostImporter().import_batch([json.loads(line) for line in lines])
+        self.assertFalse(TagStat.objects.exists())
+        version = get_content_version()
+        importer = archive.PostImporter()
+        list(importer.run(lines))
+        self.assertEqual((importer.imported, importer.skipped), (0, 2))
+        self.assertEqual(dict(TagStat.objects.values_list('tag__name', 'post_count')), {'python': 2})
+        self.assertEqual(RelatedPost.objects.count(), 2)
+        self.assertNotEqual(get_content_version(), version)
+
+
+@override_settings(BLOG_DATABASE_REPLICAS=['replica'], BLOG_PRIMARY_PATHS=['/admin/'])
+class ReplicaRouterTest(TestCase):
+    """Public reads go to a replica, writes and the reads after them to the primary."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        routers.reset()
+
+    def tearDown(self):
+        routers.reset()
+
+    def handle(self, request, write=False):
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(Post))
+            if write:
+                router.db_for_write(Post)
+                reads.append(router.db_for_read(Post))
+            return HttpResponse()
+        response = ReplicaPinningMiddleware(view)(request)
+        return reads, response
+
+    def test_routing(self):
+        self.assertEqual(router.db_for_read(Post), 'replica')
+        self.assertEqual(router.db_for_read(Tag), 'replica')
+        self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(router.db_for_read(Session), 'default')
+        self.assertEqual(router.db_for_write(Post), 'default')
+        # This thread wrote, it now reads its own writes
+        self.assertEqual(router.db_for_read(Post), 'default')
+        with override_settings(BLOG_DATABASE_REPLICAS=[]):
+            routers.reset()
+            self.assertEqual(router.db_for_read(Post), 'default')
+
+    def test_pages_cached_after_a_change_read_the_primary(self):
+        reads = []
+
+        @cache_page_versioned(key_params=())
+        def view(request):
+            reads.append(router.db_for_read(Post))
+            return HttpResponse()
+        cache.clear()
+        # No 'replica' database to look for scheduled posts in
+        with mock.patch('blog.scheduling.next_scheduled_publish', return_value=None):
+            view(RequestFactory().get('/fresh/'))
+            bump_content_version()
+            view(RequestFactory().get('/fresh/'))
+        self.assertEqual(reads, ['replica', 'default'])
+        self.assertEqual(router.db_for_read(Post), 'replica')
+
+    def test_requests_are_pinned_after_writes(self):
+        reads, response = self.handle(self.factory.get('/'))
+        self.assertEqual(reads, ['replica'])
+        self.assertNotIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        reads, response = self.handle(self.factory.get('/'), write=True)
+        self.assertEqual(reads, ['replica', 'default'])
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[ReplicaPinningMiddleware.cookie_name] = '1'
+        self.assertEqual(self.handle(request)[0], ['default'])
+        self.assertEqual(self.handle(self.factory.post('/contact/'))[0], ['default'])
+        self.assertEqual(self.handle(self.factory.get('/admin/blog/post/'))[0], ['default'])
+        # Nothing leaks into the next request
+        self.assertEqual(router.db_for_read(Post), 'replica')
+
+
+class ScheduledPublishingTest(TestCase):
+    """Future posts wait as scheduled until publish_scheduled publishes them."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.publish = timezone.now() + timezone.timedelta(hours=1)
+        self.post = Post.objects.create(title='Later', slug='later', author=self.user, body='Body',
+                                        status='published', publish=self.publish)
+        self.post.tags.add('django')
+
+    def test_future_post_is_scheduled(self):
+        self.assertEqual(self.post.status, 'scheduled')
+        self.assertFalse(Post.published.exists())
+        self.assertFalse(TagStat.objects.exists())
+        self.assertEqual(scheduling.next_scheduled_publish(), self.publish)
+        self.assertEqual(scheduling.cache_timeout(60 * 60 * 24, now=self.publish - timezone.timedelta(minutes=5)),
+                         301)
+        self.assertEqual(scheduling.cache_timeout(60, now=self.publish - timezone.timedelta(minutes=5)), 60)
+        # Due, waiting for the scheduler
+        self.assertEqual(scheduling.cache_timeout(60 * 15, now=self.publish + timezone.timedelta(seconds=5)),
+                         scheduling.scheduler_interval())
+
+    def test_publish_due(self):
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertNotContains(response, 'Later')
+        version = get_content_version()
+        self.assertEqual(scheduling.publish_due(), 0)
+        self.assertEqual(get_content_version(), version)
+
+        self.assertEqual(scheduling.publish_due(now=self.publish), 1)
+        run_commit_hooks()
+        self.assertNotEqual(get_content_version(), version)
+        self.assertEqual(Post.published.get().status, 'published')
+        self.assertEqual(Post.published.get().updated, self.publish)
+        self.assertEqual(TagStat.objects.get().post_count, 1)
+        self.assertIsNone(scheduling.next_scheduled_publish())
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, 'Later')
+
+    def test_command(self):
+        Post.objects.filter(pk=self.post.pk).update(publish=timezone.now())
+        with self.assertRaises(CommandError):
+            call_command('publish_scheduled', stdout=StringIO())
+        with override_settings(BLOG_PAGE_CACHE_TIMEOUT=0):
+            call_command('publish_scheduled', stdout=StringIO())
+        self.assertEqual(Post.published.count(), 1)
+        Post.objects.filter(pk=self.post.pk).update(status='scheduled')
+        call_command('publish_scheduled', force=True, stdout=StringIO())
+        self.assertEqual(Post.published.count(), 1)
+        Post.objects.filter(pk=self.post.pk).update(status='scheduled')
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': cache_dir}}):
+            out = StringIO()
+            call_command('publish_scheduled', stdout=out)
+        self.assertIn('Published 1 posts', out.getvalue())
+        self.assertEqual(Post.published.count(), 1)
+
+
+@temporary_media_root
+class RelatedPostTest(TestCase):
+    """Related posts by shared tags are kept up to date as posts change."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        self.first = self.create('first', 'django', 'python', 'web')
+        self.second = self.create('second', 'django', 'python')
+        self.third = self.create('third', 'python')
+        self.draft = self.create('draft', 'django', 'python', status='draft')
+
+    def create(self, slug, *tags, status='published'):
+        post = Post.objects.create(title=slug.title(), slug=slug, author=self.user, body='Body', status=status)
+        post.tags.add(*tags)
+        return post
+
+    def index(self):
+        return {post: [entry.related.slug for entry in RelatedPost.objects.filter(post__slug=post)]
+                for post in RelatedPost.objects.values_list('post__slug', flat=True).distinct()}
+
+    def assertIndexRebuilt(self):
+        # Tag weights drift between rebuilds, the order of close scores may change
+        index = {post: set(slugs) for post, slugs in self.index().items()}
+        related.rebuild(workers=1)
+        self.assertEqual({post: set(slugs) for post, slugs in self.index().items()}, index)
+
+    def test_incremental_updates(self):
+        self.assertEqual(self.index(), {'first': ['second', 'third'],
+                                        'second': ['first', 'third'],
+                                        'third': ['second', 'first']})
+        self.assertIndexRebuilt()
+
+        self.third.tags.add('django', 'web')
+        self.assertEqual(self.index()['first'], ['third', 'second'])
+        self.assertIndexRebuilt()
+
+        self.draft.status = 'published'
+        self.draft.save()
+        self.assertEqual(set(self.index()['draft']), {'first', 'second', 'third'})
+        self.assertIndexRebuilt()
+
+        self.second.delete()
+        self.assertNotIn('second', sum(self.index().values(), []))
+        self.assertIndexRebuilt()
+
+        self.first.status = 'trashed'
+        self.first.save()
+        self.assertEqual(self.index(), {'draft': ['third'], 'third': ['draft']})
+        self.assertIndexRebuilt()
+
+    def test_updated_once_per_change(self):
+        post = Post.objects.get(pk=self.third.pk)
+        with mock.patch.object(related, 'update_post', wraps=related.update_post) as update:
+            post.body = 'Edited body'
+            post.save()
+            self.assertEqual(update.call_count, 0)
+            post.tags.add('django', 'web', 'new')
+            self.assertEqual(update.call_count, 1)
+            post.tags.set('python')
+            self.assertEqual(update.call_count, 2)
+            update.reset_mock()
+            with related.deferred_updates():
+                post.status = 'draft'
+                post.save()
+                post.tags.set('django', 'python')
+            update.assert_called_once_with(post.pk)
+        self.assertIndexRebuilt()
+
+    def test_admin_save_updates_once(self):
+        User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        publish = timezone.localtime(self.third.publish)
+        data = {'title': 'Third', 'subtitle': 'Sub', 'slug': 'third', 'author': self.user.pk, 'body': 'Body',
+                'publish_0': publish.strftime('%Y-%m-%d'), 'publish_1': publish.strftime('%H:%M:%S'),
+                'status': 'published', 'tags': 'django, web',
+                'postimage_set-TOTAL_FORMS': 0, 'postimage_set-INITIAL_FORMS': 0,
+                'postimage_set-MIN_NUM_FORMS': 0, 'postimage_set-MAX_NUM_FORMS': 1000}
+        with mock.patch.object(related, 'update_post', wraps=related.update_post) as update:
+            response = self.client.post('/admin/blog/post/{}/change/'.format(self.third.pk), data)
+        self.assertEqual(response.status_code, 302)
+        update.assert_called_once_with(self.third.pk)
+        self.assertEqual(set(self.third.tags.names()), {'django', 'web'})
+        self.assertIndexRebuilt()
+
+    @override_settings(BLOG_RELATED_POSTS=1)
+    def test_only_top_entries_are_kept(self):
+        related.rebuild(workers=1)
+        self.assertEqual(self.index(), {'first': ['second'], 'second': ['first'], 'third': ['second']})
+        self.third.tags.add('django', 'web')
+        index = self.index()
+        self.assertEqual((index['first'], index['third']), (['third'], ['first']))
+
+    def test_rebuild_in_worker_processes(self):
+        index = self.index()
+        RelatedPost.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_related_posts', workers=2, stdout=out)
+        self.assertIn('3 posts', out.getvalue())
+        self.assertEqual(self.index(), index)
+
+    def test_detail_lists_related_posts(self):
+        PostImage.objects.create(post=self.first, image=make_image('header.jpg', 40, 30),
+                                 image_title='Header', image_author='Me')
+        response = self.client.get(self.first.get_absolute_url())
+        self.assertEqual([post.slug for post in response.context['related_posts']], ['second', 'third'])
+        self.assertContains(response, self.third.get_absolute_url())
+        self.assertNotContains(response, 'Draft')
+
+
+@temporary_media_root
+class PublicReadTest(TestCase):
+    """Anonymous reads of public pages skip sessions, CSRF and messages."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="test@test.com", password="test")
+        Post.objects.create(title='First', slug='first', author=self.user, body='Body', status='published')
+
+    def test_public_read(self):
+        response = self.client.get(reverse('blog:post_list'))
+        request = response.wsgi_request
+        self.assertTrue(request.public_read)
+        self.assertFalse(hasattr(request, 'session'))
+        self.assertFalse(request.user.is_authenticated)
+        self.assertFalse(response.has_header('Vary'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertFalse(response.cookies)
+        response = self.client.get(reverse('blog:post_feed'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+    def test_shared_cache_lifetime_ends_with_next_scheduled_post(self):
+        Post.objects.create(title='Later', slug='later', author=self.user, body='Body', status='published',
+                            publish=timezone.now() + timezone.timedelta(seconds=30))
+        max_age = int(self.client.get(reverse('blog:post_list'))['Cache-Control'].split('=')[1])
+        self.assertLessEqual(max_age, 31)
+
+    def test_other_requests_take_the_full_path(self):
+        response = self.client.get(reverse('contact'))
+        self.assertFalse(response.wsgi_request.public_read)
+        self.assertIn('csrftoken', response.cookies)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        self.client.login(username='test', password='test')
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertFalse(response.wsgi_request.public_read)
+        self.assertTrue(response.wsgi_request.user.is_authenticated)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_middleware_benchmark(self):
+        benchmark.seed_dataset(posts=10, tags=4, images=1, seed=3)
+        call_command('rebuild_tag_stats', stdout=StringIO())
+        report = benchmark.middleware_overhead(requests=5, host='testserver')
+        self.assertIn('post_detail', report['routes'])
+        self.assertNotIn('contact', report['routes'])
+        result = report['routes']['post_list']
+        self.assertIsNone(result['stock']['cache_control'])
+        self.assertEqual(result['lean']['cache_control'], 'public, max-age=60')
+
+
+class SQLiteProfileTest(TestCase):
+    """Testing the SQLite connection PRAGMAs and maintenance."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_pragmas_on_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_apply_pragmas_to_a_file(self):
+        db = sqlite3.connect(os.path.join(self.tmpdir, 'test.sqlite3'))
+        self.addCleanup(db.close)
+        applied = sqlite_profile.apply_pragmas(db.cursor())
+        self.assertEqual(applied['journal_mode'], 'wal')
+        self.assertEqual(applied['synchronous'], 1)
+        self.assertEqual(applied['cache_size'], -64000)
+        applied = sqlite_profile.apply_pragmas(db.cursor(), {'journal_mode': 'delete'})
+        self.assertEqual(applied['journal_mode'], 'delete')
+
+    def test_maintenance(self):
+        self.assertEqual(sqlite_profile.sqlite_aliases(), ['default'])
+        out = StringIO()
+        call_command('sqlite_maintenance', '--mode', 'PASSIVE', stdout=out)
+        self.assertIn('default:', out.getvalue())
+        with self.assertRaises(ValueError):
+            sqlite_profile.maintain(mode='EVERYTHING')
+
+    def test_benchmark_needs_a_file(self):
+        with self.assertRaises(ValueError):
+            benchmark.sqlite_concurrency(readers=1, writers=1, duration=0.1)
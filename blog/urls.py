@@ -1,6 +1,6 @@
 from django.conf.urls import url
 
-from .feeds import LatestPostFeed
+from .feeds import LatestPostFeed, AtomLatestPostFeed, TagPostFeed, AtomTagPostFeed
 from . import views
 
 
@@ -13,13 +13,33 @@ urlpatterns = [
         views.post_detail,
         name='post_detail'),
 
+    url(r'^tags/$',
+        views.tag_index,
+        name='tag_index'),
+
     url(r'^tag/(?P<tag_slug>[-\w]+)/$',
         views.post_list,
         name='post_list_by_tag'),
 
+    url(r'^search/$',
+        views.post_search,
+        name='post_search'),
+
     # Feeds
     url(r'^feed/$',
         LatestPostFeed(),
         name='post_feed'),
 
+    url(r'^feed/atom/$',
+        AtomLatestPostFeed(),
+        name='post_feed_atom'),
+
+    url(r'^tag/(?P<tag_slug>[-\w]+)/feed/$',
+        TagPostFeed(),
+        name='post_feed_by_tag'),
+
+    url(r'^tag/(?P<tag_slug>[-\w]+)/feed/atom/$',
+        AtomTagPostFeed(),
+        name='post_feed_atom_by_tag'),
+
 ]
@@ -1,74 +1,153 @@
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404
-from django.core.mail import send_mail, BadHeaderError
-from django.http import HttpResponse
+from django.core.mail import BadHeaderError
+from django.http import HttpResponse, Http404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib import messages
 from django.conf import settings
+from django.utils import timezone
 
-from .models import Post, PostImage
+from .models import Post, PostImage, RelatedPost
 from .forms import ContactForm
+from .cache import cache_page_versioned
+from .pagination import KeysetPaginator, InvalidCursor
+from .mail import queue_mail
+from .tagstats import tag_cloud
+from . import recaptcha, search, related
 
-# Google reCAPTCHA
-import urllib
-import json
+import datetime
 
 from taggit.models import Tag
 
 
+@cache_page_versioned(key_params=('page', 'after', 'before'))
 def post_list(request, tag_slug=None):
     """
     Displaying list of all posts with status published or
     posts tagged with a specific tag.
     """
-    object_list = Post.published.all()
+    # Authors are joined in and tags are fetched with one extra query
+    # for the whole page instead of one per post. Bodies aren't shown.
+    object_list = Post.published.summary()\
+                                .select_related('author')\
+                                .prefetch_related('tags')
     tag = None
 
     if tag_slug:
         # Retrieving Tag object with the given slug
         tag = get_object_or_404(Tag, slug=tag_slug)
-        # Filtering the list of posts with given tag
-        object_list = object_list.filter(tags__in=[tag])
+        # Filtering the list of posts with given tag, joining TaggedPost
+        # on its tag index
+        object_list = object_list.filter(tagged_items__tag=tag)
 
+    page = request.GET.get('page')
+    if getattr(settings, 'BLOG_PAGINATION', 'offset') == 'keyset':
+        posts = _keyset_page(request, object_list, page)
+    else:
+        posts = _offset_page(object_list, page)
+    return render(request,
+                  'blog/post/list.html',
+                  {'posts': posts,
+                   'page': page,
+                   'tag': tag})
+
+
+def _offset_page(object_list, page):
     #  Paginator a list of objects, plus the number of items to show on each page
     paginator = Paginator(object_list, 5)  # Show 5 posts per page
-
-    page = request.GET.get('page')
     try:
-        posts = paginator.page(page)
+        return paginator.page(page)
     except PageNotAnInteger:
         # If page is not an integer, deliver first page.
-        posts = paginator.page(1)
+        return paginator.page(1)
     except EmptyPage:
         #  # If page is out of range (e.g. 9999), deliver last page of results.
-        posts = paginator.page(paginator.num_pages)
+        return paginator.page(paginator.num_pages)
+
+
+def _keyset_page(request, object_list, page):
+    """
+    Seek-based pagination driven by opaque ?after= and ?before= cursors.
+    Old ?page=N links are still honoured.
+    """
+    paginator = KeysetPaginator(object_list, 5)  # Show 5 posts per page
+    try:
+        if request.GET.get('after'):
+            return paginator.page_after(request.GET['after'])
+        if request.GET.get('before'):
+            return paginator.page_before(request.GET['before'])
+    except InvalidCursor:
+        # If cursor is malformed, deliver first page.
+        return paginator.first_page()
+    try:
+        return paginator.page_number(int(page))
+    except (TypeError, ValueError):
+        return paginator.first_page()
+
+
+@cache_page_versioned(key_params=())
+def tag_index(request):
+    """
+    All tags with their number of published posts, read from the
+    TagStat table, as a tag cloud and an alphabetical list.
+    """
+    tags = tag_cloud()
     return render(request,
-                  'blog/post/list.html',
-                  {'posts': posts,
-                   'page': page,
-                   'tag': tag})
+                  'blog/post/tags.html',
+                  {'tags': tags})
 
 
+@cache_page_versioned(key_params=())
 def post_detail(request, year, month, day, post):
     """
     Post detail view takes year, month, day and slug parameters
     to retrieve a published post with requested slug, date and
     also corresponding post image.
     """
+    # Match the day as a half-open range on publish, so the lookup can
+    # use the (slug, publish) index instead of extracting date parts.
+    try:
+        day_start = timezone.make_aware(
+            datetime.datetime(int(year), int(month), int(day)))
+    except ValueError:
+        raise Http404('Invalid date')
     post = get_object_or_404(Post,
                              slug=post,
                              status='published',
-                             publish__year=year,
-                             publish__month=month,
-                             publish__day=day)
+                             publish__gte=day_start,
+                             publish__lt=day_start + datetime.timedelta(days=1))
     # Get post id
     post_pk = post.id
     # Get PostImage object
     images = PostImage.objects.get(post_id=post_pk)
+    # Precomputed by blog.related, one query on the (post, score) index
+    related_posts = [entry.related for entry in
+                     RelatedPost.objects.filter(post_id=post_pk)
+                                        .select_related('related')
+                                        .only('related__title', 'related__subtitle',
+                                              'related__slug', 'related__publish')
+                                        .order_by('-score')[:related.related_limit()]]
     return render(request,
                   'blog/post/detail.html',
                   {'post': post,
-                   'images': images})
+                   'images': images,
+                   'related_posts': related_posts})
+
+
+def post_search(request):
+    """
+    Ranked full-text search over published posts, paginated with
+    an opaque ?after= cursor.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        results = search.search(query, per_page=10, cursor=request.GET.get('after'))
+    except search.InvalidCursor:
+        results = search.search(query, per_page=10)
+    return render(request,
+                  'blog/post/search.html',
+                  {'query': query,
+                   'results': results})
 
 
 def about_page(request):
@@ -85,19 +164,11 @@ def contact(request):
         if form.is_valid():
             # Form fields passed validation
             # Begin reCAPTCHA validation
-            recaptcha_response = request.POST.get('g-recaptcha-response')
-            url = 'https://www.google.com/recaptcha/api/siteverify'
-            values = {
-                'secret': settings.GOOGLE_RECAPTCHA_SECRET_KEY,
-                'response': recaptcha_response
-            }
-            data = urllib.parse.urlencode(values).encode()
-            req = urllib.request.Request(url, data=data)
-            response = urllib.request.urlopen(req)
-            result = json.loads(response.read().decode())
+            recaptcha_passed = recaptcha.verify(request.POST.get('g-recaptcha-response'),
+                                                request.META.get('REMOTE_ADDR'))
             # End reCAPTCHA validation
 
-            if result['success']:
+            if recaptcha_passed:
                 # reCAPTCHA passed validation
                 name = form.cleaned_data['name']
                 from_email = form.cleaned_data['email']
@@ -107,11 +178,11 @@ def contact(request):
                                                                           form.cleaned_data['email'],
                                                                           form.cleaned_data['message'])
                 try:
-                    send_mail(subject,
-                              message,
-                              from_email,
-                              ['frombitstobytes.com@gmail.com'],
-                              fail_silently=False)
+                    # Delivered by the send_outbox worker
+                    queue_mail(subject,
+                               message,
+                               from_email,
+                               settings.BLOG_CONTACT_RECIPIENTS)
                     messages.success(request, 'Thank you! Your email was sent and '
                                               'I will get back to you as soon as I can.')
                     form = ContactForm()
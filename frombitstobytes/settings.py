@@ -14,6 +14,8 @@ ALLOWED_HOSTS = []
 
 # Sitemap
 SITE_ID = 1
+# Posts per sitemap shard (by primary key range)
+BLOG_SITEMAP_SHARD_SIZE = 1000
 
 # Application definition
 
@@ -28,7 +30,7 @@ INSTALLED_APPS = [
     'django.contrib.sites',
     'django.contrib.sitemaps',
     # Apps
-    'blog',
+    'blog.apps.BlogConfig',
     # Third-party application
     'coverage',
     'ckeditor',
@@ -37,23 +39,48 @@ INSTALLED_APPS = [
     'disqus',
 ]
 
+# Put 'blog.middleware.PerformanceMiddleware' first to get Server-Timing
+# headers and per-request timing logs, see BLOG_SLOW_REQUEST_MS below.
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Before the session middleware, so session writes pin the client too
+    'blog.middleware.ReplicaPinningMiddleware',
+    # Anonymous reads of BLOG_PUBLIC_VIEWS skip the Lean* middleware below
+    'blog.middleware.PublicReadMiddleware',
+    'blog.middleware.LeanSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'blog.middleware.LeanCsrfViewMiddleware',
+    'blog.middleware.LeanAuthenticationMiddleware',
+    'blog.middleware.LeanMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Pages served without session, CSRF token, user or messages to visitors
+# without a session cookie (URL names). Shared caches may keep them this
+# many seconds (0 leaves Cache-Control alone).
+BLOG_PUBLIC_VIEWS = [
+    'blog:post_list',
+    'blog:post_list_by_tag',
+    'blog:post_detail',
+    'blog:tag_index',
+    'blog:post_search',
+    'blog:post_feed',
+    'blog:post_feed_atom',
+    'blog:post_feed_by_tag',
+    'blog:post_feed_atom_by_tag',
+    'sitemap',
+    'sitemap_posts',
+    'about',
+]
+BLOG_PUBLIC_CACHE_MAX_AGE = 60
+
 ROOT_URLCONF = 'bitebybits.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to PerformanceMiddleware
+        'BACKEND': 'blog.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -61,12 +88,52 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compile every template once per worker process. In development
+            # templates are read again on every render, so edits show up.
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ] if DEBUG else [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
+# Site chrome (navigation, header, footer, pager) rendered with
+# {% cachedfragment %} is kept this many seconds (0 disables)
+BLOG_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# Part of every fragment key; set BLOG_RELEASE (e.g. to the git commit) on
+# each deploy so fragments of the previous templates aren't served
+BLOG_FRAGMENT_CACHE_VERSION = os.environ.get('BLOG_RELEASE', '')
+
 WSGI_APPLICATION = 'bitebybits.wsgi.application'
 
+# PerformanceMiddleware: send the numbers in a Server-Timing header, and log
+# requests slower than this many milliseconds with their SQL (0 disables)
+BLOG_SERVER_TIMING = True
+BLOG_SLOW_REQUEST_MS = 1000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'blog.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Database
 
@@ -74,9 +141,84 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Seconds a connection is reused across requests (0 closes it after
+        # every request, None keeps it open)
+        'CONN_MAX_AGE': 60,
+    },
+    # A read replica, for example a copy of db.sqlite3 to try it locally:
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    #     'CONN_MAX_AGE': 60,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+# Public content is read from these DATABASES aliases, everything else and
+# all writes use 'default'. Clients that wrote stay on 'default' for
+# BLOG_REPLICA_PIN_SECONDS; so do all requests under BLOG_PRIMARY_PATHS,
+# and cached pages rendered that long after any content change.
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+BLOG_DATABASE_REPLICAS = []
+BLOG_REPLICA_PIN_SECONDS = 5
+BLOG_PRIMARY_PATHS = ['/admin/', '/ckeditor/']
+
+# PRAGMAs run on every new SQLite connection (see blog/sqlite.py for the
+# defaults: WAL, synchronous=NORMAL, busy_timeout, cache_size, mmap_size).
+# {} leaves SQLite's defaults. Checkpoint the WAL with
+# `manage.py sqlite_maintenance --loop`.
+# BLOG_SQLITE_PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal'}
+
+
+# Cache
+
+# Cached pages, feeds and the content version that invalidates them must be
+# shared by every process: web workers, publish_scheduled and the other
+# commands. Use memcached or redis across machines; the file cache below
+# works on one. LocMemCache is per process, fine for runserver only.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    } if DEBUG else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        # Pages and feeds set their own timeouts. Culling deletes a third
+        # of the files at random, so keep MAX_ENTRIES well above the
+        # number of pages (old versions linger until they expire).
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
     }
 }
 
+# Full-page cache for post list and detail views (0 disables it).
+# Entries are served stale for up to BLOG_PAGE_CACHE_GRACE seconds while a
+# single request re-renders them.
+BLOG_PAGE_CACHE_TIMEOUT = 60 * 15
+BLOG_PAGE_CACHE_GRACE = 60
+BLOG_PAGE_CACHE_LOCK_TIMEOUT = 10
+BLOG_PAGE_CACHE_LOCK_WAIT = 2
+
+# RSS/Atom documents are cached until content changes, at most this long
+BLOG_FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Longest sleep of `publish_scheduled --loop`. Pages rendered once a post is
+# due but not yet published are cached at most this long.
+BLOG_SCHEDULER_INTERVAL = 60
+
+# Related posts shown under a post, by shared tags. Posts published on the
+# same day count twice; the bonus halves every BLOG_RELATED_HALF_LIFE_DAYS.
+BLOG_RELATED_POSTS = 5
+BLOG_RELATED_HALF_LIFE_DAYS = 365
+
+# Post list pagination: 'keyset' (?after=/?before= cursors, no COUNT or
+# OFFSET queries) or 'offset' (classic ?page=N).
+BLOG_PAGINATION = 'keyset'
+
+# Admin changelists count at most this many matches. Posts with more than
+# BLOG_ADMIN_INLINE_IMAGES images link to them instead of editing them inline.
+BLOG_ADMIN_COUNT_LIMIT = 1000
+BLOG_ADMIN_INLINE_IMAGES = 50
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -113,9 +255,34 @@ STATIC_URL = '/static/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
+# CSS and JS concatenated into one file each by collectstatic. Vendored
+# files come from `manage.py vendor_static`; in development, missing ones
+# are linked from their CDNs.
+BLOG_STATIC_BUNDLES = {
+    'css/site.css': (
+        'vendor/bootstrap/css/bootstrap.min.css',
+        'css/fonts.css',
+        'vendor/font-awesome/css/font-awesome.min.css',
+        'vendor/cookieconsent/cookieconsent.min.css',
+        'css/clean-blog.min.css',
+        'css/blog.css',
+    ),
+    'js/site.js': (
+        'vendor/jquery/jquery.min.js',
+        'vendor/bootstrap/js/bootstrap.min.js',
+        'vendor/cookieconsent/cookieconsent.min.js',
+        'js/clean-blog.min.js',
+    ),
+}
+if not DEBUG:
+    # Hashed file names (cached forever) plus .gz/.br copies for the web server
+    STATICFILES_STORAGE = 'blog.staticfiles.BundledManifestStaticFilesStorage'
+
 # Development only + url static
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# Uploads are named by content hash and stored once
+DEFAULT_FILE_STORAGE = 'blog.storage.ContentAddressedStorage'
 
 # CKEditor SETTINGS
 CKEDITOR_UPLOAD_PATH = 'uploads/'
@@ -133,6 +300,15 @@ CKEDITOR_CONFIGS = {
 }
 CKEDITOR_IMAGE_BACKEND = 'pillow'
 
+# Pygments style of code snippets, highlighted when a post is saved and
+# stored with inline styles; run `manage.py rehighlight_posts` after a change
+BLOG_CODE_STYLE = 'default'
+
+# Resized copies of post images, generated in a process pool on upload
+BLOG_IMAGE_WIDTHS = (480, 960, 1600)
+BLOG_IMAGE_ASYNC = True
+BLOG_IMAGE_WORKERS = 2
+
 # SMTP settings
 EMAIL_HOST = 'mail'
 EMAIL_HOST_USER = 'admin@example.com'
@@ -140,8 +316,20 @@ EMAIL_HOST_PASSWORD = 'password123'
 EMAIL_PORT = 123
 EMAIL_USE_TLS = True
 
+# Contact form messages are queued and delivered by `manage.py send_outbox`
+BLOG_CONTACT_RECIPIENTS = ['frombitstobytes.com@gmail.com']
+BLOG_OUTBOX_MAX_ATTEMPTS = 8
+# Seconds before the first retry, doubled on every further failure
+BLOG_OUTBOX_RETRY_DELAY = 30
+# Seconds a send_outbox worker holds a message it is sending; a worker that
+# dies meanwhile leaves it to the others after that
+BLOG_OUTBOX_LEASE = 60 * 5
+
 # Google reCAPTCHA secret key
 GOOGLE_RECAPTCHA_SECRET_KEY = 'SECRET_KEY'
+RECAPTCHA_VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+# Seconds to wait for the verification endpoint
+RECAPTCHA_TIMEOUT = 3
 
 # Message alert tag class working with bootstrap
 MESSAGE_TAGS = {
@@ -1,24 +1,21 @@
 from django.conf.urls import include, url
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
 from django.conf import settings
 from django.conf.urls.static import static
 
 from blog import views
-from blog.sitemaps import PostSitemap
-
-
-sitemaps = {
-    'posts': PostSitemap,
-}
+from blog.sitemaps import sitemap_index, sitemap_shard
 
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
 
-    # sitemap generator
-    url(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps},
-        name='django.contrib.sitemaps.views.sitemap'),
+    # sitemap index and its fixed-size post shards
+    url(r'^sitemap\.xml$', sitemap_index,
+        name='sitemap'),
+
+    url(r'^sitemap-posts-(?P<shard>\d+)\.xml$', sitemap_shard,
+        name='sitemap_posts'),
 
     url(r'^', include('blog.urls',
                       namespace='blog',